@@ -0,0 +1,154 @@
+#ADMISSION CONTROL
+#every request is put in a class (read, write, upload) and, before it runs:
+#   - takes a slot under the class's concurrency cap, else 503: a burst of uploads can't occupy the whole
+#     worker, reads keep their own slots while writes pile up
+#   - takes a token from its client's buckets for that class, else 429: one client can't flood votes or uploads.
+#     a signed in user pays from their own bucket and their address's, so neither new accounts nor new
+#     addresses get around the limit
+#both carry Retry-After. Counts are per worker process and in memory, like the response cache
+import math
+import os
+import time
+from collections import Counter, OrderedDict
+
+import jwt
+from dotenv import load_dotenv
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from fastapi_users.jwt import decode_jwt
+
+from auth.users import SECRET
+
+load_dotenv()
+
+ADMISSION_CONTROL = os.environ.get("ADMISSION_CONTROL", "1") == "1"
+#behind a reverse proxy every request comes from the proxy's address, X-Forwarded-For has the client's.
+#only turn this on when the proxy sets the header, otherwise clients pick their own bucket
+TRUST_FORWARDED_FOR = os.environ.get("TRUST_FORWARDED_FOR", "0") == "1"
+#buckets kept per class, the least recently seen clients are dropped (and start over with a full bucket)
+ADMISSION_MAX_CLIENTS = int(os.environ.get("ADMISSION_MAX_CLIENTS", 50_000))
+
+
+class RouteClass:
+    def __init__(self, name: str, rate: float, burst: float, concurrency: int):
+        prefix = f"ADMISSION_{name.upper()}"
+        self.name = name
+        #tokens per second per client, and how many can be spent at once
+        self.rate = float(os.environ.get(f"{prefix}_RATE", rate))
+        self.burst = float(os.environ.get(f"{prefix}_BURST", burst))
+        #requests of this class running at once in this worker
+        self.concurrency = int(os.environ.get(f"{prefix}_CONCURRENCY", concurrency))
+        self.in_flight = 0
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict() #client -> (tokens, updated)
+
+    def take(self, clients: list[str]) -> float:
+        """Spend a token from each of `clients`. Returns 0 if they all had one, else the seconds until they do.
+
+        Nothing is spent when one of them is empty, a rejected request doesn't cost the other bucket.
+        """
+        now = time.monotonic()
+        available = {}
+        for client in clients:
+            tokens, updated = self.buckets.pop(client, (self.burst, now))
+            available[client] = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = max(
+            ((1 - tokens) / self.rate if self.rate > 0 else 60.0 for tokens in available.values() if tokens < 1),
+            default=0.0,
+        )
+        for client, tokens in available.items():
+            self.buckets[client] = (tokens if wait else tokens - 1, now)
+        while len(self.buckets) > ADMISSION_MAX_CLIENTS:
+            self.buckets.popitem(last=False)
+        return wait
+
+
+CLASSES = {
+    "read": RouteClass("read", rate=20, burst=60, concurrency=200),
+    "write": RouteClass("write", rate=5, burst=30, concurrency=50),
+    #each one spools the file, stores it and queues a preview render
+    "upload": RouteClass("upload", rate=1 / 60, burst=3, concurrency=4),
+}
+
+#outcome per class: admitted, rate_limited, shed
+counters = Counter()
+
+
+def route_class(request: Request) -> RouteClass | None:
+    path = request.url.path
+    #live streams stay open for minutes and have their own cap (LIVE_MAX_SUBSCRIBERS), metrics are for the scraper
+    if path.startswith("/live/") or path in ("/metrics", "/cache/stats"):
+        return None
+    if path == "/posts/upload":
+        return CLASSES["upload"]
+    if request.method in ("GET", "HEAD", "OPTIONS"):
+        return CLASSES["read"]
+    return CLASSES["write"]
+
+
+def client_keys(request: Request) -> list[str]:
+    #everyone is limited by address, a signed in user also as themselves wherever they connect from.
+    #only the signature is checked, no database: a revoked token still just costs its owner's tokens
+    forwarded = request.headers.get("x-forwarded-for") if TRUST_FORWARDED_FOR else None
+    if forwarded:
+        keys = ["ip:" + forwarded.split(",")[0].strip()]
+    else:
+        keys = ["ip:" + (request.client.host if request.client else "unknown")]
+    authorization = request.headers.get("authorization", "")
+    if authorization[:7].lower() == "bearer ":
+        try:
+            keys.append("user:" + decode_jwt(authorization[7:], SECRET, ["fastapi-users:auth"])["sub"])
+        except (jwt.PyJWTError, KeyError):
+            pass
+    return keys
+
+
+def _reject(status: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        status_code=status,
+        content={"detail": detail},
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+async def admission_control(request: Request, call_next):
+    rc = route_class(request) if ADMISSION_CONTROL else None
+    if rc is None:
+        return await call_next(request)
+
+    #shed before charging the client, a request we turn away for being busy shouldn't cost them a token
+    if rc.in_flight >= rc.concurrency:
+        counters[(rc.name, "shed")] += 1
+        return _reject(503, "Server is busy, try again shortly", 1)
+    wait = rc.take(client_keys(request))
+    if wait:
+        counters[(rc.name, "rate_limited")] += 1
+        return _reject(429, "Too many requests, slow down", wait)
+
+    counters[(rc.name, "admitted")] += 1
+    rc.in_flight += 1
+    try:
+        return await call_next(request)
+    finally:
+        rc.in_flight -= 1
+
+
+def render_metrics() -> str:
+    lines = [
+        "# HELP peercv_admission_requests_total Requests by route class and admission outcome",
+        "# TYPE peercv_admission_requests_total counter",
+    ]
+    for (name, outcome), count in sorted(counters.items()):
+        lines.append(f'peercv_admission_requests_total{{class="{name}",outcome="{outcome}"}} {count}')
+    lines += [
+        "# HELP peercv_admission_in_flight Requests running per route class",
+        "# TYPE peercv_admission_in_flight gauge",
+    ]
+    for rc in CLASSES.values():
+        lines.append(f'peercv_admission_in_flight{{class="{rc.name}"}} {rc.in_flight}')
+    lines += [
+        "# HELP peercv_admission_concurrency_limit Concurrency cap per route class",
+        "# TYPE peercv_admission_concurrency_limit gauge",
+    ]
+    for rc in CLASSES.values():
+        lines.append(f'peercv_admission_concurrency_limit{{class="{rc.name}"}} {rc.concurrency}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,38 @@
+import uuid
+
+from sqlalchemy import select, update, union
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from data.db import Comments, Posts, User, author_snapshot
+from app.cache import comments_tag, response_cache
+
+#the User fields that end up in an author snapshot
+PROFILE_FIELDS = {"username", "profile_type", "organization", "program", "year_of_study", "job_title"}
+
+
+async def sync_author_snapshot(session: AsyncSession, user: User) -> set[uuid.UUID]:
+    """Rewrite the author snapshot on everything `user` wrote. Returns the post ids whose comments changed.
+    Caller commits."""
+    values = author_snapshot(user)
+    await session.execute(update(Posts).where(Posts.user_id == user.id).values(**values))
+    result = await session.execute(
+        update(Comments).where(Comments.user_id == user.id).values(**values).returning(Comments.post_id)
+    )
+    return set(result.scalars().all())
+
+
+async def invalidate_author(post_ids: set[uuid.UUID]):
+    await response_cache.invalidate("feed", "leaderboard", *(comments_tag(post_id) for post_id in post_ids))
+
+
+async def backfill_author_snapshots(conn: AsyncConnection):
+    #posts and comments written before the snapshot columns existed.
+    #the session joins the caller's transaction, which commits it
+    async with AsyncSession(bind=conn) as session:
+        stale_authors = union(
+            select(Posts.user_id).where(Posts.author_headline.is_(None)),
+            select(Comments.user_id).where(Comments.author_headline.is_(None)),
+        )
+        result = await session.execute(select(User).where(User.id.in_(stale_authors)))
+        for user in result.scalars().all():
+            await sync_author_snapshot(session, user)
@@ -0,0 +1,211 @@
+#EXPORT / IMPORT
+#copies users, posts, comments and ratings between databases as one NDJSON file per table, in bounded memory:
+#   python -m app.backup export backups/2026-10-17 [--gzip]
+#   python -m app.backup import backups/2026-10-17 [--on-conflict update]
+#run from backend/ with DATABASE_URL pointing at the source or target. Rows are streamed from a server side
+#cursor and written as they arrive, and loaded back in batches of INSERT ... ON CONFLICT, so an interrupted
+#import can simply be run again. The export includes password hashes, store it like the database itself.
+#search documents are rebuilt by the import and jobs aren't copied. Uploaded files live in storage, not here
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import sys
+import time
+import uuid
+from collections.abc import Iterator
+from datetime import datetime
+
+from sqlalchemy import DateTime, Select, Table, Uuid, func, literal, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from data.db import Comments, Posts, Rating, User, engine
+from app.migrations import applied_migrations, migrate
+from app.search import index_missing_documents
+from app.serialization import dumps
+
+#in foreign key order: a table only refers to the ones before it
+TABLES: list[Table] = [User.__table__, Posts.__table__, Comments.__table__, Rating.__table__]
+BATCH_SIZE = 1_000
+PROGRESS_SECONDS = 5
+
+
+class Progress:
+    def __init__(self, table: str, total: int | None = None):
+        self.table = table
+        self.total = total
+        self.rows = 0
+        self.started = time.perf_counter()
+        self._reported = self.started
+
+    def add(self, rows: int):
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self._reported >= PROGRESS_SECONDS:
+            self._reported = now
+            self.report()
+
+    def report(self, done: bool = False):
+        elapsed = time.perf_counter() - self.started
+        of = f"/{self.total}" if self.total is not None else ""
+        state = "done" if done else "..."
+        print(f"{self.table:<10} {self.rows}{of} rows  {self.rows / max(elapsed, 1e-9):,.0f} rows/s  {elapsed:.1f}s {state}", file=sys.stderr)
+
+
+def _export_query(table: Table) -> Select:
+    if table is not Comments.__table__:
+        return select(table).order_by(*table.primary_key)
+    #replies after the comment they answer, at any depth, so each one's parent is loaded before it.
+    #timestamps can't promise that (clock skew, imported data), the thread structure can
+    tree = (
+        select(Comments.id, literal(0).label("depth"))
+        .where(Comments.parent_id.is_(None))
+        .cte("tree", recursive=True)
+    )
+    tree = tree.union_all(select(Comments.id, tree.c.depth + 1).where(Comments.parent_id == tree.c.id))
+    return select(table).join(tree, tree.c.id == table.c.id).order_by(tree.c.depth, table.c.created_at, table.c.id)
+
+
+def _path(directory: str, table: str, compressed: bool) -> str:
+    return os.path.join(directory, f"{table}.ndjson" + (".gz" if compressed else ""))
+
+
+def _open(path: str, mode: str):
+    return gzip.open(path, mode) if path.endswith(".gz") else open(path, mode)
+
+
+async def export(directory: str, compressed: bool = False, batch_size: int = BATCH_SIZE, db: AsyncEngine = engine) -> dict[str, int]:
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    async with db.connect() as conn:
+        for table in TABLES:
+            total = await conn.scalar(select(func.count()).select_from(table))
+            progress = Progress(table.name, total)
+            #yield_per: a server side cursor on postgres, fetchmany on sqlite, never the whole table in memory
+            result = await conn.stream(_export_query(table).execution_options(yield_per=batch_size))
+            with _open(_path(directory, table.name, compressed), "wb") as out:
+                async for rows in result.mappings().partitions():
+                    out.write(b"".join(dumps(dict(row)) + b"\n" for row in rows))
+                    progress.add(len(rows))
+            progress.report(done=True)
+            counts[table.name] = progress.rows
+
+    applied = await applied_migrations(db)
+    manifest = {
+        "exported_at": datetime.utcnow().isoformat(),
+        "schema_version": max(applied, default=0),
+        "compressed": compressed,
+        "tables": counts,
+    }
+    with open(os.path.join(directory, "manifest.json"), "w") as out:
+        json.dump(manifest, out, indent=2)
+    return counts
+
+
+def _decoder(table: Table):
+    #json has no uuid or datetime, turn those columns back into python values
+    converters = {}
+    for column in table.columns:
+        if isinstance(column.type, Uuid):
+            converters[column.name] = uuid.UUID
+        elif isinstance(column.type, DateTime):
+            converters[column.name] = datetime.fromisoformat
+
+    def decode(line: bytes) -> dict:
+        row = json.loads(line)
+        for name, convert in converters.items():
+            if row.get(name) is not None:
+                row[name] = convert(row[name])
+        return row
+    return decode
+
+
+def _batches(path: str, table: Table, batch_size: int) -> Iterator[list[dict]]:
+    decode = _decoder(table)
+    known = set(table.columns.keys())
+    batch = []
+    with _open(path, "rb") as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            row = decode(line)
+            unknown = row.keys() - known
+            if unknown:
+                raise SystemExit(f"{path}: columns {sorted(unknown)} don't exist in {table.name}, migrate this database first")
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def _insert(table: Table, dialect_name: str, on_conflict: str):
+    insert = postgresql.insert if dialect_name == "postgresql" else sqlite.insert
+    stmt = insert(table)
+    if on_conflict == "update":
+        keys = [column.name for column in table.primary_key]
+        return stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={c.name: stmt.excluded[c.name] for c in table.columns if c.name not in keys},
+        )
+    return stmt.on_conflict_do_nothing()
+
+
+async def import_(directory: str, on_conflict: str = "skip", batch_size: int = BATCH_SIZE, db: AsyncEngine = engine) -> dict[str, int]:
+    with open(os.path.join(directory, "manifest.json")) as manifest_file:
+        manifest = json.load(manifest_file)
+    await migrate(db)
+    target_version = max(await applied_migrations(db), default=0)
+    if manifest["schema_version"] > target_version:
+        raise SystemExit(f"Export is from schema version {manifest['schema_version']}, this code only knows {target_version}")
+
+    counts = {}
+    for table in TABLES:
+        path = _path(directory, table.name, manifest["compressed"])
+        if not os.path.exists(path):
+            continue
+        progress = Progress(table.name, manifest["tables"].get(table.name))
+        stmt = _insert(table, db.dialect.name, on_conflict)
+        for rows in _batches(path, table, batch_size):
+            #a transaction per batch keeps locks and memory small; rerunning skips what already made it
+            async with db.begin() as conn:
+                await conn.execute(stmt, rows)
+            progress.add(len(rows))
+        progress.report(done=True)
+        counts[table.name] = progress.rows
+
+    async with db.begin() as conn:
+        await index_missing_documents(conn) #adds the search documents of the posts that came in
+    return counts
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Export or import users, posts, comments and ratings as NDJSON")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="write every table to DIRECTORY")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--gzip", action="store_true", help="compress the files")
+    import_parser = sub.add_parser("import", help="load an export into this database")
+    import_parser.add_argument("directory")
+    import_parser.add_argument("--on-conflict", choices=["skip", "update"], default="skip",
+                               help="rows whose key already exists: keep the existing row, or overwrite it")
+    for command_parser in (export_parser, import_parser):
+        command_parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.command == "export":
+        counts = await export(args.directory, args.gzip, args.batch_size)
+    else:
+        counts = await import_(args.directory, args.on_conflict, args.batch_size)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"{args.command}ed {total} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)", file=sys.stderr)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
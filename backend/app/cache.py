@@ -0,0 +1,124 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterable
+
+from dotenv import load_dotenv
+from fastapi import Request, Response
+
+from app.serialization import dumps
+
+load_dotenv()
+
+CACHE_TTL_SECONDS = int(os.environ.get("CACHE_TTL_SECONDS", 30))
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 5_000))
+#how long browsers may reuse a response before revalidating with If-None-Match
+CACHE_MAX_AGE_SECONDS = int(os.environ.get("CACHE_MAX_AGE_SECONDS", 5))
+
+
+class CacheBackend:
+    """What ResponseCache needs from a store. A shared store (e.g. redis GET / SET EX / INCR)
+    implements the same four methods so every worker sees the same entries and invalidations."""
+
+    async def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        raise NotImplementedError
+
+    async def get_counter(self, key: str) -> int:
+        raise NotImplementedError
+
+    async def incr(self, key: str) -> int:
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """In-process LRU with per entry TTL, only shared by requests on the same worker."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+        #counters live outside the LRU: evicting one would roll a tag back to a version with live entries
+        self._counters: dict[str, int] = {}
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: bytes, ttl: int):
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_counter(self, key: str) -> int:
+        return self._counters.get(key, 0)
+
+    async def incr(self, key: str) -> int:
+        self._counters[key] = self._counters.get(key, 0) + 1
+        return self._counters[key]
+
+
+class ResponseCache:
+    """Caches serialized JSON bodies of public GET endpoints.
+
+    Every entry is filed under one or more tags (e.g. "feed", "comments:<post_id>"). Each tag has a
+    version number that is part of the cache key, so invalidating a tag is one INCR and old entries
+    just stop being looked up until they expire.
+    """
+
+    def __init__(self, backend: CacheBackend, ttl: int):
+        self.backend = backend
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+    async def _key(self, request: Request, tags: Iterable[str]) -> str:
+        versions = [f"{tag}@{await self.backend.get_counter(f'tag:{tag}')}" for tag in tags]
+        query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+        return f"{request.url.path}?{query}|{','.join(versions)}"
+
+    async def respond(
+        self,
+        request: Request,
+        tags: Iterable[str],
+        build: Callable[[], Awaitable[object]], #json-ready content, see app/serialization.py
+    ) -> Response:
+        #the key is taken before building, so a write that lands mid-build can't get its stale result cached under the new version
+        key = await self._key(request, tags)
+        body = await self.backend.get(key)
+        if body is None:
+            self.stats["misses"] += 1
+            body = dumps(await build())
+            await self.backend.set(key, body, self.ttl)
+        else:
+            self.stats["hits"] += 1
+
+        headers = {
+            "ETag": f'"{hashlib.sha1(body).hexdigest()}"',
+            "Cache-Control": f"public, max-age={CACHE_MAX_AGE_SECONDS}",
+        }
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            self.stats["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    async def invalidate(self, *tags: str):
+        for tag in tags:
+            await self.backend.incr(f"tag:{tag}")
+            self.stats["invalidations"] += 1
+
+
+response_cache = ResponseCache(MemoryCache(CACHE_MAX_ENTRIES), CACHE_TTL_SECONDS)
+
+
+def comments_tag(post_id) -> str:
+    return f"comments:{post_id}"
@@ -0,0 +1,176 @@
+import uuid
+
+from sqlalchemy import literal, select, true, update, func
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from sqlalchemy.orm import aliased
+
+from data.db import Comments, Posts, ReadSessionLocal
+from data.schemas import CommentNode, CommentThreadPage
+from app.loader import BatchLoader
+from app.pagination import DEFAULT_PAGE_SIZE, encode_cursor, after_ascending
+from app.serialization import COMMENT_COLUMNS, comment_json
+
+#the first screen of a thread is bounded by these no matter how many comments a post has
+MAX_DEPTH = 5
+MAX_CHILDREN = 20
+#comments per post in a preview: the first page of GET /comments/{post_id}, oldest first
+COMMENT_PREVIEW_SIZE = DEFAULT_PAGE_SIZE
+
+
+def _node(comment: Comments) -> CommentNode:
+    return CommentNode(
+        post_id=comment.post_id,
+        body=comment.body,
+        id=comment.id,
+        parent_comment_id=comment.parent_id,
+        created_at=comment.created_at,
+        reply_count=comment.reply_count or 0,
+        owner=comment.owner
+    )
+
+
+def _thread_tree(
+    post_id: uuid.UUID,
+    parent_id: uuid.UUID | None,
+    cursor: str | None,
+    limit: int,
+    depth: int,
+    children: int,
+):
+    #ids and levels of the page's roots (limit + 1, the extra one says there is a next page) and, level by
+    #level down to `depth`, the oldest `children` + 1 replies of each comment already in the tree
+    roots = (
+        select(Comments.id)
+        .where(
+            Comments.post_id == post_id,
+            Comments.parent_id == parent_id if parent_id else Comments.parent_id.is_(None),
+        )
+        .order_by(Comments.created_at, Comments.id)
+        .limit(limit + 1)
+    )
+    if cursor:
+        roots = roots.where(after_ascending(Comments.created_at, Comments.id, cursor))
+    roots = roots.subquery() #sqlite takes no LIMIT directly before the UNION ALL
+    tree = select(roots.c.id, literal(1).label("level")).cte("tree", recursive=True)
+
+    #window functions aren't allowed in the recursive step (sqlite), so the cap per parent is a correlated
+    #ORDER BY ... LIMIT, served by ix_comments_parent_created
+    sibling = aliased(Comments)
+    first_replies = (
+        select(sibling.id)
+        .where(sibling.parent_id == tree.c.id)
+        .order_by(sibling.created_at, sibling.id)
+        .limit(children + 1)
+    )
+    return tree.union_all(
+        select(Comments.id, tree.c.level + 1)
+        .join(tree, Comments.parent_id == tree.c.id)
+        .where(tree.c.level < depth, Comments.id.in_(first_replies))
+    )
+
+
+async def load_threads(
+    session: AsyncSession,
+    post_id: uuid.UUID,
+    parent_id: uuid.UUID | None,
+    cursor: str | None,
+    limit: int,
+    depth: int,
+    children: int,
+) -> CommentThreadPage:
+    """One page of threads under `parent_id` (None for top level), each expanded `depth` levels deep.
+
+    A single query: a recursive CTE walks down from the page, every level capped at `children` replies
+    per comment. Anything cut off gets a `more_replies_cursor` for /comments/{post_id}/replies/{comment_id}.
+    """
+    tree = _thread_tree(post_id, parent_id, cursor, limit, depth, children)
+    position = func.row_number().over(
+        partition_by=Comments.parent_id,
+        order_by=(Comments.created_at, Comments.id),
+    ).label("position")
+    result = await session.execute(
+        select(Comments, tree.c.level, position)
+        .join(tree, tree.c.id == Comments.id)
+        .order_by(tree.c.level, Comments.parent_id, position)
+    )
+
+    nodes, shown = [], {}
+    next_cursor = None
+    #parents come before their replies and siblings oldest first
+    for comment, level, place in result.all():
+        if level == 1:
+            if place > limit:
+                next_cursor = encode_cursor(nodes[-1].created_at, nodes[-1].id)
+                continue
+            siblings = nodes
+        else:
+            parent = shown.get(comment.parent_id)
+            if parent is None:
+                continue #under a reply that was only fetched to tell there are more
+            if place > children:
+                parent.more_replies_cursor = encode_cursor(parent.replies[-1].created_at, parent.replies[-1].id)
+                continue
+            siblings = parent.replies
+        node = _node(comment)
+        siblings.append(node)
+        shown[node.id] = node
+
+    return CommentThreadPage(comments=nodes, next_cursor=next_cursor)
+
+
+async def _load_comment_previews(post_ids: list[uuid.UUID]) -> dict[uuid.UUID, dict]:
+    #one query per table for the whole batch: the counts, then the first comments of every post
+    async with ReadSessionLocal() as session:
+        counts = dict((await session.execute(
+            select(Posts.id, Posts.comment_count).where(Posts.id.in_(post_ids))
+        )).all())
+        #a correlated ORDER BY ... LIMIT per post reads only the comments shown off ix_comments_post_created,
+        #where ranking every comment of a post and keeping the first few reads all of them
+        if session.bind.dialect.name == "postgresql":
+            first = (
+                select(*COMMENT_COLUMNS)
+                .where(Comments.post_id == Posts.id)
+                .order_by(Comments.created_at, Comments.id)
+                .limit(COMMENT_PREVIEW_SIZE)
+                .lateral("first_comments")
+            )
+            query = select(first).select_from(Posts).join(first, true()).order_by(first.c.post_id, first.c.created_at, first.c.id)
+        else:
+            #no LATERAL in sqlite, it runs the IN list once per post and fetches those comments by id
+            earlier = aliased(Comments)
+            first = (
+                select(earlier.id)
+                .where(earlier.post_id == Posts.id)
+                .order_by(earlier.created_at, earlier.id)
+                .limit(COMMENT_PREVIEW_SIZE)
+            )
+            query = (
+                select(*COMMENT_COLUMNS)
+                .select_from(Posts)
+                .join(Comments, Comments.id.in_(first))
+                .order_by(Posts.id, Comments.created_at, Comments.id)
+            )
+        rows = (await session.execute(query.where(Posts.id.in_(list(counts))))).all()
+
+    previews = {post_id: {"post_id": post_id, "comment_count": count, "comments": []} for post_id, count in counts.items()}
+    for row in rows:
+        previews[row.post_id]["comments"].append(comment_json(row))
+    return previews
+
+
+#concurrent feed renders asking for the same posts share the queries (app/loader.py)
+comment_previews = BatchLoader(_load_comment_previews)
+
+
+async def backfill_reply_counts(conn: AsyncConnection):
+    #comments written before reply_count existed have it NULL
+    child = aliased(Comments)
+    await conn.execute(
+        update(Comments)
+        .where(Comments.reply_count.is_(None))
+        .values(reply_count=(
+            select(func.count())
+            .where(child.parent_id == Comments.id)
+            .scalar_subquery()
+        ))
+    )
@@ -0,0 +1,159 @@
+import logging
+import os
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+from fastapi import Request
+from sqlalchemy import event
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+#dev only: remembers every statement of a request to spot the same query being run in a loop
+DETECT_N_PLUS_ONE = os.environ.get("DETECT_N_PLUS_ONE", "0") == "1"
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("N_PLUS_ONE_THRESHOLD", 5))
+
+#upper bounds in seconds for the request latency histogram
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.shapes: Counter[str] | None = Counter() if DETECT_N_PLUS_ONE else None
+
+
+#set by the middleware for the duration of a request; statements run outside one (startup, background work) aren't attributed
+_current: ContextVar[RequestStats | None] = ContextVar("request_sql_stats", default=None)
+
+
+class Metrics:
+    """Process-wide totals, rendered in the Prometheus text format by /metrics."""
+
+    def __init__(self):
+        self.requests = Counter() #(method, route, status)
+        self.request_count = Counter() #(method, route)
+        self.request_seconds = defaultdict(float) #(method, route)
+        self.latency_buckets = defaultdict(lambda: [0] * len(LATENCY_BUCKETS)) #(method, route)
+        self.queries = Counter() #(method, route)
+        self.db_seconds = defaultdict(float) #(method, route)
+        self.slow_queries = 0
+        self.n_plus_one = Counter() #(method, route)
+
+    def observe(self, method: str, route: str, status: int, seconds: float, stats: RequestStats):
+        key = (method, route)
+        self.requests[(method, route, status)] += 1
+        self.request_count[key] += 1
+        self.request_seconds[key] += seconds
+        buckets = self.latency_buckets[key]
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+        self.queries[key] += stats.queries
+        self.db_seconds[key] += stats.db_seconds
+
+    def render(self) -> str:
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def labels(method, route, **extra):
+            pairs = {"method": method, "route": route, **extra}
+            return ",".join(f'{k}="{v}"' for k, v in pairs.items())
+
+        family("peercv_http_requests_total", "counter", "HTTP requests by route and status")
+        for (method, route, status), count in sorted(self.requests.items()):
+            lines.append(f"peercv_http_requests_total{{{labels(method, route, status=status)}}} {count}")
+
+        family("peercv_http_request_duration_seconds", "histogram", "Request latency by route")
+        for (method, route), buckets in sorted(self.latency_buckets.items()):
+            total = self.request_count[(method, route)]
+            for bound, count in zip(LATENCY_BUCKETS, buckets):
+                lines.append(f"peercv_http_request_duration_seconds_bucket{{{labels(method, route, le=bound)}}} {count}")
+            lines.append(f"peercv_http_request_duration_seconds_bucket{{{labels(method, route, le='+Inf')}}} {total}")
+            lines.append(f"peercv_http_request_duration_seconds_sum{{{labels(method, route)}}} {self.request_seconds[(method, route)]:.6f}")
+            lines.append(f"peercv_http_request_duration_seconds_count{{{labels(method, route)}}} {total}")
+
+        family("peercv_db_queries_total", "counter", "SQL statements executed while serving each route")
+        for (method, route), count in sorted(self.queries.items()):
+            lines.append(f"peercv_db_queries_total{{{labels(method, route)}}} {count}")
+
+        family("peercv_db_seconds_total", "counter", "Time spent in SQL statements while serving each route")
+        for (method, route), seconds in sorted(self.db_seconds.items()):
+            lines.append(f"peercv_db_seconds_total{{{labels(method, route)}}} {seconds:.6f}")
+
+        family("peercv_db_slow_queries_total", "counter", f"Statements slower than {SLOW_QUERY_MS:g}ms")
+        lines.append(f"peercv_db_slow_queries_total {self.slow_queries}")
+
+        family("peercv_db_n_plus_one_total", "counter", "Requests that repeated one statement shape (DETECT_N_PLUS_ONE=1)")
+        for (method, route), count in sorted(self.n_plus_one.items()):
+            lines.append(f"peercv_db_n_plus_one_total{{{labels(method, route)}}} {count}")
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def install_sql_hooks(engine):
+    """Time every statement on `engine` and charge it to the request running it."""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        stats = _current.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+            if stats.shapes is not None:
+                #statements are already parameterized, so the text is the shape
+                stats.shapes[statement] += 1
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            metrics.slow_queries += 1
+            logger.warning("Slow query (%.0fms): %s", elapsed * 1000, " ".join(statement.split())[:500])
+
+
+def _route_name(request: Request) -> str:
+    #the route template, not the raw path, so ids don't each get their own series. Built from the path
+    #parameters because route.path doesn't include the prefix of an included router on every FastAPI version
+    if "route" not in request.scope:
+        return "unmatched"
+    names = {str(value): name for name, value in request.path_params.items()}
+    return "/".join(f"{{{names[part]}}}" if part in names else part for part in request.url.path.split("/"))
+
+
+async def instrument_requests(request: Request, call_next):
+    stats = RequestStats()
+    token = _current.set(stats)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+    elapsed = time.perf_counter() - started
+
+    method, route = request.method, _route_name(request)
+    metrics.observe(method, route, response.status_code, elapsed, stats)
+
+    if stats.shapes:
+        repeated = [(statement, count) for statement, count in stats.shapes.items() if count >= N_PLUS_ONE_THRESHOLD]
+        for statement, count in repeated:
+            logger.warning("Possible N+1 on %s %s: %d x %s", method, route, count, " ".join(statement.split())[:300])
+        if repeated:
+            metrics.n_plus_one[(method, route)] += 1
+
+    #lets clients (and bench/) see what a request cost without access to the server's metrics
+    response.headers["Server-Timing"] = (
+        f'db;dur={stats.db_seconds * 1000:.2f};desc="{stats.queries} queries", total;dur={elapsed * 1000:.2f}'
+    )
+    return response
@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import uuid
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from data.db import Jobs, Posts, SearchDocuments, SessionLocal
+from app.cache import response_cache
+from app.leaderboard import recount_comments, refresh_hot_scores
+from app.live import event_bus
+from app.previews import build_preview
+from app.search import index_missing_comments
+from app.storage import storage
+from app.votes import reconcile_aggregates
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+#"0" when the worker runs as its own process (python -m app.jobs) instead of inside each web worker
+RUN_JOB_WORKER = os.environ.get("RUN_JOB_WORKER", "1") == "1"
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 2))
+JOB_BATCH_SIZE = int(os.environ.get("JOB_BATCH_SIZE", 10))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 8))
+JOB_BACKOFF_SECONDS = float(os.environ.get("JOB_BACKOFF_SECONDS", 5))
+JOB_MAX_BACKOFF_SECONDS = float(os.environ.get("JOB_MAX_BACKOFF_SECONDS", 3600))
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 300))
+#posts recounted per transaction by reconcile_ratings and recompute_hot_scores
+RECONCILE_BATCH_SIZE = int(os.environ.get("RECONCILE_BATCH_SIZE", 1_000))
+
+Handler = Callable[[dict], Awaitable[None]]
+_handlers: dict[str, Handler] = {}
+
+#set after a commit that enqueued something, so the in-process worker doesn't wait out its poll interval
+_wakeup = asyncio.Event()
+
+
+def handler(kind: str):
+    def register(fn: Handler) -> Handler:
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def enqueue(session: AsyncSession, kind: str, payload: dict, delay: float = 0):
+    """Add a job to the caller's transaction: it runs only if the caller commits. Call notify() after."""
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+    session.add(Jobs(kind=kind, payload=payload, run_at=datetime.utcnow() + timedelta(seconds=delay)))
+
+
+def notify():
+    _wakeup.set()
+
+
+def backoff(attempts: int) -> float:
+    #exponential with jitter, so jobs that failed together don't all retry together
+    delay = min(JOB_MAX_BACKOFF_SECONDS, JOB_BACKOFF_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def _claim(limit: int) -> list[Jobs]:
+    now = datetime.utcnow()
+    claimable = or_(
+        Jobs.status == "pending",
+        and_(Jobs.status == "running", Jobs.locked_until < now), #its worker died mid-job
+    )
+    async with SessionLocal() as session:
+        due = (
+            select(Jobs.id)
+            .where(claimable, Jobs.run_at <= now)
+            .order_by(Jobs.run_at)
+            .limit(limit)
+            .with_for_update(skip_locked=True) #postgres: concurrent workers take different rows; sqlite ignores it
+        )
+        #the claimable condition is repeated so two workers racing for the same rows can't both win them
+        result = await session.execute(
+            update(Jobs)
+            .where(Jobs.id.in_(due), claimable)
+            .values(status="running", attempts=Jobs.attempts + 1, locked_until=now + timedelta(seconds=JOB_LEASE_SECONDS))
+            .returning(Jobs)
+        )
+        jobs = result.scalars().all()
+        await session.commit()
+        return jobs
+
+
+async def _finish(job: Jobs, error: Exception | None):
+    async with SessionLocal() as session:
+        if error is None:
+            await session.execute(delete(Jobs).where(Jobs.id == job.id))
+        elif job.attempts >= JOB_MAX_ATTEMPTS:
+            #kept for inspection, nothing retries it
+            await session.execute(
+                update(Jobs).where(Jobs.id == job.id).values(status="failed", locked_until=None, last_error=repr(error))
+            )
+        else:
+            await session.execute(
+                update(Jobs)
+                .where(Jobs.id == job.id)
+                .values(
+                    status="pending",
+                    locked_until=None,
+                    last_error=repr(error),
+                    run_at=datetime.utcnow() + timedelta(seconds=backoff(job.attempts)),
+                )
+            )
+        await session.commit()
+
+
+async def _release(job: Jobs):
+    #back to pending as if never claimed: the attempt doesn't count and nobody waits out the lease
+    async with SessionLocal() as session:
+        await session.execute(
+            update(Jobs)
+            .where(Jobs.id == job.id, Jobs.status == "running")
+            .values(status="pending", attempts=Jobs.attempts - 1, locked_until=None)
+        )
+        await session.commit()
+
+
+async def _run(job: Jobs):
+    try:
+        await _handlers[job.kind](job.payload)
+    except asyncio.CancelledError:
+        #the worker is shutting down. If this fails too the lease still brings the job back
+        try:
+            await _release(job)
+        except Exception:
+            logger.exception("Could not release job %s", job.id)
+        raise
+    except Exception as e:
+        logger.warning("Job %s (%s) failed on attempt %d: %r", job.id, job.kind, job.attempts, e)
+        await _finish(job, e)
+    else:
+        await _finish(job, None)
+
+
+async def run_pending(limit: int = JOB_BATCH_SIZE) -> int:
+    """Run one batch of due jobs, returns how many were claimed."""
+    jobs = await _claim(limit)
+    await asyncio.gather(*(_run(job) for job in jobs))
+    return len(jobs)
+
+
+async def work_forever():
+    while True:
+        try:
+            #keep draining while there is a backlog, otherwise sleep until the next poll or a notify()
+            if await run_pending() == JOB_BATCH_SIZE:
+                continue
+        except Exception:
+            logger.exception("Job worker iteration failed")
+        _wakeup.clear()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), JOB_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+
+
+#HANDLERS
+#each one may run more than once (a retry after a timeout, a worker dying after the work but before
+#the delete), so they are written to be safe to repeat
+
+@handler("delete_file")
+async def _delete_file(payload: dict):
+    await storage.delete(payload["file_id"])
+
+
+@handler("build_preview")
+async def _build_preview(payload: dict):
+    """payload: post_id and the spooled copy of the upload (path, file_type, file_name).
+    The copy is a local temp file, so a worker running as its own process has to be on the same host."""
+    post_id = uuid.UUID(payload["post_id"])
+    path = payload["path"]
+    async with SessionLocal() as session:
+        exists = await session.get(Posts, post_id) is not None
+    if not exists:
+        #deleted before we got to it
+        if os.path.exists(path):
+            os.remove(path)
+        return
+
+    #no connection is held while the document renders
+    values = await build_preview(path, payload["file_type"], payload["file_name"])
+    if values:
+        async with SessionLocal() as session:
+            result = await session.execute(update(Posts).where(Posts.id == post_id).values(**values))
+            if result.rowcount == 0:
+                #deleted while the preview was rendering, don't leave its files behind
+                for file_id in (values.get("thumbnail_file_id"), values.get("preview_file_id")):
+                    if file_id:
+                        await storage.delete(file_id)
+            elif values.get("text_content"):
+                await session.execute(
+                    update(SearchDocuments).where(SearchDocuments.post_id == post_id).values(body=values["text_content"])
+                )
+            await session.commit()
+
+    if os.path.exists(path):
+        os.remove(path)
+    await response_cache.invalidate("feed", "leaderboard")
+    if values:
+        await event_bus.publish("posts", "post_updated", {
+            "post_id": post_id,
+            "page_count": values.get("page_count"),
+            "thumbnail_url": values.get("thumbnail_url"),
+            "preview_url": values.get("preview_url"),
+        })
+
+
+@handler("rebuild_comment_text")
+async def _rebuild_comment_text(payload: dict):
+    #comments are indexed as they are written and their documents cascade on delete, nothing enqueues this
+    #anymore. Kept for jobs queued before that, and as a repair: indexes any comment of the post that isn't
+    async with SessionLocal() as session:
+        await index_missing_comments(session, uuid.UUID(payload["post_id"]))
+        await session.commit()
+
+
+async def _post_id_batches(post_ids: list[uuid.UUID] | None):
+    if post_ids:
+        for i in range(0, len(post_ids), RECONCILE_BATCH_SIZE):
+            yield post_ids[i:i + RECONCILE_BATCH_SIZE]
+        return
+    #every post, walked in id order
+    last_id = None
+    while True:
+        stmt = select(Posts.id).order_by(Posts.id).limit(RECONCILE_BATCH_SIZE)
+        if last_id is not None:
+            stmt = stmt.where(Posts.id > last_id)
+        async with SessionLocal() as session:
+            batch = (await session.execute(stmt)).scalars().all()
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1]
+
+
+@handler("reconcile_ratings")
+async def _reconcile_ratings(payload: dict):
+    """payload: post_ids to recount, or none for every post. Recounts vote_count, rating_sum and the
+    histogram from ratings, RECONCILE_BATCH_SIZE posts per transaction so no lock is held for long."""
+    post_ids = [uuid.UUID(post_id) for post_id in payload.get("post_ids") or []]
+    corrected = 0
+    async for batch in _post_id_batches(post_ids):
+        async with SessionLocal() as session:
+            corrected += await reconcile_aggregates(session, batch)
+            await refresh_hot_scores(session, batch)
+            await session.commit()
+
+    if corrected:
+        #every write path keeps the counters exact, so anything found here is worth knowing about
+        logger.warning("Rating reconciliation corrected %d post(s)", corrected)
+        await response_cache.invalidate("feed", "leaderboard")
+
+
+@handler("recompute_hot_scores")
+async def _recompute_hot_scores(payload: dict):
+    """payload: post_ids, or none for every post. Recounts comment_count and recomputes hot_score.
+    Nothing needs it as time passes (see app/leaderboard.py), it's for after HOT_DECAY_SECONDS or
+    HOT_COMMENT_WEIGHT change, since every stored score was computed with the old values."""
+    post_ids = [uuid.UUID(post_id) for post_id in payload.get("post_ids") or []]
+    changed = 0
+    async for batch in _post_id_batches(post_ids):
+        async with SessionLocal() as session:
+            await recount_comments(session, batch)
+            changed += await refresh_hot_scores(session, batch)
+            await session.commit()
+
+    logger.info("Recomputed %d hot score(s)", changed)
+    if changed:
+        await response_cache.invalidate("feed")
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Run the background job worker")
+    parser.add_argument("--once", action="store_true", help="drain the jobs that are due now and exit")
+    parser.add_argument("--enqueue", metavar="KIND", help="add a job of this kind (e.g. reconcile_ratings) and exit")
+    parser.add_argument("--payload", default="{}", help="json payload for --enqueue")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.enqueue:
+        async with SessionLocal() as session:
+            enqueue(session, args.enqueue, json.loads(args.payload))
+            await session.commit()
+        return
+    if args.once:
+        while await run_pending():
+            pass
+        return
+    logger.info("Job worker started")
+    await work_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
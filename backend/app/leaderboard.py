@@ -0,0 +1,95 @@
+import math
+import os
+import uuid
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+from sqlalchemy import bindparam, case, func, select, update
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from data.db import Comments, Posts
+
+load_dotenv()
+
+#Bayesian average: every post starts with PRIOR_WEIGHT imaginary votes of PRIOR_MEAN,
+#so one 5 star vote can't beat 200 votes averaging 4.9
+PRIOR_MEAN = float(os.environ.get("LEADERBOARD_PRIOR_MEAN", 3.0))
+PRIOR_WEIGHT = float(os.environ.get("LEADERBOARD_PRIOR_WEIGHT", 5))
+
+#windows filter on when the post was submitted ("top this week"), so they stay index range scans
+WINDOWS = {
+    "week": timedelta(days=7),
+    "month": timedelta(days=30),
+    "all": None,
+}
+
+#"hot" feed, the reddit formula: log10 of the points plus the age bonus of a newer post. The time term
+#only depends on created_at, so the score is fixed until the next vote or comment and never has to be
+#swept as posts age: a post needs 10x the points to keep up with one posted HOT_DECAY_SECONDS later
+HOT_EPOCH = datetime(2024, 1, 1)
+HOT_DECAY_SECONDS = float(os.environ.get("HOT_DECAY_SECONDS", 45_000))
+#a 5 star vote is worth a point, a 1 star vote nothing, every comment HOT_COMMENT_WEIGHT
+HOT_COMMENT_WEIGHT = float(os.environ.get("HOT_COMMENT_WEIGHT", 0.5))
+
+
+def bayesian_score(total, count):
+    """Works on plain numbers and on SQL column expressions alike."""
+    return (PRIOR_WEIGHT * PRIOR_MEAN + total) / (PRIOR_WEIGHT + count)
+
+
+def rank_score_sql(total, count):
+    #0 until the first vote, like the column default, so unrated posts sort below every rated one
+    return case((count > 0, bayesian_score(total, count)), else_=0.0)
+
+
+def hot_score(rating_sum: int, vote_count: int, comment_count: int, created_at: datetime) -> float:
+    points = (rating_sum - vote_count) / 4 + HOT_COMMENT_WEIGHT * comment_count
+    return math.log10(1 + max(points, 0)) + (created_at - HOT_EPOCH).total_seconds() / HOT_DECAY_SECONDS
+
+
+async def refresh_hot_scores(conn: AsyncConnection | AsyncSession, post_ids: list[uuid.UUID] | None = None) -> int:
+    """Recompute hot_score of `post_ids` (every post if None) from their stored counters after a write
+    changed them. Only scores that moved are written, returns how many. Caller commits."""
+    stmt = select(Posts.id, Posts.rating_sum, Posts.vote_count, Posts.comment_count, Posts.created_at, Posts.hot_score)
+    if post_ids is not None:
+        stmt = stmt.where(Posts.id.in_(post_ids))
+    changed = []
+    for row in (await conn.execute(stmt)).all():
+        score = hot_score(row.rating_sum, row.vote_count, row.comment_count, row.created_at or HOT_EPOCH)
+        if not math.isclose(score, row.hot_score, rel_tol=0, abs_tol=1e-9):
+            changed.append({"hot_post_id": row.id, "hot": score})
+    if changed:
+        posts = Posts.__table__
+        await conn.execute(
+            update(posts).where(posts.c.id == bindparam("hot_post_id")).values(hot_score=bindparam("hot")),
+            changed,
+        )
+    return len(changed)
+
+
+def window_start(window: str) -> datetime | None:
+    delta = WINDOWS[window]
+    return datetime.utcnow() - delta if delta else None
+
+
+async def backfill_rank_scores(conn: AsyncConnection):
+    #posts that got votes before rank_score existed still carry the column default
+    await conn.execute(
+        update(Posts)
+        .where(Posts.vote_count > 0, Posts.rank_score == 0)
+        .values(rank_score=bayesian_score(Posts.average_rating * Posts.vote_count, Posts.vote_count))
+    )
+
+
+async def recount_comments(conn: AsyncConnection | AsyncSession, post_ids: list[uuid.UUID] | None = None):
+    """Set comment_count from the comments table, for `post_ids` or every post. Caller commits."""
+    counts = (
+        select(func.count())
+        .select_from(Comments)
+        .where(Comments.post_id == Posts.id)
+        .scalar_subquery()
+    )
+    stmt = update(Posts).where(Posts.comment_count != counts).values(comment_count=counts)
+    if post_ids is not None:
+        stmt = stmt.where(Posts.id.in_(post_ids))
+    await conn.execute(stmt)
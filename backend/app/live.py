@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+from collections import defaultdict
+from collections.abc import AsyncIterator, Callable, Iterable
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from data.db import Posts, PrimaryReadSessionLocal
+from app.serialization import HISTOGRAM_COLUMNS, dumps, histogram
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+#events buffered per connection; a client that falls this far behind is told to resync and dropped
+LIVE_QUEUE_SIZE = int(os.environ.get("LIVE_QUEUE_SIZE", 100))
+LIVE_MAX_SUBSCRIBERS = int(os.environ.get("LIVE_MAX_SUBSCRIBERS", 1_000))
+LIVE_HEARTBEAT_SECONDS = float(os.environ.get("LIVE_HEARTBEAT_SECONDS", 15))
+
+#channels: "post:<id>" (comments and votes on one post), "leaderboard" (vote totals), "posts" (new and deleted posts)
+RESYNC = b"event: resync\ndata: {}\n\n"
+
+
+def post_channel(post_id) -> str:
+    return f"post:{post_id}"
+
+
+class BroadcastBackend:
+    """Carries published events to every worker. A shared one (e.g. redis PUBLISH / PSUBSCRIBE)
+    implements the same two methods so a vote on one worker reaches clients connected to another."""
+
+    async def publish(self, channel: str, frame: bytes):
+        raise NotImplementedError
+
+    async def listen(self, deliver: Callable[[str, bytes], None]):
+        """Run until cancelled, calling deliver(channel, frame) for every event published by any worker."""
+        raise NotImplementedError
+
+
+class LocalBroadcast(BroadcastBackend):
+    """Single process: events go straight back to this worker's subscribers."""
+
+    def __init__(self):
+        self._deliver: Callable[[str, bytes], None] | None = None
+
+    async def publish(self, channel: str, frame: bytes):
+        if self._deliver:
+            self._deliver(channel, frame)
+
+    async def listen(self, deliver: Callable[[str, bytes], None]):
+        self._deliver = deliver
+        try:
+            await asyncio.Event().wait()
+        finally:
+            self._deliver = None
+
+
+class Subscriber:
+    def __init__(self, channels: tuple[str, ...]):
+        self.channels = channels
+        self.queue: asyncio.Queue[bytes] = asyncio.Queue(maxsize=LIVE_QUEUE_SIZE)
+        self.overflowed = False
+
+
+class EventBus:
+    def __init__(self, backend: BroadcastBackend):
+        self.backend = backend
+        self._subscribers: dict[str, set[Subscriber]] = defaultdict(set)
+        self._count = 0
+        self.stats = {"published": 0, "delivered": 0, "dropped_subscribers": 0}
+
+    async def publish(self, channel: str, event: str, data: dict):
+        #encoded once here, not once per subscriber
+        frame = b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+        self.stats["published"] += 1
+        try:
+            await self.backend.publish(channel, frame)
+        except Exception:
+            #live updates are best effort, the write they describe has already committed
+            logger.exception("Could not publish %s on %s", event, channel)
+
+    def deliver(self, channel: str, frame: bytes):
+        for subscriber in list(self._subscribers.get(channel, ())):
+            try:
+                subscriber.queue.put_nowait(frame)
+                self.stats["delivered"] += 1
+            except asyncio.QueueFull:
+                #never block a publisher on a slow reader: cut it loose, it refetches and reconnects
+                subscriber.overflowed = True
+                self._remove(subscriber)
+                self.stats["dropped_subscribers"] += 1
+
+    def full(self) -> bool:
+        return self._count >= LIVE_MAX_SUBSCRIBERS
+
+    def subscribe(self, channels: Iterable[str]) -> Subscriber:
+        subscriber = Subscriber(tuple(channels))
+        for channel in subscriber.channels:
+            self._subscribers[channel].add(subscriber)
+        self._count += 1
+        return subscriber
+
+    def _remove(self, subscriber: Subscriber):
+        removed = False
+        for channel in subscriber.channels:
+            listeners = self._subscribers.get(channel)
+            if listeners and subscriber in listeners:
+                listeners.discard(subscriber)
+                removed = True
+                if not listeners:
+                    del self._subscribers[channel]
+        if removed:
+            self._count -= 1
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._remove(subscriber)
+
+    async def stream(self, subscriber: Subscriber, is_disconnected: Callable) -> AsyncIterator[bytes]:
+        """SSE frames for one connection, with heartbeats so proxies keep idle streams open."""
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    frame = await asyncio.wait_for(subscriber.queue.get(), LIVE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if subscriber.overflowed or await is_disconnected():
+                        break
+                    yield b": ping\n\n"
+                    continue
+                yield frame
+                if subscriber.overflowed and subscriber.queue.empty():
+                    break
+            if subscriber.overflowed:
+                #whatever was queued has been sent, but events after it were lost
+                yield RESYNC
+        finally:
+            self.unsubscribe(subscriber)
+
+    def render_metrics(self) -> str:
+        return (
+            "# HELP peercv_live_subscribers Open live update streams\n"
+            "# TYPE peercv_live_subscribers gauge\n"
+            f"peercv_live_subscribers {self._count}\n"
+            "# HELP peercv_live_events_total Live update events by outcome\n"
+            "# TYPE peercv_live_events_total counter\n"
+            + "".join(f'peercv_live_events_total{{outcome="{k}"}} {v}\n' for k, v in self.stats.items())
+        )
+
+
+event_bus = EventBus(LocalBroadcast())
+
+
+async def publish_vote_totals(post_ids: Iterable):
+    """After a committed vote: the new totals of each post, to its own channel and the leaderboard."""
+    post_ids = list(post_ids)
+    if not post_ids:
+        return
+    #read back from the primary, a replica may not have the vote yet
+    async with PrimaryReadSessionLocal() as session:
+        result = await session.execute(
+            select(Posts.id, Posts.vote_count, Posts.average_rating, Posts.rank_score, *HISTOGRAM_COLUMNS)
+            .where(Posts.id.in_(post_ids))
+        )
+    for row in result.all():
+        totals = {
+            "post_id": row.id,
+            "vote_count": row.vote_count,
+            "average_rating": row.average_rating,
+            "rank_score": row.rank_score,
+            "histogram": histogram(row),
+        }
+        await event_bus.publish(post_channel(row.id), "vote", totals)
+        await event_bus.publish("leaderboard", "vote", totals)
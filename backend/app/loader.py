@@ -0,0 +1,64 @@
+import asyncio
+import contextvars
+from collections.abc import Awaitable, Callable, Hashable, Iterable
+from typing import Any
+
+LoadBatch = Callable[[list], Awaitable[dict]]
+
+
+class BatchLoader:
+    """Dataloader-style coalescing of lookups by key, across concurrent requests.
+
+    Keys asked for during one event loop iteration are fetched together by a single `load_batch(keys)`
+    call (returning {key: value}, missing keys come back as None), and a key that is already being
+    fetched is waited on rather than fetched again. Nothing is kept once a batch is answered: this
+    saves queries under concurrency, it isn't a cache.
+    """
+
+    def __init__(self, load_batch: LoadBatch, max_batch_size: int = 100):
+        self._load_batch = load_batch
+        self.max_batch_size = max_batch_size
+        self._waiting: dict[Hashable, asyncio.Future] = {} #collected for the next batch
+        self._loading: dict[Hashable, asyncio.Future] = {} #in a batch that is running
+        self.stats = {"requested": 0, "loaded": 0, "batches": 0}
+
+    async def load_many(self, keys: Iterable[Hashable]) -> list[Any]:
+        loop = asyncio.get_running_loop()
+        futures = []
+        for key in keys:
+            self.stats["requested"] += 1
+            future = self._loading.get(key) or self._waiting.get(key)
+            if future is None:
+                if not self._waiting:
+                    loop.call_soon(self._dispatch)
+                future = self._waiting[key] = loop.create_future()
+            futures.append(future)
+        #shielded: one caller going away mustn't cancel a lookup other requests are waiting on
+        return list(await asyncio.gather(*(asyncio.shield(future) for future in futures)))
+
+    def _dispatch(self):
+        waiting, self._waiting = self._waiting, {}
+        self._loading.update(waiting)
+        keys = list(waiting)
+        for i in range(0, len(keys), self.max_batch_size):
+            chunk = {key: waiting[key] for key in keys[i:i + self.max_batch_size]}
+            #its own context, so the queries aren't charged to whichever request happened to be first
+            asyncio.create_task(self._run(chunk), context=contextvars.Context())
+
+    async def _run(self, batch: dict[Hashable, asyncio.Future]):
+        self.stats["batches"] += 1
+        self.stats["loaded"] += len(batch)
+        try:
+            values = await self._load_batch(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+                    future.exception() #marked retrieved, there may be nobody left waiting for it
+        else:
+            for key, future in batch.items():
+                if not future.done():
+                    future.set_result(values.get(key))
+        finally:
+            for key in batch:
+                self._loading.pop(key, None)
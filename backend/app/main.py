@@ -1,19 +1,67 @@
-from fastapi import FastAPI
-from contextlib import asynccontextmanager
+import asyncio
+import logging
+import os
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.staticfiles import StaticFiles
+from contextlib import asynccontextmanager, suppress
 from app.routes.comment_route import router as comments_router
 from app.routes.post_route import router as posts_router
-from data.db import create_db_and_tables
+from app.routes.live_route import router as live_router
+from data.db import engine, primary_read_engine, read_engine
+from app.cache import response_cache
+from app.storage import MAX_UPLOAD_BYTES, MEDIA_ROOT, STORAGE_BACKEND
+from app.previews import shutdown_preview_pool
+from app.jobs import RUN_JOB_WORKER, work_forever
+from app.live import event_bus
+from app.writer import write_queue
+from app.migrations import RUN_MIGRATIONS, migrate, pending_migrations
+from app.instrumentation import install_sql_hooks, instrument_requests, metrics
+from app.admission import admission_control, render_metrics as admission_metrics
 from fastapi.middleware.cors import CORSMiddleware
 from auth.users import auth_backend, current_active_user, fastapi_users
 
 from data.schemas import UserCreate, UserRead, UserUpdate
 
+logger = logging.getLogger(__name__)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    await create_db_and_tables()
+    if RUN_MIGRATIONS:
+        await migrate()
+    elif pending := await pending_migrations():
+        logger.warning("Database schema is behind, run python -m app.migrations (pending: %s)", pending)
+    worker = asyncio.create_task(work_forever()) if RUN_JOB_WORKER else None
+    live_listener = asyncio.create_task(event_bus.backend.listen(event_bus.deliver))
     yield
+    live_listener.cancel()
+    #the worker goes first, a job cut off mid-write still has the connection and the queue to hand itself back with
+    if worker:
+        worker.cancel()
+        with suppress(asyncio.CancelledError):
+            await worker
+    await write_queue.close()
+    shutdown_preview_pool()
 
 app = FastAPI(title="Commenting Feature", lifespan=lifespan)
+for _engine in {engine, primary_read_engine, read_engine}:
+    install_sql_hooks(_engine)
+
+#registered before CORS so CORS stays the outermost layer and rejections still carry its headers
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    #refuse before the multipart body is read; check_upload_size still covers bodies without a Content-Length.
+    #the 64KB slack is for the multipart boundaries and the caption field
+    content_length = request.headers.get("content-length", "")
+    if request.url.path == "/posts/upload" and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + 64 * 1024:
+        return JSONResponse(status_code=413, content={"detail": "File is too large"})
+    return await call_next(request)
+
+#wraps the upload check: an oversized upload still spends the client's upload token
+app.middleware("http")(admission_control)
+
+#added after the upload check and admission control so it wraps them, rejected requests are counted too
+app.middleware("http")(instrument_requests)
 
 app.add_middleware(
     CORSMiddleware,
@@ -23,8 +71,13 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if STORAGE_BACKEND == "local":
+    os.makedirs(MEDIA_ROOT, exist_ok=True)
+    app.mount("/media", StaticFiles(directory=MEDIA_ROOT), name="media")
+
 app.include_router(comments_router, prefix="/comments", tags=["comments"])
 app.include_router(posts_router, prefix="/posts", tags=["posts"])
+app.include_router(live_router, prefix="/live", tags=["live"])
 
 #auth connections
 app.include_router(fastapi_users.get_auth_router(auth_backend), prefix='/auth/jwt', tags=["auth"])
@@ -32,3 +85,14 @@ app.include_router(fastapi_users.get_register_router(UserRead, UserCreate), pref
 app.include_router(fastapi_users.get_reset_password_router(), prefix="/auth", tags=["auth"])
 app.include_router(fastapi_users.get_verify_router(UserRead), prefix="/auth", tags=["auth"])
 app.include_router(fastapi_users.get_users_router(UserRead, UserUpdate), prefix="/users", tags=["users"])
+
+
+@app.get("/cache/stats", tags=["cache"])
+async def cache_stats():
+    return response_cache.stats
+
+
+#prometheus scrape target: per route request counts and latency, SQL statement counts and time
+@app.get("/metrics", tags=["metrics"], include_in_schema=False)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render() + event_bus.render_metrics() + write_queue.render_metrics() + admission_metrics(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,447 @@
+#SCHEMA MIGRATIONS
+#numbered steps that take any existing database, including the bundled data/app_db, to the current schema.
+#applied steps are recorded in schema_migrations. They run at startup, or from the command line (from backend/):
+#   python -m app.migrations            apply the pending steps
+#   python -m app.migrations --status   list applied and pending steps
+#new steps go at the end with the next number, an applied step is never edited. Each step is safe to run
+#again: sqlite's driver commits DDL as it goes, so a step that failed halfway can leave part of its work behind.
+#a step's DDL is written out as it was at that version (FROZEN SCHEMA below), never taken from data/db.py:
+#otherwise a model change would also change what an old step does to a new database. A model change needs a
+#step of its own. Data backfills do call app code, they fill values the way the app computes them today
+import argparse
+import asyncio
+import logging
+import os
+from collections.abc import Awaitable, Callable
+from datetime import datetime
+
+from dotenv import load_dotenv
+from sqlalchemy import (JSON, UUID, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, String,
+                        Table, Text, exists, false, func, insert, inspect, select, text)
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+from sqlalchemy.schema import CreateTable
+
+from data.db import engine
+from app.authors import backfill_author_snapshots
+from app.comment_tree import backfill_reply_counts
+from app.leaderboard import backfill_rank_scores, recount_comments, refresh_hot_scores
+from app.queue import backfill_queue_keys
+from app.votes import reconcile_aggregates
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+#"0" when migrations run as a deploy step (python -m app.migrations) instead of at every startup
+RUN_MIGRATIONS = os.environ.get("RUN_MIGRATIONS", "1") == "1"
+#any constant, it only has to be the same in every process
+MIGRATION_LOCK_KEY = 7_210_344
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(), #not part of Base, create_all must not make it look like everything is applied
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+Step = Callable[[AsyncConnection], Awaitable[None]]
+MIGRATIONS: list[tuple[int, str, Step]] = []
+
+
+def migration(version: int, name: str):
+    def register(fn: Step) -> Step:
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return register
+
+
+async def _columns(conn: AsyncConnection, table: str) -> set[str]:
+    return await conn.run_sync(lambda sync_conn: {c["name"] for c in inspect(sync_conn).get_columns(table)})
+
+
+async def add_column(conn: AsyncConnection, table: str, column: str, ddl: str):
+    """ALTER TABLE ... ADD COLUMN unless the column is there already. `ddl` is its type and constraints."""
+    if column not in await _columns(conn, table):
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+async def drop_column(conn: AsyncConnection, table: str, column: str):
+    #sqlite 3.35+, and only once no index, trigger or generated column refers to it
+    if column in await _columns(conn, table):
+        await conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+
+
+async def create_index(conn: AsyncConnection, name: str, table: str, columns: str):
+    await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+
+
+#FROZEN SCHEMA
+#tables as each step creates them. Columns and indexes that later steps add are not in here
+
+frozen = MetaData()
+
+#step 1
+Table(
+    "users", frozen,
+    Column("username", String, nullable=False),
+    Column("id", UUID(as_uuid=True), primary_key=True),
+    Column("profile_type", String),
+    Column("organization", String),
+    Column("program", String),
+    Column("year_of_study", Integer),
+    Column("job_title", String),
+    Column("email", String(320), nullable=False),
+    Column("hashed_password", String(1024), nullable=False),
+    Column("is_active", Boolean, nullable=False),
+    Column("is_superuser", Boolean, nullable=False),
+    Column("is_verified", Boolean, nullable=False),
+    Index("ix_users_email", "email", unique=True),
+)
+Table(
+    "posts", frozen,
+    Column("id", UUID(as_uuid=True), primary_key=True),
+    Column("caption", Text),
+    Column("url", String, nullable=False),
+    Column("file_type", String, nullable=False),
+    Column("file_name", String, nullable=False),
+    Column("created_at", DateTime),
+    Column("imagekit_file_id", String, nullable=False),
+    Column("user_id", UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Column("username", String, nullable=False),
+    Column("vote_count", Integer, nullable=False),
+    Column("average_rating", Float, nullable=False),
+    Column("rank_score", Float, server_default="0", nullable=False),
+    Column("queue_key", Float),
+    Column("page_count", Integer),
+    Column("text_content", Text),
+    Column("thumbnail_url", String),
+    Column("thumbnail_file_id", String),
+    Column("preview_url", String),
+    Column("preview_file_id", String),
+    Column("author_profile_type", String),
+    Column("author_organization", String),
+    Column("author_headline", String),
+)
+Table(
+    "comments", frozen,
+    Column("id", UUID(as_uuid=True), primary_key=True),
+    Column("post_id", UUID(as_uuid=True), ForeignKey("posts.id", ondelete="CASCADE"), nullable=False),
+    Column("body", String, nullable=False),
+    Column("created_at", DateTime, nullable=False),
+    Column("user_id", UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+    Column("username", String, nullable=False),
+    Column("parent_id", UUID(as_uuid=True), ForeignKey("comments.id", ondelete="CASCADE")),
+    Column("reply_count", Integer),
+    Column("author_profile_type", String),
+    Column("author_organization", String),
+    Column("author_headline", String),
+)
+Table(
+    "ratings", frozen,
+    Column("user_id", UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True),
+    Column("post_id", UUID(as_uuid=True), ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True),
+    Column("score", Integer, nullable=False),
+)
+Table(
+    "search_documents", frozen,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("post_id", UUID(as_uuid=True), ForeignKey("posts.id", ondelete="CASCADE"), nullable=False, unique=True),
+    Column("caption", Text),
+    Column("body", Text),
+    Column("comments", Text), #dropped by step 5
+)
+Table(
+    "jobs", frozen,
+    Column("id", UUID(as_uuid=True), primary_key=True),
+    Column("kind", String, nullable=False),
+    Column("payload", JSON, nullable=False),
+    Column("status", String, nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("run_at", DateTime, nullable=False),
+    Column("locked_until", DateTime),
+    Column("last_error", Text),
+    Column("created_at", DateTime, nullable=False),
+    Index("ix_jobs_status_run_at", "status", "run_at"),
+)
+
+#step 5
+Table(
+    "comment_search_documents", frozen,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("comment_id", UUID(as_uuid=True), ForeignKey("comments.id", ondelete="CASCADE"), nullable=False, unique=True),
+    Column("post_id", UUID(as_uuid=True), ForeignKey("posts.id", ondelete="CASCADE"), nullable=False),
+    Column("body", Text, nullable=False),
+    Index("ix_comment_search_documents_post_id", "post_id"),
+)
+
+#step 6
+Table(
+    "token_revocations", frozen,
+    Column("user_id", UUID(as_uuid=True), primary_key=True),
+    Column("revoked_at", Float, nullable=False),
+    Index("ix_token_revocations_revoked_at", "revoked_at"),
+)
+
+#full text search over search_documents, see app/search.py
+SEARCH_V1 = {
+    "sqlite": [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS search_documents_fts USING fts5(
+            caption, body, comments,
+            content='search_documents', content_rowid='id', tokenize='porter unicode61'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+            INSERT INTO search_documents_fts(rowid, caption, body, comments) VALUES (new.id, new.caption, new.body, new.comments);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+            INSERT INTO search_documents_fts(search_documents_fts, rowid, caption, body, comments) VALUES ('delete', old.id, old.caption, old.body, old.comments);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN
+            INSERT INTO search_documents_fts(search_documents_fts, rowid, caption, body, comments) VALUES ('delete', old.id, old.caption, old.body, old.comments);
+            INSERT INTO search_documents_fts(rowid, caption, body, comments) VALUES (new.id, new.caption, new.body, new.comments);
+        END""",
+    ],
+    "postgresql": [
+        """ALTER TABLE search_documents ADD COLUMN IF NOT EXISTS document tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(caption, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(body, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(comments, '')), 'C')
+        ) STORED""",
+        "CREATE INDEX IF NOT EXISTS ix_search_documents_document ON search_documents USING GIN (document)",
+    ],
+}
+
+#step 5: search_documents without the comments column, and comment_search_documents
+SEARCH_V5 = {
+    "sqlite": [
+        """CREATE VIRTUAL TABLE IF NOT EXISTS search_documents_fts USING fts5(
+            caption, body,
+            content='search_documents', content_rowid='id', tokenize='porter unicode61'
+        )""",
+        """CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN
+            INSERT INTO search_documents_fts(rowid, caption, body) VALUES (new.id, new.caption, new.body);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN
+            INSERT INTO search_documents_fts(search_documents_fts, rowid, caption, body) VALUES ('delete', old.id, old.caption, old.body);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN
+            INSERT INTO search_documents_fts(search_documents_fts, rowid, caption, body) VALUES ('delete', old.id, old.caption, old.body);
+            INSERT INTO search_documents_fts(rowid, caption, body) VALUES (new.id, new.caption, new.body);
+        END""",
+        """CREATE VIRTUAL TABLE IF NOT EXISTS comment_search_fts USING fts5(
+            body,
+            content='comment_search_documents', content_rowid='id', tokenize='porter unicode61'
+        )""",
+        #also fired by the ON DELETE CASCADE from a deleted comment or post
+        """CREATE TRIGGER IF NOT EXISTS comment_search_documents_ai AFTER INSERT ON comment_search_documents BEGIN
+            INSERT INTO comment_search_fts(rowid, body) VALUES (new.id, new.body);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS comment_search_documents_ad AFTER DELETE ON comment_search_documents BEGIN
+            INSERT INTO comment_search_fts(comment_search_fts, rowid, body) VALUES ('delete', old.id, old.body);
+        END""",
+    ],
+    "postgresql": [
+        """ALTER TABLE search_documents ADD COLUMN IF NOT EXISTS document tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(caption, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(body, '')), 'B')
+        ) STORED""",
+        "CREATE INDEX IF NOT EXISTS ix_search_documents_document ON search_documents USING GIN (document)",
+        """ALTER TABLE comment_search_documents ADD COLUMN IF NOT EXISTS document tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', body), 'C')
+        ) STORED""",
+        "CREATE INDEX IF NOT EXISTS ix_comment_search_documents_document ON comment_search_documents USING GIN (document)",
+    ],
+}
+
+
+async def create_tables(conn: AsyncConnection, *names: str):
+    """The frozen tables `names` and their indexes, those that don't exist yet."""
+    tables = [frozen.tables[name] for name in names]
+    await conn.run_sync(lambda sync_conn: frozen.create_all(sync_conn, tables=tables))
+
+
+async def run_all(conn: AsyncConnection, statements: dict[str, list[str]]):
+    for statement in statements["postgresql" if conn.dialect.name == "postgresql" else "sqlite"]:
+        await conn.execute(text(statement))
+
+
+#STEPS
+
+@migration(1, "baseline")
+async def _baseline(conn: AsyncConnection):
+    #a new database gets every table here, an older one the tables added since it was created
+    await create_tables(conn, "users", "posts", "comments", "ratings", "search_documents", "jobs")
+
+    #columns added to tables that already existed
+    for column, ddl in [
+        ("rank_score", "FLOAT DEFAULT 0 NOT NULL"),
+        ("queue_key", "FLOAT"),
+        ("page_count", "INTEGER"),
+        ("text_content", "TEXT"),
+        ("thumbnail_url", "VARCHAR"),
+        ("thumbnail_file_id", "VARCHAR"),
+        ("preview_url", "VARCHAR"),
+        ("preview_file_id", "VARCHAR"),
+        ("author_profile_type", "VARCHAR"),
+        ("author_organization", "VARCHAR"),
+        ("author_headline", "VARCHAR"),
+    ]:
+        await add_column(conn, "posts", column, ddl)
+    for column, ddl in [
+        ("reply_count", "INTEGER"),
+        ("author_profile_type", "VARCHAR"),
+        ("author_organization", "VARCHAR"),
+        ("author_headline", "VARCHAR"),
+    ]:
+        await add_column(conn, "comments", column, ddl)
+
+    await create_index(conn, "ix_posts_created_at_id", "posts", "created_at, id")
+    await create_index(conn, "ix_posts_rank_score", "posts", "rank_score")
+    await create_index(conn, "ix_posts_queue_key", "posts", "queue_key")
+    await create_index(conn, "ix_comments_post_parent_created", "comments", "post_id, parent_id, created_at")
+    await create_index(conn, "ix_comments_parent_created", "comments", "parent_id, created_at")
+
+    #fill the new columns in on rows written before them
+    await backfill_rank_scores(conn)
+    await backfill_queue_keys(conn)
+    await backfill_reply_counts(conn)
+    await backfill_author_snapshots(conn)
+
+    await run_all(conn, SEARCH_V1)
+    #posts from before search existed
+    posts, comments, documents = (frozen.tables[name] for name in ("posts", "comments", "search_documents"))
+    join = func.string_agg if conn.dialect.name == "postgresql" else func.group_concat
+    comment_text = select(join(comments.c.body, "\n")).where(comments.c.post_id == posts.c.id).scalar_subquery()
+    missing = select(posts.c.id, posts.c.caption, posts.c.text_content, comment_text).where(
+        ~exists().where(documents.c.post_id == posts.c.id)
+    )
+    await conn.execute(insert(documents).from_select(["post_id", "caption", "body", "comments"], missing))
+
+
+@migration(2, "indexes for author, own post and rating lookups")
+async def _lookup_indexes(conn: AsyncConnection):
+    #already covered: comments by post_id and by parent_id (leading columns of the thread indexes),
+    #posts by created_at alone (ix_posts_created_at_id). average_rating is only ever read, the
+    #leaderboard sorts on rank_score
+    #GET /posts/me, rewriting a user's author snapshot, and the cascade when a user is deleted
+    await create_index(conn, "ix_posts_user_created", "posts", "user_id, created_at")
+    await create_index(conn, "ix_comments_user_id", "comments", "user_id")
+    #the primary key is (user_id, post_id), so "the ratings of this post" can't use it
+    await create_index(conn, "ix_ratings_post_id", "ratings", "post_id")
+
+
+@migration(3, "integer rating sum and score histogram")
+async def _rating_counters(conn: AsyncConnection):
+    await add_column(conn, "posts", "rating_sum", "INTEGER DEFAULT 0 NOT NULL")
+    for score in range(1, 6):
+        await add_column(conn, "posts", f"score_{score}", "INTEGER DEFAULT 0 NOT NULL")
+    #recounted from ratings, which also rewrites averages that drifted under the old floating point update
+    await reconcile_aggregates(conn)
+
+
+@migration(4, "hot score and comment count for the ranked feeds")
+async def _hot_feed(conn: AsyncConnection):
+    await add_column(conn, "posts", "comment_count", "INTEGER DEFAULT 0 NOT NULL")
+    await add_column(conn, "posts", "hot_score", "FLOAT DEFAULT 0 NOT NULL")
+    #the keyset pages need id in the index, (rank_score, id) also serves everything rank_score alone did
+    await conn.execute(text("DROP INDEX IF EXISTS ix_posts_rank_score"))
+    await create_index(conn, "ix_posts_rank_score_id", "posts", "rank_score, id")
+    await create_index(conn, "ix_posts_hot_score_id", "posts", "hot_score, id")
+    await recount_comments(conn)
+    await refresh_hot_scores(conn)
+
+
+@migration(5, "a search document per comment")
+async def _comment_search_documents(conn: AsyncConnection):
+    #a post's comments used to be one text column of its search document, rewritten and reindexed whole for
+    #every new comment. The index over it goes first, then the column, then each comment gets its own row
+    if conn.dialect.name == "postgresql":
+        await conn.execute(text("ALTER TABLE search_documents DROP COLUMN IF EXISTS document")) #generated from comments
+    else:
+        for trigger in ("search_documents_ai", "search_documents_ad", "search_documents_au"):
+            await conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+        await conn.execute(text("DROP TABLE IF EXISTS search_documents_fts"))
+    await drop_column(conn, "search_documents", "comments")
+    await create_tables(conn, "comment_search_documents")
+    await run_all(conn, SEARCH_V5)
+    comments, documents = frozen.tables["comments"], frozen.tables["comment_search_documents"]
+    missing = select(comments.c.id, comments.c.post_id, comments.c.body).where(
+        ~exists().where(documents.c.comment_id == comments.c.id)
+    )
+    await conn.execute(insert(documents).from_select(["comment_id", "post_id", "body"], missing))
+    if conn.dialect.name != "postgresql":
+        #the recreated FTS5 index starts out empty, fill it from the post documents that are already there
+        await conn.execute(text("INSERT INTO search_documents_fts(search_documents_fts) VALUES ('rebuild')"))
+
+
+@migration(6, "token revocations every worker sees")
+async def _token_revocations(conn: AsyncConnection):
+    #revocations used to live in the response cache backend, which is per process unless a shared one is set up
+    await create_tables(conn, "token_revocations")
+
+
+@migration(7, "first comments of a post")
+async def _comment_previews(conn: AsyncConnection):
+    #the comment previews take the oldest few of each post straight off this index, whatever the thread shape
+    await create_index(conn, "ix_comments_post_created", "comments", "post_id, created_at, id")
+
+
+#RUNNER
+
+async def _lock(conn: AsyncConnection):
+    #several workers starting at once: the first one migrates, the others wait here and find nothing to do
+    if conn.dialect.name == "postgresql":
+        await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+    else:
+        #a write that matches nothing still takes sqlite's write lock until the transaction ends
+        await conn.execute(schema_migrations.update().where(false()).values(name=""))
+
+
+async def applied_migrations(db: AsyncEngine = engine) -> dict[int, datetime]:
+    async with db.begin() as conn:
+        #IF NOT EXISTS rather than checkfirst, workers starting together would race between the check and the create
+        await conn.execute(CreateTable(schema_migrations, if_not_exists=True))
+        result = await conn.execute(select(schema_migrations.c.version, schema_migrations.c.applied_at))
+        return dict(result.all())
+
+
+async def migrate(db: AsyncEngine = engine) -> list[int]:
+    """Apply the pending steps in order, each in its own transaction. Returns the versions applied."""
+    await applied_migrations(db)
+    applied = []
+    for version, name, step in sorted(MIGRATIONS, key=lambda m: m[0]):
+        async with db.begin() as conn:
+            await _lock(conn)
+            done = await conn.scalar(select(schema_migrations.c.version).where(schema_migrations.c.version == version))
+            if done is not None:
+                continue
+            logger.info("Applying migration %d: %s", version, name)
+            await step(conn)
+            await conn.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        applied.append(version)
+    return applied
+
+
+async def pending_migrations(db: AsyncEngine = engine) -> list[int]:
+    applied = await applied_migrations(db)
+    return [version for version, _, _ in MIGRATIONS if version not in applied]
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Upgrade the database schema")
+    parser.add_argument("--status", action="store_true", help="list applied and pending steps without applying any")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.status:
+        applied = await applied_migrations()
+        for version, name, _ in sorted(MIGRATIONS, key=lambda m: m[0]):
+            state = f"applied {applied[version]:%Y-%m-%d %H:%M}" if version in applied else "pending"
+            print(f"{version:>4}  {name:<50} {state}")
+    else:
+        versions = await migrate()
+        print(f"Applied {len(versions)} migration(s)" if versions else "Schema is up to date")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,59 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from fastapi import HTTPException
+from sqlalchemy import DateTime, and_, or_
+
+#feed pages are capped so a single request can never pull the whole table
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+
+#cursors are opaque to the client: urlsafe base64 of the (sort value, id) of the last row on a page.
+#the sort value is a timestamp (feeds, comments) or a score (search, ranked feeds)
+def encode_cursor(value: datetime | float, row_id: uuid.UUID) -> str:
+    if isinstance(value, datetime):
+        value = {"t": value.isoformat()}
+    raw = json.dumps([value, str(row_id)]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime | float, uuid.UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded))
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["t"])
+        elif not isinstance(value, (int, float)):
+            raise ValueError(value)
+        return value, uuid.UUID(row_id)
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _decode_for(value_column, cursor: str) -> tuple[datetime | float, uuid.UUID]:
+    #a cursor from another ordering (a timestamp where a score is expected) is a bad request, not a sql error
+    value, row_id = decode_cursor(cursor)
+    if isinstance(value, datetime) != isinstance(value_column.type, DateTime):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return value, row_id
+
+
+def after_descending(value_column, id_column, cursor: str):
+    """Keyset filter for rows after the cursor when ordering by (value DESC, id DESC)."""
+    value, row_id = _decode_for(value_column, cursor)
+    return or_(
+        value_column < value,
+        and_(value_column == value, id_column < row_id),
+    )
+
+
+def after_ascending(value_column, id_column, cursor: str):
+    """Keyset filter for rows after the cursor when ordering by (value ASC, id ASC)."""
+    value, row_id = _decode_for(value_column, cursor)
+    return or_(
+        value_column > value,
+        and_(value_column == value, id_column > row_id),
+    )
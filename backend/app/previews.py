@@ -0,0 +1,134 @@
+import asyncio
+import io
+import logging
+import os
+import re
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.etree import ElementTree
+
+from dotenv import load_dotenv
+
+from app.storage import CHUNK_SIZE, storage
+
+#PDF rendering needs the optional "previews" extra (pymupdf); without it PDFs just get no preview
+try:
+    import pymupdf
+except ImportError:
+    pymupdf = None
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+PREVIEW_WORKERS = int(os.environ.get("PREVIEW_WORKERS", 2))
+THUMBNAIL_WIDTH = 240 #feed cards
+PREVIEW_WIDTH = 800 #review modal, before the reader opens the original
+MAX_TEXT_CHARS = 100_000
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+class DocumentPreview:
+    def __init__(self, page_count: int | None = None, text: str = "", thumbnail: bytes | None = None, preview: bytes | None = None):
+        self.page_count = page_count
+        self.text = text
+        self.thumbnail = thumbnail #png
+        self.preview = preview #jpeg
+
+
+def _render(page, width: int, output: str) -> bytes:
+    zoom = width / page.rect.width
+    pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+    return pixmap.tobytes(output)
+
+
+def _pdf_preview(path: str) -> DocumentPreview:
+    if pymupdf is None:
+        return DocumentPreview()
+    with pymupdf.open(path) as document:
+        text = "\n".join(page.get_text() for page in document)[:MAX_TEXT_CHARS]
+        first_page = document[0]
+        return DocumentPreview(
+            page_count=document.page_count,
+            text=text,
+            thumbnail=_render(first_page, THUMBNAIL_WIDTH, "png"),
+            preview=_render(first_page, PREVIEW_WIDTH, "jpeg"),
+        )
+
+
+def _docx_preview(path: str) -> DocumentPreview:
+    #a docx is a zip of xml, the text and the page count Word last saw are readable without extra libraries;
+    #rendering one would need LibreOffice, so there is no thumbnail
+    with zipfile.ZipFile(path) as archive:
+        body = ElementTree.fromstring(archive.read("word/document.xml"))
+        paragraphs = (
+            "".join(node.text or "" for node in paragraph.iter(f"{WORD_NAMESPACE}t"))
+            for paragraph in body.iter(f"{WORD_NAMESPACE}p")
+        )
+        text = "\n".join(paragraphs)[:MAX_TEXT_CHARS]
+        page_count = None
+        if "docProps/app.xml" in archive.namelist():
+            match = re.search(rb"<Pages>(\d+)</Pages>", archive.read("docProps/app.xml"))
+            page_count = int(match.group(1)) if match else None
+    return DocumentPreview(page_count=page_count, text=text)
+
+
+def extract_preview(path: str, file_type: str) -> DocumentPreview:
+    """Runs in a worker process: page count, plain text and first page renders of an uploaded resume."""
+    if file_type == "pdf":
+        return _pdf_preview(path)
+    if file_type == "docx":
+        return _docx_preview(path)
+    return DocumentPreview() #legacy .doc is a binary format we don't parse
+
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    #rendering is CPU bound, so it runs in other processes instead of threads
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PREVIEW_WORKERS)
+    return _pool
+
+
+def shutdown_preview_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(cancel_futures=True)
+        _pool = None
+
+
+def _copy_to_temp(file, suffix: str) -> str:
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as copy:
+        shutil.copyfileobj(file, copy, CHUNK_SIZE)
+    file.seek(0)
+    return copy.name
+
+
+async def save_temp_copy(file, file_type: str) -> str:
+    """Copy an upload to a named temp file a worker process can open. Caller removes it."""
+    return await asyncio.to_thread(_copy_to_temp, file, f".{file_type}")
+
+
+async def build_preview(path: str, file_type: str, file_name: str) -> dict:
+    """Extract and store the preview of the file at `path`, returning the Posts column values.
+    A broken document only costs its preview, never the upload."""
+    try:
+        preview = await asyncio.get_running_loop().run_in_executor(_get_pool(), extract_preview, path, file_type)
+    except Exception:
+        logger.exception("Could not build a preview for %s", file_name)
+        return {}
+
+    values = {"page_count": preview.page_count, "text_content": preview.text or None}
+    stem = os.path.splitext(os.path.basename(file_name))[0]
+    if preview.thumbnail:
+        stored = await storage.save(io.BytesIO(preview.thumbnail), f"{stem}_thumb.png", "/previews")
+        values.update(thumbnail_url=stored.url, thumbnail_file_id=stored.file_id)
+    if preview.preview:
+        stored = await storage.save(io.BytesIO(preview.preview), f"{stem}_preview.jpg", "/previews")
+        values.update(preview_url=stored.url, preview_file_id=stored.file_id)
+    return values
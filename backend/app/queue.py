@@ -0,0 +1,116 @@
+import os
+import random
+import uuid
+
+from dotenv import load_dotenv
+from sqlalchemy import select, update, func
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from data.db import Posts, Rating
+
+load_dotenv()
+
+#how many random candidates we look at per round, and how many rounds before giving up
+POOL_SIZE = int(os.environ.get("QUEUE_POOL_SIZE", 200))
+MAX_ROUNDS = 3
+#when every candidate was already rated (someone who has voted on most posts): how many posts to scan past a
+#random start, and again from the beginning of the key space, looking for ones they haven't rated
+FALLBACK_SCAN_SIZE = int(os.environ.get("QUEUE_FALLBACK_SCAN", 5_000))
+
+
+async def _candidate_pool(session: AsyncSession, user_id: uuid.UUID, start: float) -> list[tuple[uuid.UUID, int]]:
+    #queue_key is a random number fixed at upload, so a range scan from a random start is a uniform sample
+    def pool(condition, size):
+        return (
+            select(Posts.id, Posts.vote_count)
+            .where(condition, Posts.user_id != user_id)
+            .order_by(Posts.queue_key)
+            .limit(size)
+        )
+
+    rows = (await session.execute(pool(Posts.queue_key >= start, POOL_SIZE))).all()
+    if len(rows) < POOL_SIZE:
+        #wrap around to the beginning of the key space
+        rows += (await session.execute(pool(Posts.queue_key < start, POOL_SIZE - len(rows)))).all()
+    return rows
+
+
+async def _rated_among(session: AsyncSession, user_id: uuid.UUID, post_ids: list[uuid.UUID]) -> set[uuid.UUID]:
+    if not post_ids:
+        return set()
+    #primary key lookups, however many ratings the user has
+    result = await session.execute(
+        select(Rating.post_id).where(Rating.user_id == user_id, Rating.post_id.in_(post_ids))
+    )
+    return set(result.scalars().all())
+
+
+async def _scan_unrated(
+    session: AsyncSession, user_id: uuid.UUID, start: float, limit: int, exclude: set[uuid.UUID]
+) -> dict[uuid.UUID, int]:
+    #a window of FALLBACK_SCAN_SIZE posts is cut off the queue_key index first, then its rated posts are
+    #dropped by a probe into ratings each: at most that many rows per range, never the user's whole history
+    def scan(condition):
+        window = (
+            select(Posts.id, Posts.vote_count, Posts.queue_key)
+            .where(condition, Posts.user_id != user_id)
+            .order_by(Posts.queue_key)
+            .limit(FALLBACK_SCAN_SIZE)
+            .subquery()
+        )
+        rated = select(Rating.post_id).where(Rating.user_id == user_id, Rating.post_id == window.c.id).exists()
+        return (
+            select(window.c.id, window.c.vote_count)
+            .where(~rated)
+            .order_by(window.c.queue_key)
+            .limit(limit + len(exclude))
+        )
+
+    found = {}
+    for condition in (Posts.queue_key >= start, Posts.queue_key < start):
+        for post_id, vote_count in (await session.execute(scan(condition))).all():
+            if post_id not in exclude:
+                found[post_id] = vote_count
+        if len(found) >= limit:
+            break
+    return found
+
+
+async def sample_queue(
+    session: AsyncSession,
+    user_id: uuid.UUID,
+    limit: int,
+    exclude: set[uuid.UUID] = frozenset(),
+) -> list[uuid.UUID]:
+    """Pick up to `limit` posts the user hasn't rated, preferring posts with few votes.
+
+    Reads at most POOL_SIZE * MAX_ROUNDS random posts and looks each one up in ratings by primary key, so
+    the cost doesn't grow with the number of ratings the user has. Only when all of them turn out rated
+    does it scan up to 2 * FALLBACK_SCAN_SIZE posts for unrated ones before coming back empty.
+    """
+    picked: dict[uuid.UUID, int] = {}
+
+    for _ in range(MAX_ROUNDS):
+        pool = await _candidate_pool(session, user_id, random.random())
+        rated = await _rated_among(session, user_id, [post_id for post_id, _ in pool])
+        for post_id, vote_count in pool:
+            if post_id not in rated and post_id not in exclude:
+                picked[post_id] = vote_count
+        if len(picked) >= limit:
+            break
+
+    if not picked:
+        picked = await _scan_unrated(session, user_id, random.random(), limit, exclude)
+
+    #fewest votes first so coverage spreads out; the pool order already randomises ties
+    return sorted(picked, key=picked.get)[:limit]
+
+
+async def backfill_queue_keys(conn: AsyncConnection):
+    #posts uploaded before queue_key existed have no key and would never be sampled
+    if conn.dialect.name == "sqlite":
+        #sqlite's random() is a signed 64 bit integer
+        random_key = (func.abs(func.random()) % 1_000_000_000) / 1_000_000_000.0
+    else:
+        random_key = func.random()
+    await conn.execute(update(Posts).where(Posts.queue_key.is_(None)).values(queue_key=random_key))
@@ -1,98 +1,127 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy import select
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import select, update, func
 from sqlalchemy.ext.asyncio import AsyncSession
 import uuid
-from sqlalchemy.orm import joinedload
 
-from data.db import Comments, get_async_session, User
-from data.schemas import Comment, CommentCreate
+from data.db import Comments, Posts, get_read_session, author_snapshot
+from data.schemas import Comment, CommentCreate, CommentThreadPage
+from app.comment_tree import MAX_CHILDREN, MAX_DEPTH, load_threads
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from app.cache import comments_tag, response_cache
+from app.search import index_comment
+from app.leaderboard import recount_comments, refresh_hot_scores
+from app.live import event_bus, post_channel
+from app.serialization import COMMENT_COLUMNS, comment_json
+from app.writer import write_queue
 
-from auth.users import auth_backend, current_active_user, fastapi_users
+from auth.users import auth_backend, current_token_user, fastapi_users
+from auth.tokens import TokenUser
 
 router = APIRouter()
 
 
 @router.get("/{post_id}", response_model=list[Comment])
 async def list_comments(
+    request: Request,
     post_id: uuid.UUID,
-    session: AsyncSession = Depends(get_async_session),
+    session: AsyncSession = Depends(get_read_session),
 ) -> list[Comment]:
-    result = await session.execute(select(Comments).where(Comments.post_id == post_id).options(joinedload(Comments.user)))
-    comments = result.scalars().all()
-    return [
-        Comment(
-            post_id=comment.post_id,  
-            body=comment.body, 
-            id=comment.id,
-            parent_comment_id=comment.parent_id,
-            owner={
-                    "username":comment.user.username,
-                    "profile_type":comment.user.profile_type,
-                    "organization":comment.user.organization,
-                    "headline": (
-                        comment.user.job_title  
-                        if comment.user.job_title 
-                        else f"{comment.user.program}, Year {comment.user.year_of_study}"
-                    )
-                }
-        )
-        for comment in comments
-    ]
+    async def build():
+        result = await session.execute(select(*COMMENT_COLUMNS).where(Comments.post_id == post_id))
+        return [comment_json(row) for row in result.all()]
+
+    return await response_cache.respond(request, [comments_tag(post_id)], build)
+
+
+@router.get("/{post_id}/tree", response_model=CommentThreadPage)
+async def list_comment_threads(
+    request: Request,
+    post_id: uuid.UUID,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    depth: int = Query(3, ge=1, le=MAX_DEPTH),
+    children: int = Query(3, ge=1, le=MAX_CHILDREN),
+    session: AsyncSession = Depends(get_read_session),
+) -> CommentThreadPage:
+    async def build():
+        return await load_threads(session, post_id, None, cursor, limit, depth, children)
+
+    return await response_cache.respond(request, [comments_tag(post_id)], build)
+
+
+@router.get("/{post_id}/replies/{comment_id}", response_model=CommentThreadPage)
+async def list_comment_replies(
+    request: Request,
+    post_id: uuid.UUID,
+    comment_id: uuid.UUID,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    depth: int = Query(3, ge=1, le=MAX_DEPTH),
+    children: int = Query(3, ge=1, le=MAX_CHILDREN),
+    session: AsyncSession = Depends(get_read_session),
+) -> CommentThreadPage:
+    async def build():
+        return await load_threads(session, post_id, comment_id, cursor, limit, depth, children)
+
+    return await response_cache.respond(request, [comments_tag(post_id)], build)
 
 
 @router.post("/{post_id}", response_model=Comment, status_code=201)
 async def create_comment(
     post_id: uuid.UUID,
     comment: CommentCreate,
-    session: AsyncSession = Depends(get_async_session),
-    user: User = Depends(current_active_user) #goes inside db and then checks if active, has access to header
+    user: TokenUser = Depends(current_token_user) #checks the token and that the user is active, usually without touching the users table
 ) -> Comment:
-    if comment.parent_comment_id:
-        parent_check = await session.execute(
-            select(Comments).where(Comments.id == comment.parent_comment_id)
+    async def write(session: AsyncSession) -> Comments:
+        if comment.parent_comment_id:
+            parent_check = await session.execute(
+                select(Comments).where(Comments.id == comment.parent_comment_id, Comments.post_id == post_id)
+            )
+            if not parent_check.scalars().first():
+                raise HTTPException(status_code=400, detail="The comment you are replying to does not exist.")
+
+            await session.execute(
+                update(Comments)
+                .where(Comments.id == comment.parent_comment_id)
+                .values(reply_count=func.coalesce(Comments.reply_count, 0) + 1)
+            )
+
+        to_add = Comments(
+            post_id=post_id,
+            body=comment.body,
+            user_id=user.id,
+            parent_id=comment.parent_comment_id,
+            **author_snapshot(user),
         )
-        if not parent_check.scalars().first():
-            raise HTTPException(status_code=400, detail="The comment you are replying to does not exist.")
-        
-    to_add = Comments(
-        post_id=post_id,
-        body=comment.body,
-        user_id=user.id,
-        username=user.username,
-        parent_id=comment.parent_comment_id
-    )
 
-    session.add(to_add)
-    await session.commit()
-    await session.refresh(to_add)
+        session.add(to_add)
+        await session.flush() #fills in the id and created_at
+        await index_comment(session, to_add)
+        await session.execute(update(Posts).where(Posts.id == post_id).values(comment_count=Posts.comment_count + 1))
+        await refresh_hot_scores(session, [post_id])
+        return to_add
+
+    to_add = await write_queue.run(write)
+    await response_cache.invalidate(comments_tag(post_id), "feed")
 
-    return Comment(
+    created = Comment(
         post_id=to_add.post_id,
         body=to_add.body,
         id=to_add.id,
         parent_comment_id=to_add.parent_id,
-        owner={
-                    "username":user.username,
-                    "profile_type":user.profile_type,
-                    "organization":user.organization,
-                    "headline": (
-                        user.job_title  
-                        if user.job_title 
-                        else f"{user.program}, Year {user.year_of_study}"
-                    )
-                }
+        created_at=to_add.created_at,
+        owner=to_add.owner
     )
+    await event_bus.publish(post_channel(post_id), "comment_created", created)
+    return created
 
 
 @router.delete("/{comment_id}")
 async def delete_comment(
     comment_id: str,
-    session: AsyncSession = Depends(get_async_session),
-    user: User = Depends(current_active_user),
+    user: TokenUser = Depends(current_token_user),
 ):
-    try:
-        comment_uuid = uuid.UUID(comment_id)
-
+    async def write(session: AsyncSession) -> Comments:
         result = await session.execute(
             select(Comments).where(Comments.id == comment_uuid)
         )
@@ -104,9 +133,32 @@ async def delete_comment(
         if comment.user_id != user.id:
             raise HTTPException(status_code=403, detail="You dont have permission to delete this post")
         
+        if comment.parent_id:
+            await session.execute(
+                update(Comments)
+                .where(Comments.id == comment.parent_id)
+                .values(reply_count=func.coalesce(Comments.reply_count, 1) - 1)
+            )
+
         await session.delete(comment)
-        await session.commit()
+        await session.flush()
+        #recounted rather than decremented, the replies that went with it are gone too
+        await recount_comments(session, [comment.post_id])
+        await refresh_hot_scores(session, [comment.post_id])
+        #its search document, and those of its replies, cascade with it
+        return comment
+
+    try:
+        comment_uuid = uuid.UUID(comment_id)
+        comment = await write_queue.run(write)
+        await response_cache.invalidate(comments_tag(comment.post_id), "feed")
+        #replies go with it, clients drop the whole subtree
+        await event_bus.publish(
+            post_channel(comment.post_id), "comment_deleted", {"id": comment.id, "post_id": comment.post_id}
+        )
 
         return {"success": True, "message": "Comment deleted successfully"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,41 @@
+import uuid
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from app.live import event_bus, post_channel
+
+router = APIRouter()
+
+#server-sent events: the client opens an EventSource and applies each event to the list it already
+#loaded, instead of re-fetching the list. On a "resync" event (or a reconnect) it re-fetches once
+
+
+def _stream(request: Request, channels: list[str]) -> StreamingResponse:
+    if event_bus.full():
+        raise HTTPException(status_code=503, detail="Too many live connections", headers={"Retry-After": "30"})
+    subscriber = event_bus.subscribe(channels)
+    return StreamingResponse(
+        event_bus.stream(subscriber, request.is_disconnected),
+        media_type="text/event-stream",
+        #no proxy buffering or caching, events have to go out as they happen
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/posts")
+async def post_events(request: Request):
+    """post_created, post_updated (preview ready) and post_deleted."""
+    return _stream(request, ["posts"])
+
+
+@router.get("/posts/{post_id}")
+async def comment_events(post_id: uuid.UUID, request: Request):
+    """comment_created, comment_deleted, vote and post_deleted for one post."""
+    return _stream(request, [post_channel(post_id)])
+
+
+@router.get("/leaderboard")
+async def leaderboard_events(request: Request):
+    """vote (new totals and rank score of a post) plus the post events, for re-sorting locally."""
+    return _stream(request, ["leaderboard", "posts"])
@@ -1,173 +1,190 @@
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
-from sqlalchemy import select, update
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, Query, Request
+from sqlalchemy import select, delete
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+import os
 import uuid
-from sqlalchemy.orm import joinedload
+from datetime import datetime
+from typing import Literal
+
+from data.db import Posts, get_primary_read_session, get_read_session, Rating, author_snapshot
+from data.schemas import Post, PostActivityBatch, PostPage, RatingSummary, VoteBatch, VoteBatchResult
+from app.storage import check_upload_size, storage
+from app.previews import save_temp_copy
+from app.jobs import enqueue, notify
+from app.live import event_bus, post_channel, publish_vote_totals
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, encode_cursor, after_descending
+from app.leaderboard import hot_score, window_start
+from app.queue import sample_queue
+from app.votes import cast_votes, change_vote, retract_vote
+from app.writer import write_queue
+from app.cache import comments_tag, response_cache
+from app.comment_tree import comment_previews
+from app.search import index_post, search_posts
+from app.serialization import HISTOGRAM_COLUMNS, POST_COLUMNS, FastJSONResponse, histogram, post_json
+
+from auth.users import auth_backend, current_token_user, fastapi_users, optional_token_user
+from auth.tokens import TokenUser
 
-from data.db import Posts, get_async_session, User, Rating
-from data.schemas import Post
-from app.images import imagekit
+router = APIRouter()
 
-from auth.users import auth_backend, current_active_user, fastapi_users
 
-router = APIRouter()
+def to_post(post: Posts) -> Post:
+    return Post(
+        post_id=post.id,
+        url=post.url,
+        file_type=post.file_type,
+        file_name=post.file_name,
+        caption=post.caption,
+        average_rating=post.average_rating,
+        vote_count=post.vote_count,
+        rank_score=post.rank_score,
+        comment_count=post.comment_count,
+        page_count=post.page_count,
+        thumbnail_url=post.thumbnail_url,
+        preview_url=post.preview_url,
+        owner=post.owner,
+        created_at=post.created_at
+    )
+
 
-@router.get("/", response_model=list[Post])
+#the feed orderings, each paged on (column DESC, id DESC) off its own index
+FEED_SORTS = {
+    "new": Posts.created_at,
+    "hot": Posts.hot_score,
+    "top": Posts.rank_score,
+}
+
+
+@router.get("/", response_model=PostPage)
 async def list_posts(
-    session: AsyncSession = Depends(get_async_session),
-) -> list[Post]:
-    result = await session.execute(select(Posts).options(joinedload(Posts.user)))
-    posts = result.scalars().all()
-    return [
-        Post(
-            post_id=post.id,
-            url=post.url,
-            file_type=post.file_type,
-            file_name=post.file_name,
-            caption=post.caption,
-            average_rating=post.average_rating,
-            vote_count=post.vote_count,
-            owner={
-                "username":post.user.username,
-                "profile_type":post.user.profile_type,
-                "organization":post.user.organization,
-                "headline": (
-                    post.user.job_title  
-                    if post.user.job_title 
-                    else f"{post.user.program}, Year {post.user.year_of_study}"
-                )
-            },
-            created_at=post.created_at
+    request: Request,
+    sort: Literal["hot", "new", "top"] = "new",
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: AsyncSession = Depends(get_read_session),
+) -> PostPage:
+    async def build():
+        sort_column = FEED_SORTS[sort]
+        stmt = (
+            select(*POST_COLUMNS, sort_column.label("sort_value"))
+            .order_by(sort_column.desc(), Posts.id.desc())
+            .limit(limit + 1) #one extra row tells us whether there is a next page
         )
-        for post in posts
-    ]
+        if cursor:
+            stmt = stmt.where(after_descending(sort_column, Posts.id, cursor))
+
+        rows = (await session.execute(stmt)).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].sort_value, rows[-1].id)
+
+        return {"posts": [post_json(row) for row in rows], "next_cursor": next_cursor}
+
+    return await response_cache.respond(request, ["feed"], build)
+
+
+@router.get("/search", response_model=PostPage)
+async def search(
+    q: str = Query(..., min_length=1, max_length=200),
+    profile_type: str | None = None,
+    organization: str | None = None,
+    file_type: Literal["pdf", "doc", "docx"] | None = None,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: AsyncSession = Depends(get_read_session),
+) -> PostPage:
+    rows, next_cursor = await search_posts(
+        session, q, cursor, limit,
+        profile_type=profile_type, organization=organization, file_type=file_type,
+    )
+    return FastJSONResponse({"posts": [post_json(row) for row in rows], "next_cursor": next_cursor})
 
 @router.get("/me", response_model=list[Post])
 async def list_posts(
-    session: AsyncSession = Depends(get_async_session),
-    user: User = Depends(current_active_user)
+    session: AsyncSession = Depends(get_primary_read_session),
+    user: TokenUser = Depends(current_token_user)
 ) -> list[Post]:
-    result = await session.execute(select(Posts).where(Posts.user_id == user.id).options(joinedload(Posts.user)))
-    posts = result.scalars().all()
-
-    if posts:
-        return [
-            Post(
-                post_id=post.id,
-                url=post.url,
-                file_type=post.file_type,
-                file_name=post.file_name,
-                caption=post.caption,
-                average_rating=post.average_rating,
-                vote_count=post.vote_count,
-                owner={
-                    "username":post.user.username,
-                    "profile_type":post.user.profile_type,
-                    "organization":post.user.organization,
-                    "headline": (
-                        post.user.job_title  
-                        if post.user.job_title 
-                        else f"{post.user.program}, Year {post.user.year_of_study}"
-                    )
-                },
-                created_at=post.created_at
-            )
-            for post in posts
-        ]
+    rows = (await session.execute(select(*POST_COLUMNS).where(Posts.user_id == user.id))).all()
+
+    if rows:
+        return FastJSONResponse([post_json(row) for row in rows])
     else:
         raise HTTPException(status_code=204, detail="No posts found")
 
 
 @router.get("/queue", response_model=list[Post])
 async def get_voting_queue(
-    session: AsyncSession = Depends(get_async_session),
-    user: User = Depends(current_active_user)
+    limit: int = Query(30, ge=1, le=MAX_PAGE_SIZE),
+    #post ids the client already holds (e.g. the batch it is prefetching behind), so batches don't overlap
+    exclude: list[uuid.UUID] = Query(default=[]),
+    session: AsyncSession = Depends(get_primary_read_session),
+    user: TokenUser = Depends(current_token_user)
 ):
-    stmt = (
-        select(Posts)
-        # "Line up the receipts next to the posts"
-        .outerjoin(Rating, (Rating.post_id == Posts.id) & (Rating.user_id == user.id))
-        # "Only keep the ones where the receipt is missing (None)"
-        .where(Rating.post_id == None)
-        .options(joinedload(Posts.user)) 
-        .limit(30)
-    )
-    
-    result = await session.execute(stmt)
-    posts = result.scalars().all()
-    
-    # ... (Return your list[Post] manual object like before) ...
-    # (I can paste the full return block if you need it again)
-    return [
-        Post(
-            post_id=post.id,
-            url=post.url,
-            file_type=post.file_type,
-            file_name=post.file_name,
-            caption=post.caption,
-            average_rating=post.average_rating,
-            vote_count=post.vote_count,
-
-            owner={
-                "username": post.user.username,
-                "profile_type": post.user.profile_type,
-                "organization": post.user.organization,
-                "headline": (
-                    post.user.job_title 
-                    if post.user.job_title 
-                    else f"{post.user.program}, Year {post.user.year_of_study}"
-                )
-            },
-            created_at=post.created_at
+    post_ids = await sample_queue(session, user.id, limit, exclude=set(exclude))
+    if not post_ids:
+        return []
+
+    result = await session.execute(select(*POST_COLUMNS).where(Posts.id.in_(post_ids)))
+    by_id = {row.id: row for row in result.all()}
+    #keep the fewest-votes-first order the sampler picked
+    return FastJSONResponse([post_json(by_id[post_id]) for post_id in post_ids if post_id in by_id])
+
+#one request for what a page of post cards would otherwise fetch one post at a time
+@router.get("/activity", response_model=PostActivityBatch)
+async def get_post_activity(
+    ids: list[uuid.UUID] = Query(..., max_length=MAX_PAGE_SIZE),
+    session: AsyncSession = Depends(get_primary_read_session),
+    user: TokenUser | None = Depends(optional_token_user),
+):
+    post_ids = list(dict.fromkeys(ids))
+    previews = await comment_previews.load_many(post_ids)
+    rated = None
+    if user:
+        #the ratings primary key leads with user_id, one lookup per post asked for
+        result = await session.execute(
+            select(Rating.post_id).where(Rating.user_id == user.id, Rating.post_id.in_(post_ids))
         )
-        for post in posts
+        rated = set(result.scalars().all())
+
+    posts = [
+        {**preview, "has_rated": preview["post_id"] in rated if rated is not None else None}
+        for preview in previews if preview is not None
     ]
+    return FastJSONResponse({"posts": posts})
+
 
 @router.get("/leaderboard", response_model=list[Post])
 async def get_leaderboard(
-    session: AsyncSession = Depends(get_async_session)
+    request: Request,
+    window: Literal["week", "month", "all"] = "all",
+    limit: int = Query(20, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_read_session)
 ):
-    stmt = (
-        select(Posts)
-        .order_by(Posts.average_rating.desc()) # Simple Sort!
-        .options(joinedload(Posts.user))
-        .limit(20)
-    )
-    
-    result = await session.execute(stmt)
-    posts = result.scalars().all()
-
-    return [
-        Post(
-            post_id=post.id,
-            url=post.url,
-            file_type=post.file_type,
-            file_name=post.file_name,
-            caption=post.caption,
-            average_rating=post.average_rating,
-            vote_count=post.vote_count,
-
-            owner={
-                "username": post.user.username,
-                "profile_type": post.user.profile_type,
-                "organization": post.user.organization,
-                "headline": (
-                    post.user.job_title 
-                    if post.user.job_title 
-                    else f"{post.user.program}, Year {post.user.year_of_study}"
-                )
-            },
-            created_at=post.created_at
+    async def build():
+        stmt = (
+            select(*POST_COLUMNS)
+            .order_by(Posts.rank_score.desc(), Posts.vote_count.desc(), Posts.id)
+            .offset(offset)
+            .limit(limit)
         )
-        for post in posts
-    ]
+        since = window_start(window)
+        if since:
+            stmt = stmt.where(Posts.created_at >= since)
+    
+        return [post_json(row) for row in (await session.execute(stmt)).all()]
+
+    return await response_cache.respond(request, ["leaderboard"], build)
+
 
 @router.post("/upload", response_model=Post, status_code=201)
 async def upload_post(
     file: UploadFile = File(...),
     caption: str = Form(""),
-    session: AsyncSession = Depends(get_async_session),
-    user: User = Depends(current_active_user)
+    user: TokenUser = Depends(current_token_user)
 ) -> Post:
     allowed_types = {
         "application/pdf": "pdf",
@@ -197,57 +214,51 @@ async def upload_post(
             file_type = "doc"
 
     try:
-        file_content = await file.read()
-
-        if not file_content:
+        if not await check_upload_size(file):
             raise HTTPException(status_code=400, detail="Uploaded file is empty")
 
-        upload_result = imagekit.files.upload(
-            file=file_content,
-            file_name=filename or "upload",
-            use_unique_file_name=True,
-            tags=["backend-upload"],
-            folder="/uploads",
-        )
-
-        if not upload_result.url or not upload_result.file_id:
-            raise HTTPException(
-                status_code=502, detail="ImageKit upload returned incomplete data"
+        #the original is stored now, the preview is rendered later by the job worker from a spooled copy
+        preview_source = await save_temp_copy(file.file, file_type)
+        try:
+            stored = await storage.save(file.file, filename or "upload", "/uploads")
+        except Exception:
+            os.remove(preview_source)
+            raise
+
+        async def write(writer: AsyncSession) -> Posts:
+            created_at = datetime.utcnow()
+            post = Posts(
+                caption=caption,
+                created_at=created_at,
+                hot_score=hot_score(0, 0, 0, created_at), #the age bonus alone until the first vote or comment
+                url=stored.url,
+                file_type=file_type,
+                file_name=stored.name,
+                imagekit_file_id=stored.file_id,
+                user_id=user.id,
+                **author_snapshot(user),
             )
-
-        post = Posts(
-            caption=caption,
-            url=upload_result.url,
-            file_type=file_type,
-            file_name=upload_result.name or filename or "upload",
-            imagekit_file_id=upload_result.file_id,
-            user_id=user.id,
-            username=user.username
-        )
-        session.add(post)
-        await session.commit()
-        await session.refresh(post)
-
-        return Post(
-            post_id=post.id,
-            url=post.url,
-            file_type=post.file_type,
-            file_name=post.file_name,
-            caption=post.caption,
-            average_rating=post.average_rating,
-            vote_count=post.vote_count,
-            owner={
-                    "username":user.username,
-                    "profile_type":user.profile_type,
-                    "organization":user.organization,
-                    "headline": (
-                        user.job_title  
-                        if user.job_title 
-                        else f"{user.program}, Year {user.year_of_study}"
-                    )
-                },
-            created_at=post.created_at
-        )
+            writer.add(post)
+            await writer.flush()
+            await index_post(writer, post)
+            enqueue(writer, "build_preview", {
+                "post_id": str(post.id),
+                "path": preview_source,
+                "file_type": file_type,
+                "file_name": filename or "upload",
+            })
+            await writer.refresh(post) #the server defaults, the session is gone once the queue commits
+            return post
+
+        post = await write_queue.run(write)
+        notify()
+        await response_cache.invalidate("feed", "leaderboard")
+
+        created = to_post(post)
+        await event_bus.publish("posts", "post_created", created)
+        return created
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -255,49 +266,99 @@ async def upload_post(
 @router.post("/{post_id}/rate", status_code=201)
 async def upload_post(
     post_id: uuid.UUID,
-    score: int,
-    session: AsyncSession = Depends(get_async_session),
-    user: User = Depends(current_active_user)
+    score: int = Query(..., ge=1, le=5),
+    user: TokenUser = Depends(current_token_user)
 ):
-    # 1. CHECK: Has this user voted on this post before?
-    existing_vote = await session.execute(
-        select(Rating).where(Rating.user_id == user.id, Rating.post_id == post_id)
-    )
-    if existing_vote.scalars().first():
+    try:
+        accepted = await write_queue.run(lambda writer: cast_votes(writer, user.id, {post_id: score}))
+    except IntegrityError:
+        raise HTTPException(status_code=404, detail="Post not found")
+
+    if not accepted:
         raise HTTPException(status_code=400, detail="You have already voted on this post.")
 
-    # 2. SIGN: Create the "Receipt"
-    new_rating = Rating(user_id=user.id, post_id=post_id, score=score)
-    session.add(new_rating)
-
-    # 3. MATH: Atomic Update (The "Safe" Way)
-    # New Average = ((Old Avg * Old Count) + New Score) / (Old Count + 1)
-    stmt = (
-        update(Posts)
-        .where(Posts.id == post_id)
-        .values(
-            vote_count=Posts.vote_count + 1,
-            average_rating=(
-                (Posts.average_rating * Posts.vote_count) + score
-            ) / (Posts.vote_count + 1)
-        )
+    await response_cache.invalidate("feed", "leaderboard")
+    await publish_vote_totals([post_id])
+    return {"message": "Vote registered"}
+
+
+@router.put("/{post_id}/rate")
+async def change_rating(
+    post_id: uuid.UUID,
+    score: int = Query(..., ge=1, le=5),
+    user: TokenUser = Depends(current_token_user)
+):
+    previous = await write_queue.run(lambda writer: change_vote(writer, user.id, post_id, score))
+    if previous is None:
+        raise HTTPException(status_code=404, detail="You have not voted on this post.")
+
+    if previous != score:
+        await response_cache.invalidate("feed", "leaderboard")
+        await publish_vote_totals([post_id])
+    return {"message": "Vote updated"}
+
+
+@router.delete("/{post_id}/rate")
+async def retract_rating(
+    post_id: uuid.UUID,
+    user: TokenUser = Depends(current_token_user)
+):
+    removed = await write_queue.run(lambda writer: retract_vote(writer, user.id, post_id))
+    if removed is None:
+        raise HTTPException(status_code=404, detail="You have not voted on this post.")
+
+    await response_cache.invalidate("feed", "leaderboard")
+    await publish_vote_totals([post_id])
+    return {"message": "Vote withdrawn"}
+
+
+@router.get("/{post_id}/ratings", response_model=RatingSummary)
+async def get_rating_summary(
+    post_id: uuid.UUID,
+    session: AsyncSession = Depends(get_read_session)
+) -> RatingSummary:
+    result = await session.execute(
+        select(Posts.id, Posts.vote_count, Posts.average_rating, *HISTOGRAM_COLUMNS).where(Posts.id == post_id)
     )
-    await session.execute(stmt)
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    return RatingSummary(post_id=row.id, vote_count=row.vote_count, average_rating=row.average_rating, histogram=histogram(row))
+
+
+@router.post("/votes", response_model=VoteBatchResult, status_code=201)
+async def cast_vote_batch(
+    batch: VoteBatch,
+    user: TokenUser = Depends(current_token_user)
+) -> VoteBatchResult:
+    #if the same post shows up twice in a burst, the first vote counts
+    votes = {}
+    for vote in batch.votes:
+        votes.setdefault(vote.post_id, vote.score)
 
-    await session.commit()
-    return {"message": "Vote registered"}
-    
+    try:
+        accepted = await write_queue.run(lambda writer: cast_votes(writer, user.id, votes))
+    except IntegrityError:
+        raise HTTPException(status_code=404, detail="One or more posts do not exist")
+
+    if accepted:
+        await response_cache.invalidate("feed", "leaderboard")
+        await publish_vote_totals(accepted)
+
+    accepted_ids = set(accepted)
+    return VoteBatchResult(
+        accepted=[post_id for post_id in votes if post_id in accepted_ids],
+        already_voted=[post_id for post_id in votes if post_id not in accepted_ids],
+    )
 
 
 @router.delete("/{post_id}")
 async def delete_post(
     post_id: str,
-    session: AsyncSession = Depends(get_async_session),
-    user: User = Depends(current_active_user)
+    user: TokenUser = Depends(current_token_user)
 ):
-    try:
-        post_uuid = uuid.UUID(post_id)
-        result = await session.execute(select(Posts).where(Posts.id == post_uuid))
+    async def write(writer: AsyncSession):
+        result = await writer.execute(select(Posts).where(Posts.id == post_uuid))
         post = result.scalars().first()
 
         if not post:
@@ -306,11 +367,24 @@ async def delete_post(
         if user.id != post.user_id:
             raise HTTPException(status_code=403, detail="Post not found")
 
-        if post.imagekit_file_id:
-            imagekit.files.delete(post.imagekit_file_id)
+        #files are removed by the job worker once the delete has committed, so a slow or failing
+        #storage call can't hold the request or leave a post pointing at a missing file
+        for file_id in (post.imagekit_file_id, post.thumbnail_file_id, post.preview_file_id):
+            if file_id:
+                enqueue(writer, "delete_file", {"file_id": file_id})
 
-        await session.delete(post)
-        await session.commit()
+        #older databases were created without ON DELETE CASCADE on ratings.post_id
+        await writer.execute(delete(Rating).where(Rating.post_id == post_uuid))
+        await writer.delete(post)
+
+    try:
+        post_uuid = uuid.UUID(post_id)
+        await write_queue.run(write)
+        notify()
+        await response_cache.invalidate("feed", "leaderboard", comments_tag(post_uuid))
+        deleted = {"post_id": post_uuid}
+        await event_bus.publish("posts", "post_deleted", deleted)
+        await event_bus.publish(post_channel(post_uuid), "post_deleted", deleted)
 
         return {"success": True, "message": "Post deleted successfully"}
     except HTTPException:
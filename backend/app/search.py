@@ -0,0 +1,141 @@
+import re
+import uuid
+
+from sqlalchemy import Row, Select, column, exists, func, insert, literal_column, select, table, union_all
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from data.db import CommentSearchDocuments, Comments, Posts, SearchDocuments
+from app.pagination import after_descending, encode_cursor
+from app.serialization import POST_COLUMNS
+
+#sqlite: FTS5 indexes kept in sync with search_documents and comment_search_documents by triggers, ranked with bm25
+#postgres: generated, weighted tsvector columns with GIN indexes, ranked with ts_rank_cd
+#either way the application only ever writes plain rows: one per post (caption and document text) and one per
+#comment, combined per post when searching. The indexes and triggers are created by app/migrations.py
+#caption matches count most, then the resume itself, then what people said about it
+SQLITE_WEIGHTS = (4.0, 1.0)
+COMMENT_WEIGHT = 0.5 #sqlite, on postgres the comments' tsvector carries weight 'C'
+
+
+async def index_missing_documents(conn: AsyncConnection):
+    #posts and comments that came in without going through the app, e.g. a restored backup
+    missing_posts = select(Posts.id, Posts.caption, Posts.text_content).where(
+        ~exists().where(SearchDocuments.post_id == Posts.id)
+    )
+    await conn.execute(insert(SearchDocuments).from_select(["post_id", "caption", "body"], missing_posts))
+    await index_missing_comments(conn)
+
+
+async def index_missing_comments(conn: AsyncConnection | AsyncSession, post_id: uuid.UUID | None = None):
+    missing = select(Comments.id, Comments.post_id, Comments.body).where(
+        ~exists().where(CommentSearchDocuments.comment_id == Comments.id)
+    )
+    if post_id is not None:
+        missing = missing.where(Comments.post_id == post_id)
+    await conn.execute(
+        insert(CommentSearchDocuments).from_select(["comment_id", "post_id", "body"], missing)
+    )
+
+
+async def index_post(session: AsyncSession, post: Posts):
+    """Caller flushes `post` first so it has an id, and commits."""
+    session.add(SearchDocuments(post_id=post.id, caption=post.caption, body=post.text_content))
+
+
+async def index_comment(session: AsyncSession, comment: Comments):
+    """Caller flushes `comment` first so it has an id, and commits. Deletes need nothing, the row cascades."""
+    session.add(CommentSearchDocuments(comment_id=comment.id, post_id=comment.post_id, body=comment.body))
+
+
+def _fts5_query(q: str) -> str | None:
+    #user input goes in as quoted terms so FTS5 operators and stray quotes can't break the query;
+    #the last term is a prefix match so results show up while typing
+    terms = re.findall(r"\w+", q)
+    if not terms:
+        return None
+    quoted = [f'"{term}"' for term in terms]
+    quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def _matches(dialect_name: str, q: str):
+    """Subquery of (post_id, rank) for posts matching `q`, higher rank is better."""
+    if dialect_name == "postgresql":
+        query = func.websearch_to_tsquery("english", q)
+        document = literal_column("search_documents.document")
+        comment_document = literal_column("comment_search_documents.document")
+        posts = (
+            select(SearchDocuments.post_id, func.ts_rank_cd(document, query).label("rank"))
+            .where(document.op("@@")(query))
+        )
+        comments = (
+            select(CommentSearchDocuments.post_id, func.ts_rank_cd(comment_document, query).label("rank"))
+            .where(comment_document.op("@@")(query))
+        )
+        return _per_post(posts, comments)
+
+    fts = table("search_documents_fts", column("rowid"))
+    fts_table = literal_column("search_documents_fts")
+    comment_fts = table("comment_search_fts", column("rowid"))
+    comment_fts_table = literal_column("comment_search_fts")
+    match = _fts5_query(q)
+    #bm25 is lower-is-better, flip it so both dialects sort the same way
+    posts = (
+        select(SearchDocuments.post_id, (-func.bm25(fts_table, *SQLITE_WEIGHTS)).label("rank"))
+        .select_from(fts.join(SearchDocuments, SearchDocuments.id == fts.c.rowid))
+        .where(fts_table.op("MATCH")(match))
+    )
+    comments = (
+        select(CommentSearchDocuments.post_id, (-func.bm25(comment_fts_table) * COMMENT_WEIGHT).label("rank"))
+        .select_from(comment_fts.join(CommentSearchDocuments, CommentSearchDocuments.id == comment_fts.c.rowid))
+        .where(comment_fts_table.op("MATCH")(match))
+        #no limit at all, but with one sqlite won't flatten this into the per post max(), where bm25 can't run
+        .limit(-1)
+    )
+    return _per_post(posts, comments)
+
+
+def _per_post(posts: Select, comments: Select):
+    #a post's own rank plus that of its best matching comment, so a long thread doesn't outweigh the resume
+    best_comment = comments.subquery()
+    best_comment = select(best_comment.c.post_id, func.max(best_comment.c.rank).label("rank")).group_by(best_comment.c.post_id)
+    hits = union_all(posts, best_comment).subquery()
+    return select(hits.c.post_id, func.sum(hits.c.rank).label("rank")).group_by(hits.c.post_id).subquery()
+
+
+async def search_posts(
+    session: AsyncSession,
+    q: str,
+    cursor: str | None,
+    limit: int,
+    profile_type: str | None = None,
+    organization: str | None = None,
+    file_type: str | None = None,
+) -> tuple[list[Row], str | None]:
+    """Ranked posts matching `q` as POST_COLUMNS rows, one keyset page at a time ordered by (rank DESC, id DESC)."""
+    dialect_name = session.bind.dialect.name
+    if dialect_name != "postgresql" and _fts5_query(q) is None:
+        return [], None
+
+    matched = _matches(dialect_name, q)
+    stmt = (
+        select(*POST_COLUMNS, matched.c.rank)
+        .join(matched, matched.c.post_id == Posts.id)
+        .order_by(matched.c.rank.desc(), Posts.id.desc())
+        .limit(limit + 1)
+    )
+    if profile_type:
+        stmt = stmt.where(Posts.author_profile_type == profile_type)
+    if organization:
+        stmt = stmt.where(Posts.author_organization == organization)
+    if file_type:
+        stmt = stmt.where(Posts.file_type == file_type)
+    if cursor:
+        stmt = stmt.where(after_descending(matched.c.rank, Posts.id, cursor))
+
+    rows = (await session.execute(stmt)).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].rank, rows[-1].id)
+    return rows, next_cursor
@@ -0,0 +1,93 @@
+import json
+import uuid
+from datetime import datetime
+from typing import Any
+
+from fastapi.responses import Response
+from pydantic import BaseModel
+from sqlalchemy import Row
+
+from data.db import Comments, Posts, public_owner
+
+#the "speedups" extra (orjson) encodes several times faster; without it the stdlib encoder is used
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+#the list endpoints select these columns as plain rows and turn them into the Post / Comment json shape
+#directly: no ORM objects, no per row pydantic validation and no jsonable_encoder pass over the result.
+#the response_model on each route still documents the shape, keep the two in sync
+POST_COLUMNS = (
+    Posts.id, Posts.url, Posts.file_type, Posts.file_name, Posts.caption,
+    Posts.average_rating, Posts.vote_count, Posts.rank_score, Posts.comment_count,
+    Posts.page_count, Posts.thumbnail_url, Posts.preview_url, Posts.created_at,
+    Posts.username, Posts.author_profile_type, Posts.author_organization, Posts.author_headline,
+)
+
+HISTOGRAM_COLUMNS = (Posts.score_1, Posts.score_2, Posts.score_3, Posts.score_4, Posts.score_5)
+
+COMMENT_COLUMNS = (
+    Comments.id, Comments.post_id, Comments.body, Comments.parent_id, Comments.created_at,
+    Comments.username, Comments.author_profile_type, Comments.author_organization, Comments.author_headline,
+)
+
+
+def post_json(row: Row) -> dict:
+    return {
+        "post_id": row.id,
+        "url": row.url,
+        "file_type": row.file_type,
+        "file_name": row.file_name,
+        "caption": row.caption,
+        "owner": public_owner(row.username, row.author_profile_type, row.author_organization, row.author_headline),
+        "average_rating": row.average_rating or 0.0,
+        "vote_count": row.vote_count or 0,
+        "rank_score": row.rank_score,
+        "comment_count": row.comment_count,
+        "page_count": row.page_count,
+        "thumbnail_url": row.thumbnail_url,
+        "preview_url": row.preview_url,
+        "created_at": row.created_at,
+    }
+
+
+def histogram(row: Row) -> dict[str, int]:
+    #from a row that selected HISTOGRAM_COLUMNS. String keys, as json would make them anyway (orjson insists)
+    return {str(score): getattr(row, f"score_{score}") for score in range(1, 6)}
+
+
+def comment_json(row: Row) -> dict:
+    return {
+        "id": row.id,
+        "post_id": row.post_id,
+        "body": row.body,
+        "parent_comment_id": row.parent_id,
+        "owner": public_owner(row.username, row.author_profile_type, row.author_organization, row.author_headline),
+        "created_at": row.created_at,
+    }
+
+
+def _default(value: Any):
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """JSON bytes for dicts, lists, rows made by post_json/comment_json and pydantic models."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,105 @@
+import asyncio
+import os
+import shutil
+import uuid
+from typing import BinaryIO
+from urllib.parse import quote
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, UploadFile
+
+load_dotenv()
+
+#"imagekit" in production, "local" for tests and self hosting
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "imagekit")
+MEDIA_ROOT = os.environ.get("MEDIA_ROOT", os.path.join(os.path.dirname(__file__), "..", "data", "media"))
+MEDIA_URL = os.environ.get("MEDIA_URL", "http://localhost:8000/media").rstrip("/")
+
+MAX_UPLOAD_BYTES = int(os.environ.get("MAX_UPLOAD_BYTES", 10 * 1024 * 1024))
+CHUNK_SIZE = 1024 * 1024
+
+
+class StoredFile:
+    def __init__(self, url: str, file_id: str, name: str):
+        self.url = url
+        self.file_id = file_id #what delete() needs later, saved as Posts.imagekit_file_id
+        self.name = name
+
+
+class StorageBackend:
+    async def save(self, file: BinaryIO, file_name: str, folder: str) -> StoredFile:
+        raise NotImplementedError
+
+    async def delete(self, file_id: str):
+        raise NotImplementedError
+
+
+class ImageKitStorage(StorageBackend):
+    def __init__(self):
+        #imported here so the local backend doesn't need ImageKit credentials
+        from app.images import imagekit
+        self.imagekit = imagekit
+
+    async def save(self, file: BinaryIO, file_name: str, folder: str) -> StoredFile:
+        #the SDK is synchronous, run it on a worker thread so the event loop keeps serving other requests
+        result = await asyncio.to_thread(
+            self.imagekit.files.upload,
+            file=file,
+            file_name=file_name,
+            use_unique_file_name=True,
+            tags=["backend-upload"],
+            folder=folder,
+        )
+        if not result.url or not result.file_id:
+            raise HTTPException(status_code=502, detail="ImageKit upload returned incomplete data")
+        return StoredFile(url=result.url, file_id=result.file_id, name=result.name or file_name)
+
+    async def delete(self, file_id: str):
+        await asyncio.to_thread(self.imagekit.files.delete, file_id)
+
+
+class LocalStorage(StorageBackend):
+    """Writes files under MEDIA_ROOT, main.py serves them back at /media."""
+
+    def __init__(self, root: str, base_url: str):
+        self.root = root
+        self.base_url = base_url
+
+    def _copy(self, file: BinaryIO, relative_path: str):
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as out:
+            shutil.copyfileobj(file, out, CHUNK_SIZE)
+
+    async def save(self, file: BinaryIO, file_name: str, folder: str) -> StoredFile:
+        #unique prefix like ImageKit's use_unique_file_name, basename so names can't escape the folder
+        name = f"{uuid.uuid4().hex[:8]}_{os.path.basename(file_name)}"
+        relative_path = f"{folder.strip('/')}/{name}"
+        await asyncio.to_thread(self._copy, file, relative_path)
+        return StoredFile(url=f"{self.base_url}/{quote(relative_path)}", file_id=relative_path, name=name)
+
+    async def delete(self, file_id: str):
+        path = os.path.join(self.root, file_id)
+        if os.path.isfile(path):
+            await asyncio.to_thread(os.remove, path)
+
+
+async def check_upload_size(file: UploadFile) -> int:
+    """Walk the upload in chunks, stop as soon as it is over MAX_UPLOAD_BYTES, and rewind it.
+    Starlette has already spooled the body to a temp file, so this never holds more than a chunk."""
+    size = 0
+    while chunk := await file.read(CHUNK_SIZE):
+        size += len(chunk)
+        if size > MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    await file.seek(0)
+    return size
+
+
+def _make_storage() -> StorageBackend:
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(MEDIA_ROOT, MEDIA_URL)
+    return ImageKitStorage()
+
+
+storage = _make_storage()
@@ -0,0 +1,170 @@
+import uuid
+
+from sqlalchemy import Float, case, cast, delete, func, or_, select, update, bindparam
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from data.db import Posts, Rating
+from app.leaderboard import rank_score_sql, refresh_hot_scores
+
+SCORES = (1, 2, 3, 4, 5)
+
+
+def histogram_column(score: int):
+    return Posts.__table__.c[f"score_{score}"]
+
+
+def average_sql(total, count):
+    return case((count > 0, cast(total, Float) / count), else_=0.0)
+
+
+def _aggregate_values(added=None, removed=None):
+    """SET values for a post gaining the rating `added` and/or losing the rating `removed`, each a
+    number or a per row SQL expression. SET expressions see the old row, so the derived columns
+    describe the post after the change."""
+    count, total = Posts.vote_count, Posts.rating_sum
+    histogram = {score: histogram_column(score) for score in SCORES}
+    for rating, sign in ((added, 1), (removed, -1)):
+        if rating is None:
+            continue
+        count, total = count + sign, (total + rating if sign > 0 else total - rating)
+        if isinstance(rating, int):
+            histogram[rating] = histogram[rating] + sign
+        else:
+            #the score differs per row (a bindparam or a CTE column), so every bucket gets a CASE
+            for score in SCORES:
+                hit = case((rating == score, 1), else_=0)
+                histogram[score] = histogram[score] + hit if sign > 0 else histogram[score] - hit
+
+    values = dict(
+        vote_count=count,
+        rating_sum=total,
+        average_rating=average_sql(total, count),
+        rank_score=rank_score_sql(total, count),
+    )
+    for score, value in histogram.items():
+        if value is not histogram_column(score):
+            values[f"score_{score}"] = value
+    return values
+
+
+async def cast_votes(session: AsyncSession, user_id: uuid.UUID, votes: dict[uuid.UUID, int]) -> list[uuid.UUID]:
+    """Record votes and fold them into the post aggregates, skipping posts the user already voted on.
+
+    Returns the post ids whose vote was accepted. The ratings primary key decides who wins a race,
+    so there is no check-then-insert window. Caller commits; an IntegrityError means a post doesn't exist.
+    """
+    rows = [{"user_id": user_id, "post_id": post_id, "score": score} for post_id, score in votes.items()]
+
+    if session.bind.dialect.name == "postgresql":
+        #one round trip: the UPDATE only sees the rows the INSERT actually wrote
+        new_votes = (
+            postgresql.insert(Rating).values(rows)
+            .on_conflict_do_nothing()
+            .returning(Rating.post_id, Rating.score)
+            .cte("new_votes")
+        )
+        result = await session.execute(
+            update(Posts)
+            .where(Posts.id == new_votes.c.post_id)
+            .values(**_aggregate_values(added=new_votes.c.score))
+            .returning(Posts.id),
+            #the ORM's session sync wants to evaluate the WHERE itself and drops RETURNING against a CTE
+            execution_options={"synchronize_session": False},
+        )
+        accepted = list(result.scalars().all())
+        if accepted:
+            await refresh_hot_scores(session, accepted)
+        return accepted
+
+    #sqlite can't put DML in a CTE, so it's INSERT ... RETURNING then one executemany UPDATE in the same transaction
+    result = await session.execute(
+        sqlite.insert(Rating).values(rows)
+        .on_conflict_do_nothing()
+        .returning(Rating.post_id, Rating.score)
+    )
+    accepted = result.all()
+    if accepted:
+        posts = Posts.__table__
+        await session.execute(
+            update(posts)
+            .where(posts.c.id == bindparam("voted_post_id"))
+            .values(**_aggregate_values(added=bindparam("voted_score"))),
+            [{"voted_post_id": post_id, "voted_score": score} for post_id, score in accepted],
+        )
+        await refresh_hot_scores(session, [post_id for post_id, _ in accepted])
+    return [post_id for post_id, _ in accepted]
+
+
+async def change_vote(session: AsyncSession, user_id: uuid.UUID, post_id: uuid.UUID, score: int) -> int | None:
+    """Replace the user's score on a post. Returns the previous score, None if they hadn't voted. Caller commits."""
+    #a no-op UPDATE rather than a SELECT to read the old score: it locks the rating row (sqlite: takes
+    #the write lock), so a concurrent change or retraction of the same vote waits for us and can't
+    #subtract a score that is no longer there
+    result = await session.execute(
+        update(Rating)
+        .where(Rating.user_id == user_id, Rating.post_id == post_id)
+        .values(score=Rating.score)
+        .returning(Rating.score)
+    )
+    previous = result.scalar_one_or_none()
+    if previous is None or previous == score:
+        return previous
+    await session.execute(
+        update(Rating).where(Rating.user_id == user_id, Rating.post_id == post_id).values(score=score)
+    )
+    await session.execute(update(Posts).where(Posts.id == post_id).values(**_aggregate_values(added=score, removed=previous)))
+    await refresh_hot_scores(session, [post_id])
+    return previous
+
+
+async def retract_vote(session: AsyncSession, user_id: uuid.UUID, post_id: uuid.UUID) -> int | None:
+    """Withdraw the user's vote on a post. Returns the removed score, None if they hadn't voted. Caller commits."""
+    #whichever concurrent retraction deletes the row is the one that gets its score back
+    result = await session.execute(
+        delete(Rating).where(Rating.user_id == user_id, Rating.post_id == post_id).returning(Rating.score)
+    )
+    removed = result.scalar_one_or_none()
+    if removed is not None:
+        await session.execute(update(Posts).where(Posts.id == post_id).values(**_aggregate_values(removed=removed)))
+        await refresh_hot_scores(session, [post_id])
+    return removed
+
+
+async def reconcile_aggregates(conn: AsyncConnection | AsyncSession, post_ids: list[uuid.UUID] | None = None) -> int:
+    """Recount the aggregates of `post_ids` (every post if None) from ratings, in one statement.
+    Only posts whose counters disagree are written. Returns how many that was. Caller commits."""
+    histogram = [
+        func.coalesce(func.sum(case((Rating.score == score, 1), else_=0)), 0).label(f"s{score}") for score in SCORES
+    ]
+    stats = (
+        select(
+            Posts.id.label("post_id"),
+            func.count(Rating.post_id).label("n"),
+            func.coalesce(func.sum(Rating.score), 0).label("total"),
+            *histogram,
+        )
+        .select_from(Posts)
+        .outerjoin(Rating, Rating.post_id == Posts.id)
+        .group_by(Posts.id)
+    )
+    if post_ids is not None:
+        stats = stats.where(Posts.id.in_(post_ids))
+    stats = stats.subquery()
+
+    total, count = stats.c.total, stats.c.n
+    values = dict(
+        vote_count=count,
+        rating_sum=total,
+        average_rating=average_sql(total, count),
+        rank_score=rank_score_sql(total, count),
+    )
+    drifted = [Posts.vote_count != count, Posts.rating_sum != total]
+    for score in SCORES:
+        values[f"score_{score}"] = stats.c[f"s{score}"]
+        drifted.append(histogram_column(score) != stats.c[f"s{score}"])
+
+    result = await conn.execute(
+        update(Posts).where(Posts.id == stats.c.post_id, or_(*drifted)).values(**values)
+    )
+    return result.rowcount
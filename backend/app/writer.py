@@ -0,0 +1,157 @@
+#GROUP COMMIT
+#on sqlite every commit takes the file's write lock and appends to the WAL, so one transaction per vote caps
+#throughput at commits per second. Writes handed to write_queue.run() are applied by a single task instead,
+#as many as are waiting (up to WRITE_BATCH_SIZE) in one transaction with one commit. Callers get their own
+#result or exception back as if they had committed alone.
+#every write of the post and comment routers goes through here, their reads use the read sessions. Left on
+#the write connection directly, on purpose: fastapi-users (register, login, profile updates) commits on its
+#own session through get_user_db and can't be handed a shared transaction, and the job worker, migrations
+#and app.backup run their own transactions outside any request. They take turns with the queue for the
+#connection, they are just not batched
+import asyncio
+import contextvars
+import logging
+import os
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
+
+from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from data.db import SessionLocal, engine
+
+load_dotenv()
+logger = logging.getLogger(__name__)
+
+#on by default for sqlite. Postgres handles concurrent transactions itself, there each write commits on its own
+GROUP_COMMIT = os.environ.get("GROUP_COMMIT", "1" if engine.dialect.name == "sqlite" else "0") == "1"
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", 64))
+#0: batch whatever queued up while the previous commit ran, never wait for company. A few ms more latency
+#per write buys bigger batches when writes arrive steadily but not all at once
+WRITE_BATCH_WAIT_MS = float(os.environ.get("WRITE_BATCH_WAIT_MS", 0))
+
+T = TypeVar("T")
+Work = Callable[[AsyncSession], Awaitable[T]]
+
+
+class WriteQueue:
+    def __init__(self):
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        self.stats = {"writes": 0, "batches": 0, "retried": 0}
+
+    async def run(self, work: Work[T]) -> T:
+        """Run `work(session)` in a write transaction and commit it. `work` must not commit or roll back,
+        and must not touch another session: in a batch it shares the transaction with other requests,
+        and runs again if another write in its batch fails."""
+        if not GROUP_COMMIT:
+            async with SessionLocal() as session:
+                result = await work(session)
+                await session.commit()
+                return result
+
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            #a fresh context: started from a request, it would otherwise charge every later write's
+            #queries to that request's stats (app/instrumentation.py)
+            self._task = asyncio.create_task(self._drain(), context=contextvars.Context())
+        done = asyncio.get_running_loop().create_future()
+        #the caller's context goes along, each write's statements are charged to the request that queued it
+        await self._queue.put((work, done, contextvars.copy_context()))
+        return await done
+
+    async def close(self):
+        """Finish the writes already queued, then stop."""
+        if self._task is not None and not self._task.done():
+            await self._queue.put(None)
+            await self._task
+        self._task = None
+
+    async def _next_batch(self) -> list:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + WRITE_BATCH_WAIT_MS / 1000
+        while batch[-1] is not None and len(batch) < WRITE_BATCH_SIZE:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _drain(self):
+        while True:
+            batch = await self._next_batch()
+            closing = batch[-1] is None
+            if closing:
+                batch.pop()
+            if batch:
+                try:
+                    await self._apply(batch)
+                except Exception:
+                    logger.exception("Write batch failed")
+            if closing:
+                return
+
+    async def _apply(self, batch: list):
+        results = []
+        try:
+            async with SessionLocal() as session:
+                for work, _, context in batch:
+                    results.append(await asyncio.create_task(_run(work, session), context=context))
+                await session.commit()
+        except Exception as e:
+            if len(batch) == 1:
+                _settle(batch[0][1], error=e)
+                return
+            if len(results) < len(batch):
+                #one write failed (a post deleted meanwhile, a permission check) and rolled back the whole batch.
+                #it saw what it would have seen committing alone after the ones before it, so its error
+                #stands, the rest go again without it
+                failed = len(results)
+                _settle(batch[failed][1], error=e)
+                self.stats["retried"] += len(batch) - 1
+                await self._apply(batch[:failed] + batch[failed + 1:])
+                return
+            #the commit itself failed, nothing to tell the writes apart: each on its own
+            self.stats["retried"] += len(batch)
+            for item in batch:
+                await self._apply([item])
+            return
+
+        self.stats["batches"] += 1
+        self.stats["writes"] += len(batch)
+        for (_, done, _), result in zip(batch, results):
+            _settle(done, result=result)
+
+    def render_metrics(self) -> str:
+        return (
+            "# HELP peercv_write_queue_total Writes through the group commit queue\n"
+            "# TYPE peercv_write_queue_total counter\n"
+            + "".join(f'peercv_write_queue_total{{kind="{k}"}} {v}\n' for k, v in self.stats.items())
+        )
+
+
+async def _run(work: Work[T], session: AsyncSession) -> T:
+    result = await work(session)
+    #what it left pending goes out now: charged to its request rather than to the commit, and a failing
+    #insert or delete is pinned on the write that made it
+    await session.flush()
+    return result
+
+
+def _settle(done: asyncio.Future, result: Any = None, error: Exception | None = None):
+    #the caller may have gone away (client disconnect cancels the request), the write stands regardless
+    if done.done():
+        return
+    if error is not None:
+        done.set_exception(error)
+    else:
+        done.set_result(result)
+
+
+write_queue = WriteQueue()
@@ -0,0 +1,130 @@
+#STATELESS FAST PATH
+#login tokens carry the user's public profile as claims, so endpoints that only need "who is this"
+#can trust the signature instead of loading the users row on every request.
+#a profile change, deactivation or delete revokes the claims of every token issued before it: those requests
+#fall back to the database (through a short-lived cache) until the user logs in again. Revocations are rows
+#in token_revocations, every worker reloads the recent ones every TOKEN_REVOCATION_SYNC_SECONDS
+import os
+import time
+import uuid
+
+from dotenv import load_dotenv
+from fastapi_users import models
+from fastapi_users.authentication import JWTStrategy
+from fastapi_users.jwt import generate_jwt
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from data.db import PrimaryReadSessionLocal, TokenRevocations, User
+
+load_dotenv()
+
+#"0" issues plain tokens (just the user id), every request then goes through the verified user cache
+TOKEN_CLAIMS = os.environ.get("AUTH_TOKEN_CLAIMS", "1") == "1"
+VERIFIED_USER_TTL = int(os.environ.get("VERIFIED_USER_TTL_SECONDS", 30))
+#how stale a worker's view of revocations made by other workers may get. One small indexed query per worker per period
+TOKEN_REVOCATION_SYNC_SECONDS = float(os.environ.get("TOKEN_REVOCATION_SYNC_SECONDS", 5))
+TOKEN_LIFETIME_SECONDS = 3600
+
+CLAIM_FIELDS = ("username", "profile_type", "organization", "program", "year_of_study", "job_title")
+
+
+class TokenUser:
+    """The part of a User that endpoints need, built from token claims or a users row."""
+
+    def __init__(self, id: uuid.UUID, username: str, is_active: bool = True, profile_type=None,
+                 organization=None, program=None, year_of_study=None, job_title=None):
+        self.id = id
+        self.username = username
+        self.is_active = is_active
+        self.profile_type = profile_type
+        self.organization = organization
+        self.program = program
+        self.year_of_study = year_of_study
+        self.job_title = job_title
+
+    headline = User.headline #same formula, so author snapshots match either way
+
+    @classmethod
+    def from_claims(cls, claims: dict) -> "TokenUser":
+        return cls(id=uuid.UUID(claims["sub"]), is_active=claims["active"], **{f: claims.get(f) for f in CLAIM_FIELDS})
+
+    @classmethod
+    def from_user(cls, user: User) -> "TokenUser":
+        return cls(id=user.id, is_active=user.is_active, **{f: getattr(user, f) for f in CLAIM_FIELDS})
+
+
+class ClaimsJWTStrategy(JWTStrategy):
+    async def write_token(self, user: models.UP) -> str:
+        data = {"sub": str(user.id), "aud": self.token_audience, "iat": time.time()}
+        if TOKEN_CLAIMS:
+            data["active"] = user.is_active
+            data.update({field: getattr(user, field) for field in CLAIM_FIELDS})
+        return generate_jwt(data, self.encode_key, self.lifetime_seconds, algorithm=self.algorithm)
+
+
+#users read from the database by the fallback path, per process
+_verified: dict[uuid.UUID, tuple[float, TokenUser]] = {}
+#user id -> when their claims were revoked, the token_revocations rows of the last token lifetime
+_revoked: dict[uuid.UUID, float] = {}
+_revocations_synced_at = float("-inf") #time.monotonic()
+
+
+def cached_user(user_id: uuid.UUID) -> TokenUser | None:
+    entry = _verified.get(user_id)
+    if entry is None or entry[0] < time.monotonic():
+        _verified.pop(user_id, None)
+        return None
+    return entry[1]
+
+
+def cache_user(user: TokenUser):
+    _verified[user.id] = (time.monotonic() + VERIFIED_USER_TTL, user)
+
+
+async def revoke_user(session: AsyncSession, user_id: uuid.UUID):
+    """Stop trusting claims in tokens issued to `user_id` before now. Caller commits."""
+    now = time.time()
+    insert = postgresql.insert if session.bind.dialect.name == "postgresql" else sqlite.insert
+    await session.execute(
+        insert(TokenRevocations).values(user_id=user_id, revoked_at=now)
+        .on_conflict_do_update(index_elements=[TokenRevocations.user_id], set_={"revoked_at": now})
+    )
+    #every token these apply to has expired
+    await session.execute(delete(TokenRevocations).where(TokenRevocations.revoked_at < now - TOKEN_LIFETIME_SECONDS))
+    #this worker knows right away, the others at their next sync
+    _revoked[user_id] = now
+    _verified.pop(user_id, None)
+
+
+async def _sync_revocations():
+    global _revocations_synced_at
+    if time.monotonic() < _revocations_synced_at + TOKEN_REVOCATION_SYNC_SECONDS:
+        return
+    #claimed before the query, so requests arriving meanwhile use what we have instead of querying too
+    _revocations_synced_at = time.monotonic()
+    try:
+        async with PrimaryReadSessionLocal() as session:
+            result = await session.execute(
+                select(TokenRevocations.user_id, TokenRevocations.revoked_at)
+                .where(TokenRevocations.revoked_at >= time.time() - TOKEN_LIFETIME_SECONDS)
+            )
+            revoked = dict(result.tuples().all())
+    except Exception:
+        _revocations_synced_at = float("-inf")
+        raise
+    for user_id, revoked_at in revoked.items():
+        if _revoked.get(user_id, float("-inf")) < revoked_at:
+            _revoked[user_id] = revoked_at
+            #revoked elsewhere: the fallback cache may hold the old profile or active flag
+            _verified.pop(user_id, None)
+    #merged rather than replaced, a revocation made here may not have committed when the query ran
+    expired = time.time() - TOKEN_LIFETIME_SECONDS
+    for user_id in [user_id for user_id, revoked_at in _revoked.items() if revoked_at < expired]:
+        del _revoked[user_id]
+
+
+async def claims_revoked(user_id: uuid.UUID, issued_at: float) -> bool:
+    await _sync_revocations()
+    return user_id in _revoked and issued_at <= _revoked[user_id]
@@ -3,13 +3,18 @@ import os
 import uuid
 from typing import Optional
 
+import jwt
 from dotenv import load_dotenv
-from fastapi import Depends, Request
+from fastapi import Depends, HTTPException, Request
 from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin, models
-from fastapi_users.authentication import (AuthenticationBackend, BearerTransport, JWTStrategy)
+from fastapi_users.authentication import (AuthenticationBackend, BearerTransport)
 from fastapi_users.db import SQLAlchemyUserDatabase
+from fastapi_users.jwt import decode_jwt
 
-from data.db import User, get_user_db
+from data.db import PrimaryReadSessionLocal, User, get_user_db
+from app.authors import PROFILE_FIELDS, invalidate_author, sync_author_snapshot
+from auth.tokens import (TOKEN_LIFETIME_SECONDS, ClaimsJWTStrategy, TokenUser, cache_user, cached_user,
+                         claims_revoked, revoke_user)
 from data.schemas import UserCreate, UserRead, UserUpdate
 
 load_dotenv()
@@ -32,6 +37,23 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]): #[UserModel, I
     async def on_after_request_verify(self, user, token, request = None):
         return await super().on_after_request_verify(user, token, request)
 
+    async def on_after_update(self, user, update_dict, request = None):
+        #tokens issued before this carry the old profile (or an active flag that no longer holds)
+        if (PROFILE_FIELDS | {"is_active"}) & update_dict.keys():
+            await revoke_user(self.user_db.session, user.id)
+            await self.user_db.session.commit()
+        #posts and comments carry a copy of the author's public profile, refresh it
+        if PROFILE_FIELDS & update_dict.keys():
+            post_ids = await sync_author_snapshot(self.user_db.session, user)
+            await self.user_db.session.commit()
+            await invalidate_author(post_ids)
+        return await super().on_after_update(user, update_dict, request)
+
+    async def on_before_delete(self, user, request = None):
+        #committed together with the delete
+        await revoke_user(self.user_db.session, user.id)
+        return await super().on_before_delete(user, request)
+
 async def get_user_manager(user_db: SQLAlchemyUserDatabase=Depends(get_user_db)):
     yield UserManager(user_db) #each time this is called, then we pass in session and the ability to interact with it
 
@@ -48,8 +70,9 @@ bearer_transport = BearerTransport(tokenUrl="auth/jwt/login")
 #creates a token to represent an authenticated session
 #token: header, payload, signature
 #the signature is what gets checked as we perform computation on payload
+#tokens also carry the user's public profile, see auth/tokens.py
 def get_jwt_strategy():
-    return JWTStrategy(secret=SECRET, lifetime_seconds=3600)
+    return ClaimsJWTStrategy(secret=SECRET, lifetime_seconds=TOKEN_LIFETIME_SECONDS)
 
 auth_backend = AuthenticationBackend(name="jwt",
                                      transport=bearer_transport,
@@ -61,3 +84,38 @@ fastapi_users = FastAPIUsers[User, uuid.UUID](get_user_manager, [auth_backend])
 
 #this returns a dependency function from the orchestrator
 current_active_user = fastapi_users.current_user(active=True)
+
+
+#lighter than current_active_user for endpoints that only need the id and public profile:
+#the signed claims are trusted unless they were revoked after the token was issued, and only then
+#(or for tokens without claims) is the users row read, through a short-lived cache
+async def current_token_user(token: Optional[str] = Depends(bearer_transport.scheme)) -> TokenUser:
+    if token is None:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    try:
+        claims = decode_jwt(token, SECRET, ["fastapi-users:auth"])
+        user_id = uuid.UUID(claims["sub"])
+    except (jwt.PyJWTError, KeyError, ValueError):
+        raise HTTPException(status_code=401, detail="Unauthorized")
+
+    if "active" in claims and not await claims_revoked(user_id, claims.get("iat", 0)):
+        user = TokenUser.from_claims(claims)
+    else:
+        user = cached_user(user_id)
+        if user is None:
+            async with PrimaryReadSessionLocal() as session:
+                row = await session.get(User, user_id)
+            if row is None:
+                raise HTTPException(status_code=401, detail="Unauthorized")
+            user = TokenUser.from_user(row)
+            cache_user(user)
+
+    if not user.is_active:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return user
+
+#the same check for endpoints that also serve anonymous visitors: None without a token, 401 for a bad one
+async def optional_token_user(token: Optional[str] = Depends(bearer_transport.scheme)) -> Optional[TokenUser]:
+    if token is None:
+        return None
+    return await current_token_user(token)
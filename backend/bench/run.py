@@ -0,0 +1,290 @@
+#LOAD TEST
+#seeds a throwaway database and drives the main read/write endpoints at a fixed concurrency.
+#run from backend/:
+#   python -m bench.run --users 200 --posts 2000 --requests 500 --concurrency 16 --save bench/baseline.json
+#   python -m bench.run ... --compare bench/baseline.json   (exit code 1 if an endpoint got slower)
+#each endpoint is measured --runs times. Compare only fails on latency when every run is slower than every
+#baseline run by more than --threshold, with enough requests on both sides: one p95 from a few hundred
+#requests moves by tens of percent between identical runs
+#by default the app runs in-process over httpx's ASGI transport, pass --url to hit a running server
+#that uses the same --database-url instead
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Seed synthetic data and load test the backend")
+    parser.add_argument("--database-url", help="defaults to a fresh sqlite file in a temp directory")
+    parser.add_argument("--url", help="base url of a running server, defaults to the app in-process")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--posts", type=int, default=1_000)
+    parser.add_argument("--ratings-per-post", type=int, default=10)
+    parser.add_argument("--comments-per-post", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=300, help="requests per endpoint per run")
+    parser.add_argument("--runs", type=int, default=3, help="times each endpoint is measured")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per endpoint before its runs")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--endpoints", help="comma separated subset of: " + ", ".join(ENDPOINTS))
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache to measure the database path")
+    parser.add_argument("--skip-seed", action="store_true", help="reuse data already in --database-url")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="write results as json to this path")
+    parser.add_argument("--compare", help="baseline json from an earlier --save")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed p95 slowdown before --compare fails")
+    parser.add_argument("--min-samples", type=int, default=500,
+                        help="requests per endpoint both runs need before --compare fails on latency")
+    return parser.parse_args()
+
+
+class Context:
+    def __init__(self, user_ids, post_ids, rated, tokens, rng):
+        self.user_ids = user_ids
+        self.post_ids = post_ids
+        self.rated = rated #(user_id, post_id) pairs, so rate requests only send new votes
+        self.tokens = tokens #user_id -> bearer token
+        self.rng = rng
+
+    def auth(self, user_id=None):
+        user_id = user_id or self.rng.choice(list(self.tokens))
+        return {"Authorization": f"Bearer {self.tokens[user_id]}"}
+
+    def post_id(self):
+        return self.rng.choice(self.post_ids)
+
+
+def _feed(ctx):
+    return "GET", "/posts/", {}, None
+
+
+def _queue(ctx):
+    return "GET", "/posts/queue", {}, ctx.auth()
+
+
+def _leaderboard(ctx):
+    return "GET", "/posts/leaderboard", {"window": ctx.rng.choice(["week", "month", "all"])}, None
+
+
+def _rate(ctx):
+    for _ in range(100):
+        user_id, post_id = ctx.rng.choice(list(ctx.tokens)), ctx.post_id()
+        if (user_id, post_id) not in ctx.rated:
+            ctx.rated.add((user_id, post_id))
+            return "POST", f"/posts/{post_id}/rate", {"score": ctx.rng.randint(1, 5)}, ctx.auth(user_id)
+    raise RuntimeError("Every sampled (user, post) pair already voted, seed more posts")
+
+
+def _comments(ctx):
+    return "GET", f"/comments/{ctx.post_id()}", {}, None
+
+
+ENDPOINTS = {
+    "feed": _feed,
+    "queue": _queue,
+    "leaderboard": _leaderboard,
+    "rate": _rate,
+    "comments": _comments,
+}
+
+
+#app/instrumentation.py reports each request's statement count in its Server-Timing header
+_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def query_count(response: httpx.Response) -> int:
+    match = _QUERIES.search(response.headers.get("server-timing", ""))
+    return int(match.group(1)) if match else 0
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def measure(client: httpx.AsyncClient, name: str, ctx: Context, total: int, concurrency: int):
+    """Send `total` requests to one endpoint. Returns latencies in ms, query counts, errors and seconds taken."""
+    latencies, queries, errors = [], [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        nonlocal errors
+        method, path, params, headers = ENDPOINTS[name](ctx)
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.request(method, path, params=params, headers=headers)
+            latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(query_count(response))
+            if response.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(total)))
+    return latencies, queries, errors, time.perf_counter() - started
+
+
+async def run_endpoint(client: httpx.AsyncClient, name: str, ctx: Context, total: int, concurrency: int,
+                       runs: int, warmup: int) -> dict:
+    #the first requests fill caches and prepare statements, they would land in the first run's tail
+    if warmup:
+        await measure(client, name, ctx, warmup, concurrency)
+    latencies, queries, errors, elapsed, run_p95 = [], [], 0, 0.0, []
+    for _ in range(runs):
+        run_latencies, run_queries, run_errors, run_elapsed = await measure(client, name, ctx, total, concurrency)
+        latencies += run_latencies
+        queries += run_queries
+        errors += run_errors
+        elapsed += run_elapsed
+        run_p95.append(round(percentile(run_latencies, 95), 2))
+
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "run_p95_ms": run_p95,
+        "mean_queries": round(statistics.mean(queries), 2) if queries else 0,
+        "max_queries": max(queries, default=0),
+    }
+
+
+def print_report(results: dict):
+    print(f"\n{'endpoint':<12} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'errors':>7}")
+    for name, r in results.items():
+        print(f"{name:<12} {r['throughput_rps']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9} {r['mean_queries']:>8.1f} {r['errors']:>7}")
+
+
+def slower(before: dict, now: dict, threshold: float, min_samples: int) -> str | None:
+    """Why `now` counts as slower than `before`, None if it doesn't (or the runs can't tell)."""
+    change = (now["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+    if change <= threshold:
+        return None
+    #results saved before --runs have a single p95
+    before_runs, now_runs = before.get("run_p95_ms", [before["p95_ms"]]), now.get("run_p95_ms", [now["p95_ms"]])
+    if min(before["requests"], now["requests"]) < min_samples or min(len(before_runs), len(now_runs)) < 2:
+        return "too few samples to tell"
+    #noise: the runs of either side spread over the gap. A real slowdown moves every run
+    if min(now_runs) <= max(before_runs) * (1 + threshold):
+        return "within run-to-run noise"
+    return "REGRESSION"
+
+
+def compare(results: dict, baseline_path: str, threshold: float, min_samples: int) -> bool:
+    """Print the p95 and query count change against a saved run; False if any endpoint regressed."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+
+    ok = True
+    print(f"\n{'endpoint':<12} {'p95 before':>11} {'p95 now':>9} {'change':>8} {'queries':>12}")
+    for name, r in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]
+        change = (r["p95_ms"] - before["p95_ms"]) / before["p95_ms"] if before["p95_ms"] else 0.0
+        verdict = slower(before, r, threshold, min_samples)
+        #a query count going up is a regression no matter how fast the machine is,
+        #half a query of slack for endpoints whose count depends on the sampled data (queue rounds)
+        if r["mean_queries"] > before["mean_queries"] + 0.5:
+            verdict = "REGRESSION"
+        regressed = verdict == "REGRESSION"
+        ok = ok and not regressed
+        flag = f"  {verdict}" if verdict else ""
+        print(
+            f"{name:<12} {before['p95_ms']:>11} {r['p95_ms']:>9} {change:>+8.0%} "
+            f"{before['mean_queries']:>5} -> {r['mean_queries']:<4}{flag}"
+        )
+    return ok
+
+
+async def main(args) -> int:
+    #the app reads its configuration at import time, so everything is set before importing it
+    temp_dir = tempfile.mkdtemp(prefix="peercv-bench-")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{os.path.join(temp_dir, 'bench.db')}"
+    os.environ.setdefault("JWT_SECRET", "peercv-benchmark-secret-not-for-production")
+    #the load comes from a handful of simulated clients, which the rate limits would throttle
+    os.environ.setdefault("ADMISSION_CONTROL", "0")
+    #local storage in place of ImageKit, nothing leaves the machine
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["MEDIA_ROOT"] = os.path.join(temp_dir, "media")
+    if args.no_cache:
+        os.environ["CACHE_TTL_SECONDS"] = "0"
+
+    from sqlalchemy import select
+
+    from app.main import app, lifespan
+    from auth.users import get_jwt_strategy
+    from bench.seed import seed
+    from data.db import Posts, Rating, SessionLocal, User, engine
+
+    names = args.endpoints.split(",") if args.endpoints else list(ENDPOINTS)
+    unknown = set(names) - ENDPOINTS.keys()
+    if unknown:
+        print(f"Unknown endpoints: {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+
+    async with lifespan(app):
+        if not args.skip_seed:
+            started = time.perf_counter()
+            await seed(engine, args.users, args.posts, args.ratings_per_post, args.comments_per_post, args.seed)
+            print(f"seeded {args.users} users, {args.posts} posts in {time.perf_counter() - started:.1f}s")
+
+        async with SessionLocal() as session:
+            users = (await session.scalars(select(User).limit(max(args.concurrency * 4, 50)))).all()
+            post_ids = list((await session.scalars(select(Posts.id))).all())
+            user_ids = [user.id for user in users]
+            rated = set((await session.execute(
+                select(Rating.user_id, Rating.post_id).where(Rating.user_id.in_(user_ids))
+            )).tuples().all())
+        if not users or not post_ids:
+            print("The database has no users or posts, run without --skip-seed", file=sys.stderr)
+            return 2
+
+        strategy = get_jwt_strategy()
+        tokens = {user.id: await strategy.write_token(user) for user in users}
+        ctx = Context(user_ids, post_ids, rated, tokens, random.Random(args.seed))
+
+        if args.url is None:
+            transport = httpx.ASGITransport(app=app)
+            client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+        else:
+            client = httpx.AsyncClient(base_url=args.url, timeout=30)
+
+        results = {}
+        async with client:
+            for name in names:
+                results[name] = await run_endpoint(
+                    client, name, ctx, args.requests, args.concurrency, args.runs, args.warmup
+                )
+
+    print_report(results)
+
+    if args.save:
+        run = {
+            "settings": {k: v for k, v in vars(args).items() if k not in ("save", "compare")},
+            "dialect": engine.dialect.name,
+            "results": results,
+        }
+        with open(args.save, "w") as f:
+            json.dump(run, f, indent=2)
+        print(f"\nsaved to {args.save}")
+
+    if args.compare and not compare(results, args.compare, args.threshold, args.min_samples):
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
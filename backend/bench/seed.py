@@ -0,0 +1,149 @@
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi_users.password import PasswordHelper
+from sqlalchemy import insert
+
+from data.db import CommentSearchDocuments, Comments, Posts, Rating, SearchDocuments, User
+from app.leaderboard import bayesian_score, hot_score
+
+BATCH_SIZE = 1_000
+PASSWORD = "benchmark-password"
+
+WORDS = (
+    "python rust go typescript react fastapi postgres kubernetes docker aws gcp ml pytorch "
+    "product design figma research intern backend frontend data analyst startup leadership"
+).split()
+
+
+def _uuid(rng: random.Random) -> uuid.UUID:
+    #from the seeded generator, so the same --seed gives the same ids run to run
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+async def _insert(conn, model, rows):
+    for start in range(0, len(rows), BATCH_SIZE):
+        await conn.execute(insert(model), rows[start:start + BATCH_SIZE])
+
+
+async def seed(engine, users: int, posts: int, ratings_per_post: int, comments_per_post: int, seed: int = 42) -> dict:
+    """Fill an empty database with synthetic users, posts, ratings and nested comments.
+
+    Rows go in with batched executemany INSERTs straight through the data/db.py models, with the
+    denormalized columns (aggregates, author snapshot, reply counts, search text) filled in the
+    way the write paths would. Returns the generated user and post ids.
+    """
+    rng = random.Random(seed)
+    hashed_password = PasswordHelper().hash(PASSWORD)
+    now = datetime.utcnow()
+
+    user_rows = []
+    for i in range(users):
+        student = rng.random() < 0.7
+        user_rows.append({
+            "id": _uuid(rng),
+            "email": f"bench{i}@example.com",
+            "hashed_password": hashed_password,
+            "is_active": True,
+            "is_superuser": False,
+            "is_verified": True,
+            "username": f"bench{i}",
+            "profile_type": "student" if student else "professional",
+            "organization": rng.choice(["Waterloo", "UofT", "McGill", "Stripe", "Shopify"]),
+            "program": "Computer Science" if student else None,
+            "year_of_study": rng.randint(1, 5) if student else None,
+            "job_title": None if student else rng.choice(["SWE", "PM", "Designer"]),
+        })
+
+    def headline(user):
+        return user["job_title"] or f"{user['program']}, Year {user['year_of_study']}"
+
+    post_rows, rating_rows, comment_rows, search_rows = [], [], [], []
+    for i in range(posts):
+        author = rng.choice(user_rows)
+        post_id = _uuid(rng)
+        caption = _sentence(rng, 6)
+        text_content = _sentence(rng, 80)
+
+        voters = rng.sample(user_rows, min(ratings_per_post, users))
+        scores = [rng.randint(1, 5) for _ in voters]
+        rating_rows += [{"user_id": voter["id"], "post_id": post_id, "score": score} for voter, score in zip(voters, scores)]
+
+        comments = []
+        for _ in range(comments_per_post):
+            #half the comments reply to an earlier one, so threads nest a few levels deep
+            parent = rng.choice(comments) if comments and rng.random() < 0.5 else None
+            commenter = rng.choice(user_rows)
+            comment = {
+                "id": _uuid(rng),
+                "post_id": post_id,
+                "body": _sentence(rng, 12),
+                "created_at": now - timedelta(minutes=rng.randint(0, 60 * 24 * 30)),
+                "user_id": commenter["id"],
+                "username": commenter["username"],
+                "author_profile_type": commenter["profile_type"],
+                "author_organization": commenter["organization"],
+                "author_headline": headline(commenter),
+                "parent_id": parent["id"] if parent else None,
+                "reply_count": 0,
+            }
+            if parent:
+                parent["reply_count"] += 1
+            comments.append(comment)
+        comment_rows += comments
+
+        vote_count = len(scores)
+        average = sum(scores) / vote_count if vote_count else 0.0
+        created_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 90))
+        post_rows.append({
+            "id": post_id,
+            "caption": caption,
+            "url": f"http://localhost:8000/media/bench/{post_id}.pdf",
+            "file_type": "pdf",
+            "file_name": f"resume_{i}.pdf",
+            "created_at": created_at,
+            "imagekit_file_id": f"bench/{post_id}.pdf",
+            "user_id": author["id"],
+            "username": author["username"],
+            "author_profile_type": author["profile_type"],
+            "author_organization": author["organization"],
+            "author_headline": headline(author),
+            "vote_count": vote_count,
+            "rating_sum": sum(scores),
+            **{f"score_{score}": scores.count(score) for score in range(1, 6)},
+            "average_rating": average,
+            "rank_score": bayesian_score(sum(scores), vote_count) if vote_count else 0.0,
+            "comment_count": len(comments),
+            "hot_score": hot_score(sum(scores), vote_count, len(comments), created_at),
+            "queue_key": rng.random(),
+            "page_count": 1,
+            "text_content": text_content,
+        })
+        search_rows.append({
+            "post_id": post_id,
+            "caption": caption,
+            "body": text_content,
+        })
+
+    async with engine.begin() as conn:
+        await _insert(conn, User, user_rows)
+        await _insert(conn, Posts, post_rows)
+        await _insert(conn, Rating, rating_rows)
+        #parents before replies, the self referencing foreign key is checked per row
+        await _insert(conn, Comments, [row for row in comment_rows if row["parent_id"] is None])
+        await _insert(conn, Comments, [row for row in comment_rows if row["parent_id"] is not None])
+        await _insert(conn, SearchDocuments, search_rows)
+        await _insert(conn, CommentSearchDocuments, [
+            {"comment_id": row["id"], "post_id": row["post_id"], "body": row["body"]} for row in comment_rows
+        ])
+
+    return {
+        "user_ids": [row["id"] for row in user_rows],
+        "post_ids": [row["id"] for row in post_rows],
+        "ratings": {(row["user_id"], row["post_id"]) for row in rating_rows},
+    }
@@ -0,0 +1,93 @@
+#SERIALIZATION MICRO-BENCHMARK
+#per row cost of turning a feed page into response bytes, the old pydantic path against the row path:
+#   model:  select(Posts) -> ORM objects -> Post models -> PostPage -> jsonable_encoder -> json
+#   rows:   select(*POST_COLUMNS) -> Row tuples -> post_json dicts -> dumps (orjson when installed)
+#run from backend/:  python -m bench.serialization --rows 100 --repeat 200
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Per row serialization cost of the feed")
+    parser.add_argument("--rows", type=int, default=100, help="rows per page")
+    parser.add_argument("--repeat", type=int, default=200, help="pages per measurement")
+    return parser.parse_args()
+
+
+async def main(args) -> int:
+    temp_dir = tempfile.mkdtemp(prefix="peercv-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(temp_dir, 'bench.db')}"
+    os.environ.setdefault("JWT_SECRET", "peercv-benchmark-secret-not-for-production")
+    os.environ["STORAGE_BACKEND"] = "local"
+    os.environ["MEDIA_ROOT"] = os.path.join(temp_dir, "media")
+
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse
+    from sqlalchemy import select
+
+    from app.migrations import migrate
+    from app.routes.post_route import to_post
+    from app.serialization import POST_COLUMNS, dumps, orjson, post_json
+    from bench.seed import seed
+    from data.db import Posts, SessionLocal, engine
+    from data.schemas import PostPage
+
+    await migrate()
+    await seed(engine, users=50, posts=args.rows, ratings_per_post=0, comments_per_post=0)
+
+    def model_bytes(posts):
+        page = PostPage(posts=[to_post(post) for post in posts], next_cursor=None)
+        return JSONResponse(content=jsonable_encoder(page)).body
+
+    def row_bytes(rows):
+        return dumps({"posts": [post_json(row) for row in rows], "next_cursor": None})
+
+    async with SessionLocal() as session:
+        model_stmt = select(Posts).order_by(Posts.id).limit(args.rows)
+        row_stmt = select(*POST_COLUMNS).order_by(Posts.id).limit(args.rows)
+        posts = (await session.execute(model_stmt)).scalars().all()
+        rows = (await session.execute(row_stmt)).all()
+        if model_bytes(posts) != row_bytes(rows):
+            print("The two paths produce different json", file=sys.stderr)
+            return 1
+
+        def per_row_us(fn, *fn_args):
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                fn(*fn_args)
+            return (time.perf_counter() - started) / (args.repeat * args.rows) * 1e6
+
+        async def query_and_serialize(stmt, to_bytes, scalars):
+            started = time.perf_counter()
+            for _ in range(args.repeat):
+                result = await session.execute(stmt)
+                to_bytes(result.scalars().all() if scalars else result.all())
+                session.expunge_all() #don't let the identity map turn later queries into cache hits
+            return (time.perf_counter() - started) / (args.repeat * args.rows) * 1e6
+
+        results = {
+            "model": (
+                per_row_us(model_bytes, posts),
+                await query_and_serialize(model_stmt, model_bytes, scalars=True),
+            ),
+            "rows": (
+                per_row_us(row_bytes, rows),
+                await query_and_serialize(row_stmt, row_bytes, scalars=False),
+            ),
+        }
+
+    print(f"{args.rows} rows per page, {args.repeat} pages, encoder: {'orjson' if orjson else 'json'}")
+    print(f"\n{'path':<8} {'serialize us/row':>17} {'query+serialize us/row':>23}")
+    for name, (serialize, total) in results.items():
+        print(f"{name:<8} {serialize:>17.2f} {total:>23.2f}")
+    model, rows = results["model"], results["rows"]
+    print(f"\nspeedup  {model[0] / rows[0]:>16.1f}x {model[1] / rows[1]:>22.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -1,14 +1,15 @@
 from collections.abc import AsyncGenerator
 import uuid
+import random
 from datetime import datetime
 
-from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Integer, Float
+from sqlalchemy import Column, String, Text, DateTime, ForeignKey, Integer, Float, Index, JSON
 from sqlalchemy import UUID
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.orm import DeclarativeBase, relationship
 from fastapi_users.db import SQLAlchemyUserDatabase, SQLAlchemyBaseUserTableUUID
 from fastapi import Depends
-from sqlalchemy import event
+from sqlalchemy import event, make_url
 
 import os
 from dotenv import load_dotenv
@@ -22,7 +23,37 @@ if not DATABASE_URL:
 class Base(DeclarativeBase):
     pass
 
-class Posts(Base):
+class AuthorSnapshot:
+    #copy of the author's public profile so feed and comment reads don't need to join users,
+    #kept in sync by UserManager.on_after_update (username is declared on each table)
+    author_profile_type = Column(String, nullable=True)
+    author_organization = Column(String, nullable=True)
+    author_headline = Column(String, nullable=True) #NULL until backfilled on older databases
+
+    @property
+    def owner(self) -> dict:
+        return public_owner(self.username, self.author_profile_type, self.author_organization, self.author_headline)
+
+def public_owner(username, profile_type, organization, headline) -> dict:
+    """The UserPublic shape of an author snapshot. Every field there is a str, so a missing one (NULL until
+    backfilled, a profile without an organization) comes out as "" rather than null."""
+    return {
+        "username": username or "",
+        "profile_type": profile_type or "",
+        "organization": organization or "",
+        "headline": headline or "",
+    }
+
+def author_snapshot(user) -> dict:
+    """Column values for the AuthorSnapshot of a post or comment written by `user`."""
+    return {
+        "username": user.username,
+        "author_profile_type": user.profile_type,
+        "author_organization": user.organization,
+        "author_headline": user.headline,
+    }
+
+class Posts(AuthorSnapshot, Base):
     __tablename__ = "posts"
     id = Column(UUID(as_uuid=True), primary_key=True, nullable=False, default=uuid.uuid4)
     caption = Column(Text)
@@ -34,14 +65,46 @@ class Posts(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     username = Column(String, nullable=False)
 
+    #exact integer aggregates of the post's ratings. average_rating and rank_score are derived from
+    #rating_sum / vote_count on every change (app/votes.py), never updated incrementally
     vote_count = Column(Integer, default=0, nullable=False)
+    rating_sum = Column(Integer, default=0, server_default="0", nullable=False)
+    #histogram: how many ratings of each score
+    score_1 = Column(Integer, default=0, server_default="0", nullable=False)
+    score_2 = Column(Integer, default=0, server_default="0", nullable=False)
+    score_3 = Column(Integer, default=0, server_default="0", nullable=False)
+    score_4 = Column(Integer, default=0, server_default="0", nullable=False)
+    score_5 = Column(Integer, default=0, server_default="0", nullable=False)
     average_rating = Column(Float, default=0.0, nullable=False)
+    rank_score = Column(Float, default=0.0, server_default="0", nullable=False) #bayesian average, 0 until the first vote
+    queue_key = Column(Float, default=random.random, nullable=True) #random sort key for sampling the voting queue
+    comment_count = Column(Integer, default=0, server_default="0", nullable=False) #every comment, replies included
+    hot_score = Column(Float, default=0.0, server_default="0", nullable=False) #app/leaderboard.py hot_score, kept current on every vote and comment
+
+    #filled in at upload from the document, see app/previews.py
+    page_count = Column(Integer, nullable=True)
+    text_content = Column(Text, nullable=True)
+    thumbnail_url = Column(String, nullable=True)
+    thumbnail_file_id = Column(String, nullable=True)
+    preview_url = Column(String, nullable=True)
+    preview_file_id = Column(String, nullable=True)
 
     #defining relationships
     user = relationship("User", back_populates="posts")
     comments = relationship("Comments", back_populates="post", cascade="all, delete-orphan")
 
-class Comments(Base):
+    __table_args__ = (
+        #backs the keyset pagination of the feed (ORDER BY created_at DESC, id DESC)
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        #the "hot" and "top" feeds page the same way on (score DESC, id DESC)
+        Index("ix_posts_hot_score_id", "hot_score", "id"),
+        Index("ix_posts_rank_score_id", "rank_score", "id"),
+        Index("ix_posts_queue_key", "queue_key"),
+        #a user's own posts, and rewriting their author snapshot
+        Index("ix_posts_user_created", "user_id", "created_at"),
+    )
+
+class Comments(AuthorSnapshot, Base):
     __tablename__ = "comments"
     id = Column(UUID(as_uuid=True), primary_key=True, nullable=False, default=uuid.uuid4)
     post_id = Column(UUID(as_uuid=True), ForeignKey("posts.id", ondelete="CASCADE"), nullable=False)
@@ -50,11 +113,20 @@ class Comments(Base):
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     username = Column(String, nullable=False)
     parent_id = Column(UUID(as_uuid=True), ForeignKey("comments.id", ondelete="CASCADE"), nullable=True)
+    reply_count = Column(Integer, default=0, nullable=True) #direct replies, NULL until backfilled on older databases
 
     #defining relationships for python
     user = relationship("User", back_populates="comments")
     post = relationship("Posts", back_populates="comments")
 
+    __table_args__ = (
+        #top level threads of a post, the replies under a comment and a post's first comments (previews), oldest first
+        Index("ix_comments_post_parent_created", "post_id", "parent_id", "created_at"),
+        Index("ix_comments_parent_created", "parent_id", "created_at"),
+        Index("ix_comments_post_created", "post_id", "created_at", "id"),
+        Index("ix_comments_user_id", "user_id"),
+    )
+
 class User(SQLAlchemyBaseUserTableUUID, Base):
     __tablename__ = "users"
     username = Column(String, nullable=False)
@@ -71,38 +143,190 @@ class User(SQLAlchemyBaseUserTableUUID, Base):
     #defining relationships
     posts = relationship("Posts", back_populates="user")
     comments = relationship("Comments", back_populates="user")
+
+    @property
+    def headline(self) -> str:
+        return self.job_title if self.job_title else f"{self.program}, Year {self.year_of_study}"
     
 
 class Rating(Base):
     __tablename__ = "ratings"
     # Composite Primary Key: The pair of (user + post) must be unique
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.id"), primary_key=True)
-    post_id = Column(UUID(as_uuid=True), ForeignKey("posts.id"), primary_key=True)
+    post_id = Column(UUID(as_uuid=True), ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
     score = Column(Integer, nullable=False) # 1 to 5
 
+    __table_args__ = (
+        #the primary key leads with user_id, this is for the ratings of one post
+        Index("ix_ratings_post_id", "post_id"),
+    )
+
+class SearchDocuments(Base):
+    #text we search per post; the full text index over it is dialect specific, see app/search.py
+    __tablename__ = "search_documents"
+    id = Column(Integer, primary_key=True, autoincrement=True) #sqlite's FTS5 table links rows by this integer
+    post_id = Column(UUID(as_uuid=True), ForeignKey("posts.id", ondelete="CASCADE"), nullable=False, unique=True)
+    caption = Column(Text, nullable=True)
+    body = Column(Text, nullable=True) #extracted document text
 
-engine = create_async_engine(
-    DATABASE_URL,
-    pool_pre_ping=True
+class CommentSearchDocuments(Base):
+    #one row per comment, indexed on its own: a new comment costs its own text, not the whole thread again
+    __tablename__ = "comment_search_documents"
+    id = Column(Integer, primary_key=True, autoincrement=True) #the FTS5 rowid, as for search_documents
+    comment_id = Column(UUID(as_uuid=True), ForeignKey("comments.id", ondelete="CASCADE"), nullable=False, unique=True)
+    post_id = Column(UUID(as_uuid=True), ForeignKey("posts.id", ondelete="CASCADE"), nullable=False)
+    body = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index("ix_comment_search_documents_post_id", "post_id"),
     )
 
-if engine.url.drivername == "sqlite":
-    @event.listens_for(engine.sync_engine, "connect")
-    def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+class TokenRevocations(Base):
+    #claims in tokens issued to the user at or before revoked_at are not trusted (auth/tokens.py). A table rather
+    #than a users column so a deleted user's tokens stay revoked; rows older than a token lifetime are pruned
+    __tablename__ = "token_revocations"
+    user_id = Column(UUID(as_uuid=True), primary_key=True)
+    revoked_at = Column(Float, nullable=False) #unix time, compared with the token's iat
+
+    __table_args__ = (
+        Index("ix_token_revocations_revoked_at", "revoked_at"),
+    )
+
+class Jobs(Base):
+    #outbox of side effects (storage deletes, previews, recomputes), written in the same transaction
+    #as the change that needs them and carried out by the worker in app/jobs.py
+    __tablename__ = "jobs"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="pending") #pending, running, failed (done jobs are deleted)
+    attempts = Column(Integer, nullable=False, default=0)
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow) #not before, pushed back after a failure
+    locked_until = Column(DateTime, nullable=True) #a running job past this is assumed abandoned and retried
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_at", "status", "run_at"),
+    )
+
+
+#read-only endpoints can go to a replica, everything else uses DATABASE_URL (the primary)
+DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+
+#pool sizing is per process: with N uvicorn workers the database sees up to N * (size + overflow) connections
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+#a ping is an extra round trip on every checkout. Off by default: recycling retires connections before
+#server/proxy idle timeouts, and one that died anyway fails its statement, which invalidates the pool
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "0") == "1"
+#asyncpg prepared statements per connection, 0 when behind pgbouncer in transaction mode
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get("DB_STATEMENT_CACHE_SIZE", 500))
+
+#SQLITE
+#a file database gets one write connection per process, so writers in this process queue for it instead of
+#failing with "database is locked", and a pool of read-only connections that WAL lets run next to the writer
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+#NORMAL with WAL: a power cut can lose the last commits, never corrupt the file. FULL to fsync every commit
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHE_SIZE = int(os.environ.get("SQLITE_CACHE_SIZE", -64_000)) #negative is KiB: 64MB per connection
+#how long a connection waits for another process (a second worker, python -m app.jobs) to release the write lock
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", 5_000))
+SQLITE_READERS = int(os.environ.get("SQLITE_READERS", 4))
+
+def _sqlite_file(url) -> bool:
+    #an in-memory database only exists inside its one connection, it can't be split into readers and a writer
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:") and url.query.get("mode") != "memory"
+
+def _create_engine(database_url: str, readonly: bool = False):
+    url = make_url(database_url)
+    if url.get_backend_name() == "sqlite":
+        if not _sqlite_file(url):
+            return create_async_engine(url)
+        #connections are file handles, nothing to ping or recycle. Only the size matters
+        sqlite_engine = create_async_engine(
+            url,
+            pool_size=SQLITE_READERS if readonly else 1,
+            max_overflow=0,
+            pool_timeout=DB_POOL_TIMEOUT,
+        )
+        event.listen(sqlite_engine.sync_engine, "connect", _sqlite_pragmas(readonly))
+        return sqlite_engine
+
+    if url.drivername == "postgresql+asyncpg" and "prepared_statement_cache_size" not in url.query:
+        url = url.update_query_dict({"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)})
+    return create_async_engine(
+        url,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        #hand out the most recently used connection, so under light load the extra ones sit idle and get recycled
+        pool_use_lifo=True,
+    )
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def _sqlite_pragmas(readonly: bool):
+    pragmas = [
+        f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}", #persistent, the file stays in WAL mode after the first connection
+        f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size={SQLITE_CACHE_SIZE}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+    ]
+    if readonly:
+        pragmas.append("PRAGMA query_only=ON") #a write that slipped onto a read session fails instead of taking the lock
+
+    def apply(dbapi_connection, connection_record):
         cursor = dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_keys=ON")
+        for pragma in pragmas:
+            cursor.execute(pragma)
         cursor.close()
+    return apply
+
+engine = _create_engine(DATABASE_URL)
+#reads of the primary. On a sqlite file that is the pool of read-only connections, so reads never wait for the
+#single writer; elsewhere the primary's own pool
+if _sqlite_file(make_url(DATABASE_URL)):
+    primary_read_engine = _create_engine(DATABASE_URL, readonly=True)
+else:
+    primary_read_engine = engine
+read_engine = _create_engine(DATABASE_REPLICA_URL) if DATABASE_REPLICA_URL else primary_read_engine
+
+for _engine in {engine, primary_read_engine, read_engine}:
+    if _engine.dialect.name == "sqlite": #drivername is "sqlite+aiosqlite", so match on the dialect
+        event.listen(_engine.sync_engine, "connect", _enable_sqlite_foreign_keys)
 
 SessionLocal = async_sessionmaker(engine, expire_on_commit=False)
+PrimaryReadSessionLocal = async_sessionmaker(primary_read_engine, expire_on_commit=False)
+ReadSessionLocal = async_sessionmaker(read_engine, expire_on_commit=False)
 
-async def create_db_and_tables():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+#the schema is created and upgraded by the numbered steps in app/migrations.py
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with SessionLocal() as session:
         yield session
 
+#for endpoints that never write but must see the latest commits (a user's own votes and posts): never a replica,
+#and on sqlite never the write connection
+async def get_primary_read_session() -> AsyncGenerator[AsyncSession, None]:
+    async with PrimaryReadSessionLocal() as session:
+        yield session
+
+#for endpoints that never write. A replica can lag the primary, so only use it where a slightly
+#stale answer is fine (the cached public reads already are up to CACHE_TTL_SECONDS stale)
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    async with ReadSessionLocal() as session:
+        yield session
+
 async def get_user_db(session: AsyncSession=Depends(get_async_session)):
     yield SQLAlchemyUserDatabase(session, User) #this takes in a session and uses our User model for querying
     #sqlachemy provides an adapter object, converting between the datahase and provide various methods
\ No newline at end of file
@@ -23,6 +23,17 @@ class Comment(BaseModel):  # Don't inherit from CommentCreate since the fields a
     body: str
     parent_comment_id: uuid.UUID | None = None
     owner: UserPublic
+    created_at: datetime | None = None
+
+class CommentNode(Comment):
+    reply_count: int = 0
+    replies: list["CommentNode"] = []
+    #reply_count > len(replies) means there is more: fetch /comments/{post_id}/replies/{id}?cursor=more_replies_cursor
+    more_replies_cursor: str | None = None
+
+class CommentThreadPage(BaseModel):
+    comments: list[CommentNode]
+    next_cursor: str | None = None
 
 class CommentUpdate(BaseModel):
     body: str
@@ -37,9 +48,46 @@ class Post(BaseModel):
 
     average_rating: float = 0.0
     vote_count: int = 0
+    rank_score: float = 0.0
+    comment_count: int = 0
+
+    #small renders of the first page, so list views don't download the whole document
+    page_count: int | None = None
+    thumbnail_url: str | None = None
+    preview_url: str | None = None
     
     created_at: datetime
 
+class PostPage(BaseModel):
+    posts: list[Post]
+    next_cursor: str | None = None #pass back as ?cursor= to get the next page, None on the last page
+
+class VoteCreate(BaseModel):
+    post_id: uuid.UUID
+    score: int = Field(..., ge=1, le=5)
+
+class VoteBatch(BaseModel):
+    votes: list[VoteCreate] = Field(..., min_length=1, max_length=100)
+
+class VoteBatchResult(BaseModel):
+    accepted: list[uuid.UUID]
+    already_voted: list[uuid.UUID]
+
+class RatingSummary(BaseModel):
+    post_id: uuid.UUID
+    vote_count: int
+    average_rating: float
+    histogram: dict[str, int] #"1".."5" -> how many ratings gave that score
+
+class PostActivity(BaseModel):
+    post_id: uuid.UUID
+    comment_count: int
+    comments: list[Comment] #the first page, oldest first; all of them when comment_count fits
+    has_rated: bool | None = None #None without a login
+
+class PostActivityBatch(BaseModel):
+    posts: list[PostActivity] #in the order asked for, unknown ids left out
+
 class UserRead(schemas.BaseUser[uuid.UUID]):
     username: str
     profile_type: str # "student" or "professional"
@@ -59,4 +107,10 @@ class UserCreate(schemas.BaseUserCreate):
     job_title: Optional[str] = None
 
 class UserUpdate(schemas.BaseUserUpdate):
-    pass
+    username: Optional[str] = None
+    profile_type: Optional[str] = None
+    organization: Optional[str] = None
+
+    program: Optional[str] = None
+    year_of_study: Optional[int] = None
+    job_title: Optional[str] = None
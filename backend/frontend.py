@@ -1,7 +1,17 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
 
 DEFAULT_API_URL = "http://localhost:8000"
+#fetched posts and comments are reused across reruns for this long; creating something clears them at once
+CACHE_TTL_SECONDS = int(os.environ.get("FRONTEND_CACHE_TTL_SECONDS", 30))
+REQUEST_TIMEOUT = (3.05, 10) #connect, read
+FETCH_WORKERS = 16
+PAGE_SIZE = 20 #posts per request, Load more fetches the next page
+ACTIVITY_BATCH_SIZE = 100 #the most ids GET /posts/activity takes
 
 st.set_page_config(page_title="Commenting Feature", layout="centered")
 
@@ -34,69 +44,138 @@ st.caption("Create a post, then open comments to add or read replies.")
 
 if "api_url" not in st.session_state:
     st.session_state.api_url = DEFAULT_API_URL
-if "posts" not in st.session_state:
-    st.session_state.posts = []
-if "comments_by_post" not in st.session_state:
-    st.session_state.comments_by_post = {}
-if "posts_loaded" not in st.session_state:
-    st.session_state.posts_loaded = False
+if "open_comments" not in st.session_state:
+    st.session_state.open_comments = set()
+if "feed_cursors" not in st.session_state:
+    st.session_state.feed_cursors = [None] #the cursor of every page shown, None for the first
 
 
 def short_id(value: str) -> str:
     return value[-8:] if len(value) > 8 else value
 
 
-def load_posts(base_url: str) -> list[dict]:
-    response = requests.get(f"{base_url}/posts", timeout=5)
+@st.cache_resource
+def http_session() -> requests.Session:
+    #one keep-alive connection pool shared by every rerun and fetch thread, instead of a new connection per call
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=FETCH_WORKERS)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@st.cache_resource
+def fetch_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="fetch")
+
+
+def get_json(url: str, params: dict | None = None):
+    response = http_session().get(url, params=params, timeout=REQUEST_TIMEOUT)
     response.raise_for_status()
     return response.json()
 
 
-def load_comments(base_url: str, post_id: str) -> list[dict]:
-    response = requests.get(f"{base_url}/comments/{post_id}", timeout=5)
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def load_feed_page(base_url: str, cursor: str | None) -> dict:
+    params = {"limit": PAGE_SIZE}
+    if cursor:
+        params["cursor"] = cursor
+    return get_json(f"{base_url}/posts/", params)
+
+
+def fetch_comments(base_url: str, post_id: str) -> list[dict]:
+    return get_json(f"{base_url}/comments/{post_id}")
+
+
+def fetch_activity(base_url: str, post_ids: list[str]) -> dict[str, dict] | None:
+    """Comment counts and first comments of up to ACTIVITY_BATCH_SIZE posts, None if the API has no batch endpoint."""
+    response = http_session().get(f"{base_url}/posts/activity", params={"ids": post_ids}, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 404:
+        return None
     response.raise_for_status()
-    return response.json()
+    return {str(item["post_id"]): item for item in response.json()["posts"]}
+
+
+@st.cache_data(ttl=CACHE_TTL_SECONDS, show_spinner=False)
+def load_comments(base_url: str, post_ids: tuple[str, ...]) -> dict[str, list[dict]]:
+    """Every comment of every post, post_id -> comments. The batch endpoint covers most posts, all its
+    requests sent at once; only posts with more comments than fit in a batch answer are fetched on
+    their own, also all at once."""
+    pool = fetch_pool()
+    chunks = [list(post_ids[i:i + ACTIVITY_BATCH_SIZE]) for i in range(0, len(post_ids), ACTIVITY_BATCH_SIZE)]
+
+    comments, remaining = {}, []
+    for chunk, activity in zip(chunks, pool.map(lambda chunk: fetch_activity(base_url, chunk), chunks)):
+        if activity is None:
+            remaining += chunk
+            continue
+        for post_id in chunk:
+            item = activity.get(post_id)
+            if item is None:
+                comments[post_id] = [] #deleted since the feed was loaded
+            elif len(item["comments"]) >= item["comment_count"]:
+                comments[post_id] = item["comments"]
+            else:
+                remaining.append(post_id)
+
+    for post_id, post_comments in zip(remaining, pool.map(lambda post_id: fetch_comments(base_url, post_id), remaining)):
+        comments[post_id] = post_comments
+    return comments
+
+
+def reset_feed():
+    load_feed_page.clear()
+    load_comments.clear()
+    st.session_state.feed_cursors = [None]
+
+
+def load_more(cursor: str):
+    st.session_state.feed_cursors.append(cursor)
 
 
 with st.sidebar:
     st.header("Controls")
     api_url = st.text_input("API base URL", value=st.session_state.api_url).strip()
     if api_url != st.session_state.api_url:
+        #the caches are keyed by the URL, only the pages shown start over
         st.session_state.api_url = api_url
-        st.session_state.posts = []
-        st.session_state.comments_by_post = {}
-        st.session_state.posts_loaded = False
+        st.session_state.open_comments = set()
+        st.session_state.feed_cursors = [None]
 
     refresh_clicked = st.button("Refresh feed")
     create_clicked = st.button("Create post")
 
-create_success = False
 if create_clicked:
     try:
-        response = requests.post(f"{api_url}/posts/upload", timeout=5)
+        response = http_session().post(f"{api_url}/posts/upload", timeout=REQUEST_TIMEOUT)
         response.raise_for_status()
-        create_success = True
+        reset_feed()
         st.success("Post created.")
     except requests.RequestException as exc:
         st.error(f"Failed to create post: {exc}")
 
-if refresh_clicked or create_success or not st.session_state.posts_loaded:
-    try:
-        st.session_state.posts = load_posts(api_url)
-        st.session_state.posts_loaded = True
-    except requests.RequestException as exc:
-        st.error(f"Failed to load posts: {exc}")
-        st.session_state.posts_loaded = False
-
-if st.session_state.posts_loaded:
-    st.caption(f"{len(st.session_state.posts)} post(s) in feed")
+if refresh_clicked:
+    reset_feed()
+
+posts, comments_by_post, next_cursor = [], {}, None
+try:
+    for cursor in st.session_state.feed_cursors:
+        page = load_feed_page(api_url, cursor)
+        posts.extend(page["posts"])
+        #each page's comments in one go and cached with it, so opening them below costs nothing
+        #and Load more only fetches the new page's
+        comments_by_post.update(load_comments(api_url, tuple(str(post["post_id"]) for post in page["posts"])))
+        next_cursor = page.get("next_cursor")
+    st.caption(f"{len(posts)} post(s) loaded")
+except requests.RequestException as exc:
+    st.error(f"Failed to load the feed: {exc}")
 
 st.subheader("Feed")
 
-if not st.session_state.posts:
+if not posts:
     st.info("No posts yet. Click Create post in the sidebar to add one.")
 else:
-    for post in st.session_state.posts:
+    for post in posts:
         post_id = str(post.get("post_id", "")).strip()
         if not post_id:
             continue
@@ -115,12 +194,7 @@ else:
 
         with col_left:
             if st.button("Comments +", key=f"load_{post_id}"):
-                try:
-                    st.session_state.comments_by_post[post_id] = load_comments(
-                        api_url, post_id
-                    )
-                except requests.RequestException as exc:
-                    st.error(f"Failed to load comments: {exc}")
+                st.session_state.open_comments.add(post_id)
 
         with col_right:
             with st.expander("Add comment"):
@@ -139,20 +213,19 @@ else:
                                 "author": author.strip() or None,
                                 "body": body.strip(),
                             }
-                            response = requests.post(
+                            response = http_session().post(
                                 f"{api_url}/comments/{post_id}",
                                 json=payload,
-                                timeout=5,
+                                timeout=REQUEST_TIMEOUT,
                             )
                             response.raise_for_status()
-                            st.session_state.comments_by_post[post_id] = load_comments(
-                                api_url, post_id
-                            )
-                            st.success("Comment created.")
+                            load_comments.clear() #the pages loaded so far stay
+                            st.session_state.open_comments.add(post_id)
+                            st.rerun()
                         except requests.RequestException as exc:
                             st.error(f"Failed to create comment: {exc}")
 
-        comments = st.session_state.comments_by_post.get(post_id)
+        comments = comments_by_post.get(post_id) if post_id in st.session_state.open_comments else None
         if comments is not None:
             if comments:
                 st.markdown("Comments:")
@@ -162,3 +235,6 @@ else:
                     st.markdown(f"- {author_display}: {body}")
             else:
                 st.caption("No comments yet.")
+
+    if next_cursor:
+        st.button("Load more", on_click=load_more, args=(next_cursor,))
@@ -0,0 +1,120 @@
+#TESTS
+#run from backend/:
+#   uv run pytest                                         on a throwaway sqlite file
+#   TEST_DATABASE_URL=postgresql+asyncpg://... uv run pytest   on postgres, the database is emptied first
+#the app reads its settings at import, so they are set here before anything imports it
+import os
+import tempfile
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+TEMP_DIR = tempfile.mkdtemp(prefix="peercv-tests-")
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL") or f"sqlite+aiosqlite:///{os.path.join(TEMP_DIR, 'test.db')}"
+os.environ["DATABASE_REPLICA_URL"] = ""
+os.environ["JWT_SECRET"] = "peercv-test-secret-not-for-production"
+os.environ["STORAGE_BACKEND"] = "local"
+os.environ["MEDIA_ROOT"] = os.path.join(TEMP_DIR, "media")
+os.environ["ADMISSION_CONTROL"] = "0"
+os.environ["RUN_JOB_WORKER"] = "0"
+
+import httpx
+from sqlalchemy import text
+
+from app.cache import CACHE_MAX_ENTRIES, MemoryCache, response_cache
+from app.main import app
+from app.migrations import migrate
+from app.writer import write_queue
+from auth import tokens
+from data.db import Base, Posts, SessionLocal, engine, primary_read_engine, read_engine
+
+_schema_ready = False
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def _reset_database():
+    global _schema_ready
+    if not _schema_ready:
+        if engine.dialect.name == "postgresql":
+            async with engine.begin() as conn:
+                await conn.execute(text("DROP SCHEMA public CASCADE"))
+                await conn.execute(text("CREATE SCHEMA public"))
+        await migrate()
+        _schema_ready = True
+        return
+    #empty every table but keep the schema, migrating for each test is slow on postgres
+    tables = [table.name for table in Base.metadata.sorted_tables]
+    async with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            await conn.execute(text(f"TRUNCATE {', '.join(tables)} CASCADE"))
+        else:
+            for table in reversed(tables):
+                await conn.execute(text(f"DELETE FROM {table}"))
+
+
+@pytest.fixture
+async def client(anyio_backend):
+    await _reset_database()
+    #state kept per process between requests, each test starts without it
+    response_cache.backend = MemoryCache(CACHE_MAX_ENTRIES)
+    tokens._verified.clear()
+    tokens._revoked.clear()
+    tokens._revocations_synced_at = float("-inf")
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+        yield http
+    #every test gets its own event loop, connections and the queue's task can't outlive it
+    await write_queue.close()
+    for _engine in {engine, primary_read_engine, read_engine}:
+        await _engine.dispose()
+
+
+async def signup(client: httpx.AsyncClient, name: str, **profile) -> tuple[dict, uuid.UUID]:
+    """Register and log in `name`. Returns the Authorization header and the user's id."""
+    body = dict(email=f"{name}@example.com", password="correct-horse-battery", username=name,
+                profile_type="student", organization="UofT", program="CS", year_of_study=2)
+    body.update(profile)
+    response = await client.post("/auth/register", json=body)
+    assert response.status_code == 201, response.text
+    response = await client.post("/auth/jwt/login", data={"username": body["email"], "password": body["password"]})
+    assert response.status_code == 200, response.text
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return headers, uuid.UUID((await client.get("/users/me", headers=headers)).json()["id"])
+
+
+async def add_posts(user_id: uuid.UUID, count: int, username: str = "author") -> list[uuid.UUID]:
+    """Insert `count` posts by `user_id` straight into the database, newest last."""
+    posts = [
+        Posts(caption=f"post {i}", url=f"http://test/media/{i}.pdf", file_type="pdf", file_name=f"{i}.pdf",
+              imagekit_file_id=f"file-{i}", user_id=user_id, username=username,
+              created_at=datetime(2026, 1, 1) + timedelta(minutes=i))
+        for i in range(count)
+    ]
+    async with SessionLocal() as session:
+        session.add_all(posts)
+        await session.commit()
+    return [post.id for post in posts]
+
+
+async def upload(client: httpx.AsyncClient, headers: dict, caption: str = "") -> dict:
+    """Upload a small pdf through the API, so it is indexed for search like any other post."""
+    files = {"file": ("resume.pdf", b"%PDF-1.4 test resume", "application/pdf")}
+    response = await client.post("/posts/upload", headers=headers, files=files, data={"caption": caption})
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+async def comment(client: httpx.AsyncClient, headers: dict, post_id, body: str, parent_id=None) -> dict:
+    payload = {"body": body, "parent_comment_id": str(parent_id) if parent_id else None}
+    response = await client.post(f"/comments/{post_id}", headers=headers, json=payload)
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+def query_count(response: httpx.Response) -> int:
+    """Statements the request ran, from the Server-Timing header app/instrumentation.py adds."""
+    return int(response.headers["server-timing"].split('desc="')[1].split(" ")[0])
@@ -0,0 +1,68 @@
+import pytest
+
+from app.comment_tree import COMMENT_PREVIEW_SIZE
+from conftest import add_posts, comment, query_count, signup
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_activity(client):
+    headers, user_id = await signup(client, "alice")
+    voter, voter_id = await signup(client, "bob")
+    quiet, busy = await add_posts(user_id, 2)
+    for i in range(3):
+        await comment(client, headers, busy, f"comment {i}")
+    await client.post(f"/posts/{busy}/rate", params={"score": 4}, headers=voter)
+
+    response = await client.get("/posts/activity", params={"ids": [str(busy), str(quiet), str(voter_id)]}, headers=voter)
+
+    assert response.status_code == 200, response.text
+    posts = response.json()["posts"]
+    assert [p["post_id"] for p in posts] == [str(busy), str(quiet)] #unknown ids are left out
+    assert posts[0]["comment_count"] == 3
+    assert [c["body"] for c in posts[0]["comments"]] == ["comment 0", "comment 1", "comment 2"]
+    assert [p["has_rated"] for p in posts] == [True, False]
+    anonymous = (await client.get("/posts/activity", params={"ids": [str(busy)]})).json()["posts"]
+    assert anonymous[0]["has_rated"] is None
+
+
+async def test_activity_follows_vote_changes(client):
+    _, user_id = await signup(client, "alice")
+    voter, _ = await signup(client, "bob")
+    [post_id] = await add_posts(user_id, 1)
+
+    async def has_rated():
+        return (await client.get("/posts/activity", params={"ids": [str(post_id)]}, headers=voter)).json()["posts"][0]["has_rated"]
+
+    assert await has_rated() is False
+    await client.post(f"/posts/{post_id}/rate", params={"score": 4}, headers=voter)
+    assert await has_rated() is True
+    await client.delete(f"/posts/{post_id}/rate", headers=voter)
+    assert await has_rated() is False
+
+
+async def test_activity_query_count_does_not_grow_with_posts(client):
+    headers, user_id = await signup(client, "alice")
+    post_ids = await add_posts(user_id, 20)
+    for post_id in post_ids:
+        await comment(client, headers, post_id, "hello")
+
+    few = await client.get("/posts/activity", params={"ids": [str(p) for p in post_ids[:2]]}, headers=headers)
+    many = await client.get("/posts/activity", params={"ids": [str(p) for p in post_ids]}, headers=headers)
+
+    assert query_count(many) == query_count(few)
+
+
+async def test_activity_previews_first_comments_of_each_post(client):
+    headers, user_id = await signup(client, "alice")
+    long, short = await add_posts(user_id, 2)
+    for i in range(COMMENT_PREVIEW_SIZE + 3):
+        await comment(client, headers, long, f"long {i}")
+    first = await comment(client, headers, short, "short 0")
+    await comment(client, headers, short, "reply", parent_id=first["id"])
+
+    posts = (await client.get("/posts/activity", params={"ids": [str(long), str(short)]})).json()["posts"]
+
+    assert [c["body"] for c in posts[0]["comments"]] == [f"long {i}" for i in range(COMMENT_PREVIEW_SIZE)]
+    assert posts[0]["comment_count"] == COMMENT_PREVIEW_SIZE + 3
+    assert [c["body"] for c in posts[1]["comments"]] == ["short 0", "reply"]
@@ -0,0 +1,44 @@
+import uuid
+
+from fastapi import Request
+from fastapi_users.jwt import generate_jwt
+
+from app.admission import RouteClass, client_keys
+from auth.users import SECRET
+
+
+def _request(host: str, user_id: uuid.UUID | None = None) -> Request:
+    headers = []
+    if user_id:
+        token = generate_jwt({"sub": str(user_id), "aud": ["fastapi-users:auth"]}, SECRET, 60)
+        headers.append((b"authorization", f"Bearer {token}".encode()))
+    return Request({"type": "http", "method": "POST", "path": "/posts/votes", "headers": headers, "client": (host, 1234)})
+
+
+def test_signed_in_requests_pay_from_user_and_address():
+    user_id = uuid.uuid4()
+    assert client_keys(_request("10.0.0.1", user_id)) == ["ip:10.0.0.1", f"user:{user_id}"]
+    assert client_keys(_request("10.0.0.1")) == ["ip:10.0.0.1"]
+    #a token that doesn't verify is just an address
+    bad = Request({"type": "http", "method": "GET", "path": "/", "headers": [(b"authorization", b"Bearer nope")], "client": ("10.0.0.1", 1)})
+    assert client_keys(bad) == ["ip:10.0.0.1"]
+
+
+def test_new_accounts_share_their_address_bucket():
+    rc = RouteClass("test", rate=0, burst=2, concurrency=1)
+    first, second = uuid.uuid4(), uuid.uuid4()
+    assert rc.take(client_keys(_request("10.0.0.1", first))) == 0
+    assert rc.take(client_keys(_request("10.0.0.1", second))) == 0
+    assert rc.take(client_keys(_request("10.0.0.1", uuid.uuid4()))) > 0
+    #the same users elsewhere still have a token left each
+    assert rc.take(client_keys(_request("10.0.0.2", first))) == 0
+
+
+def test_user_bucket_follows_them_across_addresses():
+    rc = RouteClass("test", rate=0, burst=2, concurrency=1)
+    user_id = uuid.uuid4()
+    assert rc.take(client_keys(_request("10.0.0.1", user_id))) == 0
+    assert rc.take(client_keys(_request("10.0.0.2", user_id))) == 0
+    assert rc.take(client_keys(_request("10.0.0.3", user_id))) > 0
+    #the refused request didn't cost the fresh address anything
+    assert rc.buckets["ip:10.0.0.3"][0] == 2
@@ -0,0 +1,53 @@
+import time
+
+import pytest
+from sqlalchemy import select, update
+
+from auth import tokens
+from conftest import add_posts, signup
+from data.db import SessionLocal, TokenRevocations, User
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_profile_change_revokes_older_claims(client):
+    headers, user_id = await signup(client, "alice")
+    [post_id] = await add_posts(user_id, 1)
+
+    response = await client.patch("/users/me", headers=headers, json={"organization": "Waterloo"})
+    assert response.status_code == 200, response.text
+
+    async with SessionLocal() as session:
+        assert await session.scalar(select(TokenRevocations.revoked_at).where(TokenRevocations.user_id == user_id))
+    #the old token still works, its user now comes from the database with the new profile
+    response = await client.post(f"/comments/{post_id}", headers=headers, json={"body": "hi"})
+    assert response.status_code == 201
+    assert response.json()["owner"]["organization"] == "Waterloo"
+
+
+async def test_deactivation_on_another_worker(client, monkeypatch):
+    monkeypatch.setattr(tokens, "TOKEN_REVOCATION_SYNC_SECONDS", 0)
+    headers, user_id = await signup(client, "alice")
+    [post_id] = await add_posts(user_id, 1)
+    assert (await client.get("/posts/queue", headers=headers)).status_code == 200
+
+    #what UserManager.on_after_update commits on whichever worker handled the deactivation
+    async with SessionLocal() as session:
+        await session.execute(update(User).where(User.id == user_id).values(is_active=False))
+        session.add(TokenRevocations(user_id=user_id, revoked_at=time.time()))
+        await session.commit()
+
+    assert (await client.post(f"/posts/{post_id}/rate", params={"score": 5}, headers=headers)).status_code == 401
+    assert (await client.post(f"/comments/{post_id}", headers=headers, json={"body": "hi"})).status_code == 401
+
+
+async def test_new_login_is_trusted_again(client):
+    headers, user_id = await signup(client, "alice")
+    await client.patch("/users/me", headers=headers, json={"organization": "Waterloo"})
+    tokens._verified.clear()
+
+    response = await client.post("/auth/jwt/login", data={"username": "alice@example.com", "password": "correct-horse-battery"})
+    fresh = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    assert not await tokens.claims_revoked(user_id, time.time())
+    assert (await client.get("/posts/queue", headers=fresh)).status_code == 200
@@ -0,0 +1,23 @@
+from bench.run import slower
+
+
+def _result(run_p95, requests=900):
+    return {"p95_ms": sorted(run_p95)[len(run_p95) // 2], "run_p95_ms": run_p95, "requests": requests}
+
+
+def test_noisy_runs_are_not_a_regression():
+    #two identical runs of the comments endpoint, one with a slow outlier
+    assert slower(_result([100, 110, 120]), _result([105, 180, 140]), 0.15, 500) == "within run-to-run noise"
+
+
+def test_consistent_slowdown_is_a_regression():
+    assert slower(_result([100, 110, 120]), _result([160, 170, 175]), 0.15, 500) == "REGRESSION"
+
+
+def test_single_small_sample_never_fails():
+    before = {"p95_ms": 100, "requests": 300}
+    assert slower(before, {"p95_ms": 167, "requests": 300}, 0.15, 500) == "too few samples to tell"
+
+
+def test_faster_is_fine():
+    assert slower(_result([100, 110, 120]), _result([90, 95, 99]), 0.15, 500) is None
@@ -0,0 +1,74 @@
+import pytest
+
+from conftest import add_posts, comment, query_count, signup
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_comment_tree(client):
+    headers, user_id = await signup(client, "alice")
+    [post_id] = await add_posts(user_id, 1)
+    first = await comment(client, headers, post_id, "first")
+    second = await comment(client, headers, post_id, "second")
+    replies = [await comment(client, headers, post_id, f"reply {i}", parent_id=first["id"]) for i in range(4)]
+    nested = await comment(client, headers, post_id, "nested", parent_id=replies[0]["id"])
+
+    response = await client.get(f"/comments/{post_id}/tree", params={"children": 2, "depth": 3})
+
+    assert response.status_code == 200, response.text
+    assert query_count(response) == 1
+    page = response.json()
+    assert [c["body"] for c in page["comments"]] == ["first", "second"]
+    top = page["comments"][0]
+    assert top["reply_count"] == 4
+    assert [c["body"] for c in top["replies"]] == ["reply 0", "reply 1"]
+    assert top["more_replies_cursor"] is not None
+    assert [c["id"] for c in top["replies"][0]["replies"]] == [nested["id"]]
+    assert page["comments"][1]["id"] == second["id"] and page["comments"][1]["replies"] == []
+
+    more = (await client.get(f"/comments/{post_id}/replies/{first['id']}",
+                             params={"cursor": top["more_replies_cursor"], "children": 2})).json()
+    assert [c["body"] for c in more["comments"]] == ["reply 2", "reply 3"]
+    assert more["next_cursor"] is None
+
+
+async def test_comment_tree_pages(client):
+    headers, user_id = await signup(client, "alice")
+    [post_id] = await add_posts(user_id, 1)
+    for i in range(5):
+        await comment(client, headers, post_id, f"comment {i}")
+
+    bodies, cursor = [], None
+    while True:
+        page = (await client.get(f"/comments/{post_id}/tree", params={"limit": 2, **({"cursor": cursor} if cursor else {})})).json()
+        bodies += [c["body"] for c in page["comments"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert bodies == [f"comment {i}" for i in range(5)]
+
+
+async def test_delete_comment_takes_its_replies(client):
+    headers, user_id = await signup(client, "alice")
+    other, _ = await signup(client, "bob")
+    [post_id] = await add_posts(user_id, 1)
+    parent = await comment(client, headers, post_id, "parent")
+    await comment(client, other, post_id, "reply", parent_id=parent["id"])
+    await comment(client, other, post_id, "other thread")
+
+    assert (await client.delete(f"/comments/{parent['id']}", headers=other)).status_code == 403
+    assert (await client.delete(f"/comments/{parent['id']}", headers=headers)).status_code == 200
+
+    assert [c["body"] for c in (await client.get(f"/comments/{post_id}")).json()] == ["other thread"]
+    [post] = (await client.get("/posts/")).json()["posts"]
+    assert post["comment_count"] == 1
+
+
+async def test_reply_to_missing_comment(client):
+    headers, user_id = await signup(client, "alice")
+    [post_id] = await add_posts(user_id, 1)
+
+    response = await client.post(f"/comments/{post_id}", headers=headers, json={"body": "hi", "parent_comment_id": str(user_id)})
+
+    assert response.status_code == 400
@@ -0,0 +1,72 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from app import jobs, main
+from conftest import signup, upload
+from data.db import Jobs, SessionLocal
+
+pytestmark = pytest.mark.anyio
+
+
+async def _jobs() -> list[Jobs]:
+    async with SessionLocal() as session:
+        return list((await session.scalars(select(Jobs))).all())
+
+
+async def test_post_delete_removes_its_file(client, monkeypatch):
+    deleted = []
+
+    async def delete_file(payload):
+        deleted.append(payload["file_id"])
+
+    monkeypatch.setitem(jobs._handlers, "delete_file", delete_file)
+    headers, _ = await signup(client, "alice")
+    post = await upload(client, headers)
+    async with SessionLocal() as session:
+        await session.execute(Jobs.__table__.delete().where(Jobs.kind == "build_preview"))
+        await session.commit()
+
+    await client.delete(f"/posts/{post['post_id']}", headers=headers)
+    assert await jobs.run_pending() == 1
+
+    assert len(deleted) == 1
+    assert await _jobs() == []
+
+
+async def test_failed_job_is_retried_later(client, monkeypatch):
+    async def broken(payload):
+        raise RuntimeError("storage is down")
+
+    monkeypatch.setitem(jobs._handlers, "delete_file", broken)
+    async with SessionLocal() as session:
+        jobs.enqueue(session, "delete_file", {"file_id": "missing"})
+        await session.commit()
+
+    assert await jobs.run_pending() == 1
+
+    [job] = await _jobs()
+    assert (job.status, job.attempts) == ("pending", 1)
+    assert "storage is down" in job.last_error
+    assert await jobs.run_pending() == 0 #backed off
+
+
+async def test_shutdown_hands_running_jobs_back(client, monkeypatch):
+    started = asyncio.Event()
+
+    async def slow(payload):
+        started.set()
+        await asyncio.Event().wait()
+
+    monkeypatch.setitem(jobs._handlers, "delete_file", slow)
+    monkeypatch.setattr(main, "RUN_JOB_WORKER", True)
+    async with SessionLocal() as session:
+        jobs.enqueue(session, "delete_file", {"file_id": "f"})
+        await session.commit()
+
+    async with main.lifespan(main.app):
+        await asyncio.wait_for(started.wait(), 5)
+
+    [job] = await _jobs()
+    assert (job.status, job.attempts, job.locked_until) == ("pending", 0, None)
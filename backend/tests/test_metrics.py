@@ -0,0 +1,25 @@
+import pytest
+
+from conftest import add_posts, query_count, signup
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_writes_count_toward_their_request(client):
+    #on sqlite the vote is applied by the group commit queue's task, its statements still belong to the request
+    headers, user_id = await signup(client, "alice")
+    [post_id] = await add_posts(user_id, 1)
+
+    response = await client.post(f"/posts/{post_id}/rate", params={"score": 4}, headers=headers)
+
+    assert response.status_code == 201
+    assert query_count(response) >= 3 #insert, aggregates, hot score and the vote totals read
+
+
+async def test_metrics_endpoint(client):
+    await client.get("/posts/")
+
+    body = (await client.get("/metrics")).text
+
+    assert 'route="/posts/"' in body
+    assert "peercv_write_queue_total" in body
@@ -0,0 +1,78 @@
+import pytest
+from sqlalchemy import update
+
+from conftest import add_posts, signup, upload
+from data.db import Posts, SessionLocal
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_upload_and_delete(client):
+    headers, _ = await signup(client, "alice")
+    other, _ = await signup(client, "bob")
+
+    post = await upload(client, headers, caption="my resume")
+
+    assert post["caption"] == "my resume"
+    assert post["vote_count"] == 0 and post["comment_count"] == 0
+    assert post["owner"]["username"] == "alice"
+    assert [p["post_id"] for p in (await client.get("/posts/me", headers=headers)).json()] == [post["post_id"]]
+
+    assert (await client.delete(f"/posts/{post['post_id']}", headers=other)).status_code == 403
+    assert (await client.delete(f"/posts/{post['post_id']}", headers=headers)).status_code == 200
+    assert (await client.delete(f"/posts/{post['post_id']}", headers=headers)).status_code == 404
+    assert (await client.get("/posts/")).json()["posts"] == []
+
+
+async def test_feed_pages_by_cursor(client):
+    _, user_id = await signup(client, "alice")
+    post_ids = await add_posts(user_id, 7)
+
+    seen, cursor = [], None
+    for _ in range(4):
+        page = (await client.get("/posts/", params={"limit": 3, **({"cursor": cursor} if cursor else {})})).json()
+        seen += [p["post_id"] for p in page["posts"]]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert seen == [str(post_id) for post_id in reversed(post_ids)]
+
+
+@pytest.mark.parametrize("sort", ["hot", "top"])
+async def test_feed_sorts_by_votes(client, sort):
+    headers, user_id = await signup(client, "alice")
+    quiet, liked = await add_posts(user_id, 2)
+    await client.post(f"/posts/{liked}/rate", params={"score": 5}, headers=headers)
+
+    posts = (await client.get("/posts/", params={"sort": sort})).json()["posts"]
+
+    assert [p["post_id"] for p in posts] == [str(liked), str(quiet)]
+
+
+async def test_leaderboard(client):
+    headers, user_id = await signup(client, "alice")
+    other, _ = await signup(client, "bob")
+    low, high = await add_posts(user_id, 2)
+    for voter in (headers, other):
+        await client.post(f"/posts/{low}/rate", params={"score": 2}, headers=voter)
+        await client.post(f"/posts/{high}/rate", params={"score": 5}, headers=voter)
+
+    board = (await client.get("/posts/leaderboard")).json()
+
+    assert [p["post_id"] for p in board] == [str(high), str(low)]
+    assert board[0]["vote_count"] == 2
+
+
+async def test_owner_fields_are_never_null(client):
+    _, user_id = await signup(client, "alice")
+    [post_id] = await add_posts(user_id, 1)
+    #a post from before author snapshots were backfilled
+    async with SessionLocal() as session:
+        await session.execute(update(Posts).values(author_profile_type=None, author_organization=None, author_headline=None))
+        await session.commit()
+
+    [post] = (await client.get("/posts/")).json()["posts"]
+
+    assert post["post_id"] == str(post_id)
+    assert post["owner"] == {"username": "author", "profile_type": "", "organization": "", "headline": ""}
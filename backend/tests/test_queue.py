@@ -0,0 +1,45 @@
+import pytest
+
+from app import queue
+from conftest import add_posts, signup
+from data.db import Rating, SessionLocal
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_queue_skips_own_and_rated_posts(client):
+    author, author_id = await signup(client, "alice")
+    voter, _ = await signup(client, "bob")
+    post_ids = await add_posts(author_id, 6)
+    await client.post(f"/posts/{post_ids[0]}/rate", params={"score": 3}, headers=voter)
+
+    queued = {p["post_id"] for p in (await client.get("/posts/queue", headers=voter)).json()}
+
+    assert queued == {str(post_id) for post_id in post_ids[1:]}
+    assert (await client.get("/posts/queue", headers=author)).json() == []
+
+
+async def test_queue_excludes_what_the_client_holds(client):
+    _, author_id = await signup(client, "alice")
+    voter, _ = await signup(client, "bob")
+    post_ids = await add_posts(author_id, 4)
+
+    queued = (await client.get("/posts/queue", headers=voter, params={"exclude": [str(p) for p in post_ids[:3]]})).json()
+
+    assert [p["post_id"] for p in queued] == [str(post_ids[3])]
+
+
+async def test_queue_finds_the_last_unrated_posts(client, monkeypatch):
+    #a heavy voter: every random candidate is already rated, only the fallback scan finds the rest
+    monkeypatch.setattr(queue, "POOL_SIZE", 5)
+    _, author_id = await signup(client, "alice")
+    voter, voter_id = await signup(client, "bob")
+    post_ids = await add_posts(author_id, 200)
+    unrated = set(post_ids[::50])
+    async with SessionLocal() as session:
+        session.add_all(Rating(user_id=voter_id, post_id=post_id, score=3) for post_id in post_ids if post_id not in unrated)
+        await session.commit()
+
+    for _ in range(5):
+        queued = {p["post_id"] for p in (await client.get("/posts/queue", headers=voter)).json()}
+        assert queued and queued <= {str(post_id) for post_id in unrated}
@@ -0,0 +1,42 @@
+import pytest
+
+from conftest import comment, signup, upload
+
+pytestmark = pytest.mark.anyio
+
+
+async def _search(client, q) -> list[str]:
+    response = await client.get("/posts/search", params={"q": q})
+    assert response.status_code == 200, response.text
+    return [p["post_id"] for p in response.json()["posts"]]
+
+
+async def test_search_captions_and_comments(client):
+    headers, _ = await signup(client, "alice")
+    backend = await upload(client, headers, caption="backend engineer resume")
+    design = await upload(client, headers, caption="product designer portfolio")
+    await comment(client, headers, design["post_id"], "great kubernetes experience")
+
+    assert await _search(client, "backend") == [backend["post_id"]]
+    assert await _search(client, "kubernetes") == [design["post_id"]]
+    assert await _search(client, "nothing matches this") == []
+
+
+async def test_caption_ranks_above_comment(client):
+    headers, _ = await signup(client, "alice")
+    in_comment = await upload(client, headers, caption="first resume")
+    in_caption = await upload(client, headers, caption="python developer")
+    await comment(client, headers, in_comment["post_id"], "learn python")
+
+    assert await _search(client, "python") == [in_caption["post_id"], in_comment["post_id"]]
+
+
+async def test_deleted_comment_leaves_search(client):
+    headers, _ = await signup(client, "alice")
+    post = await upload(client, headers, caption="resume")
+    note = await comment(client, headers, post["post_id"], "mentions terraform")
+    assert await _search(client, "terraform") == [post["post_id"]]
+
+    await client.delete(f"/comments/{note['id']}", headers=headers)
+
+    assert await _search(client, "terraform") == []
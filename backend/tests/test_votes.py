@@ -0,0 +1,93 @@
+import pytest
+from sqlalchemy import func, select
+
+from conftest import add_posts, signup
+from data.db import Posts, Rating, SessionLocal
+
+pytestmark = pytest.mark.anyio
+
+
+async def _summary(client, post_id) -> dict:
+    response = await client.get(f"/posts/{post_id}/ratings")
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_vote(client):
+    headers, user_id = await signup(client, "alice")
+    [post_id] = await add_posts(user_id, 1)
+
+    response = await client.post(f"/posts/{post_id}/rate", params={"score": 4}, headers=headers)
+
+    assert response.status_code == 201, response.text
+    summary = await _summary(client, post_id)
+    assert summary["vote_count"] == 1
+    assert summary["average_rating"] == 4.0
+    assert summary["histogram"] == {"1": 0, "2": 0, "3": 0, "4": 1, "5": 0}
+
+
+async def test_duplicate_vote_is_rejected(client):
+    headers, user_id = await signup(client, "alice")
+    [post_id] = await add_posts(user_id, 1)
+    await client.post(f"/posts/{post_id}/rate", params={"score": 4}, headers=headers)
+
+    response = await client.post(f"/posts/{post_id}/rate", params={"score": 1}, headers=headers)
+
+    assert response.status_code == 400
+    summary = await _summary(client, post_id)
+    assert summary["vote_count"] == 1
+    assert summary["average_rating"] == 4.0
+
+
+async def test_vote_on_missing_post(client):
+    headers, user_id = await signup(client, "alice")
+
+    response = await client.post(f"/posts/{user_id}/rate", params={"score": 4}, headers=headers)
+
+    assert response.status_code == 404
+
+
+async def test_vote_batch(client):
+    headers, user_id = await signup(client, "alice")
+    first, second, third = await add_posts(user_id, 3)
+    await client.post(f"/posts/{first}/rate", params={"score": 2}, headers=headers)
+
+    response = await client.post("/posts/votes", headers=headers, json={"votes": [
+        {"post_id": str(first), "score": 5},
+        {"post_id": str(second), "score": 5},
+        {"post_id": str(third), "score": 3},
+        {"post_id": str(second), "score": 1}, #a repeat in the same batch, the first one counts
+    ]})
+
+    assert response.status_code == 201, response.text
+    assert response.json() == {"accepted": [str(second), str(third)], "already_voted": [str(first)]}
+    assert (await _summary(client, first))["average_rating"] == 2.0
+    assert (await _summary(client, second))["average_rating"] == 5.0
+    assert (await _summary(client, third))["average_rating"] == 3.0
+
+
+async def test_change_and_retract_vote(client):
+    headers, user_id = await signup(client, "alice")
+    other, _ = await signup(client, "bob")
+    [post_id] = await add_posts(user_id, 1)
+    await client.post(f"/posts/{post_id}/rate", params={"score": 2}, headers=headers)
+    await client.post(f"/posts/{post_id}/rate", params={"score": 4}, headers=other)
+
+    assert (await client.put(f"/posts/{post_id}/rate", params={"score": 5}, headers=headers)).status_code == 200
+    summary = await _summary(client, post_id)
+    assert summary["average_rating"] == 4.5
+    assert summary["histogram"] == {"1": 0, "2": 0, "3": 0, "4": 1, "5": 1}
+
+    assert (await client.delete(f"/posts/{post_id}/rate", headers=other)).status_code == 200
+    assert (await client.delete(f"/posts/{post_id}/rate", headers=other)).status_code == 404
+    summary = await _summary(client, post_id)
+    assert summary["vote_count"] == 1
+    assert summary["average_rating"] == 5.0
+
+    #the stored aggregates agree with a recount of the ratings
+    async with SessionLocal() as session:
+        post = await session.get(Posts, post_id)
+        count, total = (await session.execute(
+            select(func.count(), func.sum(Rating.score)).where(Rating.post_id == post_id)
+        )).one()
+    assert (post.vote_count, post.rating_sum) == (count, total)
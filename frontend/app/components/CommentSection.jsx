@@ -4,6 +4,7 @@ import { useEffect, useMemo, useRef, useState } from "react";
 import Link from "next/link";
 import { toast } from "sonner";
 import { getAuthUser } from "../auth";
+import { subscribeLive } from "../live";
 
 const formatTimestamp = (value) => {
   const date = value ? new Date(value) : new Date();
@@ -33,6 +34,7 @@ export default function CommentSection({
   token,
   onCountChange,
   layout = "default",
+  preloaded = null,
 }) {
   const [comments, setComments] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -75,6 +77,14 @@ export default function CommentSection({
 
   const rootComments = commentsByParent.get("root") || [];
 
+  const normalizeComments = (data) => {
+    const fallbackTimestamp = new Date().toISOString();
+    return (Array.isArray(data) ? data : []).map((comment) => ({
+      ...comment,
+      created_at: comment.created_at || fallbackTimestamp,
+    }));
+  };
+
   const loadComments = async () => {
     setLoading(true);
     try {
@@ -83,12 +93,7 @@ export default function CommentSection({
         throw new Error("Failed to load comments.");
       }
       const data = await response.json();
-      const fallbackTimestamp = new Date().toISOString();
-      const normalized = (Array.isArray(data) ? data : []).map((comment) => ({
-        ...comment,
-        created_at: comment.created_at || fallbackTimestamp,
-      }));
-      setComments(normalized);
+      setComments(normalizeComments(data));
     } catch (error) {
       toast.error("Could not load comments.");
     } finally {
@@ -97,10 +102,33 @@ export default function CommentSection({
   };
 
   useEffect(() => {
+    // A page that fetched /posts/activity already has the first comments; only a longer thread needs its own request.
+    const comments = preloaded?.comments;
+    if (Array.isArray(comments) && comments.length >= (preloaded.comment_count ?? 0)) {
+      setComments(normalizeComments(comments));
+      setLoading(false);
+      return;
+    }
     loadComments();
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [postId]);
 
+  useEffect(() => {
+    if (!postId) {
+      return undefined;
+    }
+    return subscribeLive(`${apiBase}/live/posts/${postId}`, {
+      comment_created: (comment) =>
+        setComments((prev) =>
+          prev.some((item) => item.id === comment.id) ? prev : [comment, ...prev]
+        ),
+      comment_deleted: ({ id }) =>
+        setComments((prev) => prev.filter((item) => item.id !== id)),
+      resync: () => loadComments(),
+    });
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [apiBase, postId]);
+
   useEffect(() => {
     setBody("");
     setReplyTo(null);
@@ -5,6 +5,7 @@ import Link from "next/link";
 import { Medal, Star, Trophy } from "lucide-react";
 import { toast } from "sonner";
 import { DEFAULT_API_URL } from "../auth";
+import { subscribeLive } from "../live";
 
 const formatRating = (value) => {
   if (typeof value !== "number") {
@@ -132,6 +133,31 @@ export default function Leaderboard() {
     loadLeaderboard();
   }, []);
 
+  useEffect(() => {
+    return subscribeLive(`${DEFAULT_API_URL}/live/leaderboard`, {
+      vote: (totals) =>
+        setPosts((prev) => {
+          if (!prev.some((post) => post.post_id === totals.post_id)) {
+            return prev;
+          }
+          // same order as the server: rank score, then vote count
+          return prev
+            .map((post) =>
+              post.post_id === totals.post_id ? { ...post, ...totals } : post
+            )
+            .sort(
+              (a, b) =>
+                (b.rank_score ?? 0) - (a.rank_score ?? 0) ||
+                (b.vote_count ?? 0) - (a.vote_count ?? 0)
+            );
+        }),
+      post_deleted: ({ post_id }) =>
+        setPosts((prev) => prev.filter((post) => post.post_id !== post_id)),
+      resync: () => loadLeaderboard(),
+    });
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, []);
+
   if (loading) {
     return (
       <div className="card px-5 py-6 text-sm text-muted-foreground">
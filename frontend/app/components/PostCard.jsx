@@ -124,6 +124,7 @@ export default function PostCard({
   showRatingStats = false,
   rank = null,
   compact = false,
+  activity = null,
 }) {
   const [commentCount, setCommentCount] = useState(null);
   const [showPreview, setShowPreview] = useState(!compact);
@@ -147,7 +148,7 @@ export default function PostCard({
   const ownerMeta = [postHeadline, postOrganization].filter(Boolean).join(" • ");
   const canDelete =
     token && currentUsername && postOwnerName && postOwnerName === currentUsername;
-  const safeCount = commentCount ?? 0;
+  const safeCount = commentCount ?? activity?.comment_count ?? 0;
   const commentLabel = safeCount === 1 ? "1 comment" : `${safeCount} comments`;
   const rankLabel = typeof rank === "number" ? `Rank #${rank}` : "";
   const showComments = compact ? showPreview : true;
@@ -359,6 +360,7 @@ export default function PostCard({
             apiBase={apiBase}
             token={token}
             onCountChange={setCommentCount}
+            preloaded={activity}
           />
         ) : (
           <div className="flex items-center justify-between rounded-lg border border-dashed border-border bg-muted px-4 py-3 text-sm text-muted-foreground">
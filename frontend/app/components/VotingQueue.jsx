@@ -1,13 +1,17 @@
 "use client";
 
-import { useEffect, useMemo, useState } from "react";
+import { useEffect, useMemo, useRef, useState } from "react";
 import Link from "next/link";
 import { useRouter } from "next/navigation";
 import { Star } from "lucide-react";
 import { toast } from "sonner";
 import { DEFAULT_API_URL, getToken, onAuthChange, validateSession } from "../auth";
+import { subscribeLive } from "../live";
 
 const ratingOptions = [1, 2, 3, 4, 5];
+// votes go out together through POST /posts/votes: after this many, or this long after the first one
+const VOTE_BATCH_SIZE = 10;
+const VOTE_FLUSH_MS = 3000;
 
 const appendPdfControls = (fileUrl) => {
   if (!fileUrl) {
@@ -125,6 +129,8 @@ export default function VotingQueue() {
   const [token, setToken] = useState("");
   const [hoverScore, setHoverScore] = useState(0);
   const [previewImageFailed, setPreviewImageFailed] = useState(false);
+  const pendingVotes = useRef([]);
+  const flushTimer = useRef(null);
   const router = useRouter();
 
   const apiBase = useMemo(() => DEFAULT_API_URL, []);
@@ -185,7 +191,70 @@ export default function VotingQueue() {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [token]);
 
-  const handleRate = async (score) => {
+  useEffect(() => {
+    // a resume deleted while it waits in the queue can no longer be rated
+    return subscribeLive(`${apiBase}/live/posts`, {
+      post_deleted: ({ post_id }) => {
+        setQueue((prev) => prev.filter((post) => post.post_id !== post_id));
+        pendingVotes.current = pendingVotes.current.filter(
+          (vote) => vote.post.post_id !== post_id
+        );
+      },
+    });
+  }, [apiBase]);
+
+  const flushVotes = (authToken, { keepalive = false } = {}) => {
+    window.clearTimeout(flushTimer.current);
+    flushTimer.current = null;
+    const batch = pendingVotes.current;
+    pendingVotes.current = [];
+    if (!batch.length || !authToken) {
+      return;
+    }
+
+    fetch(`${apiBase}/posts/votes`, {
+      method: "POST",
+      // still delivered when the tab is closing
+      keepalive,
+      headers: {
+        Authorization: `Bearer ${authToken}`,
+        "Content-Type": "application/json",
+      },
+      body: JSON.stringify({
+        votes: batch.map(({ post, score }) => ({ post_id: post.post_id, score })),
+      }),
+    })
+      .then(async (response) => {
+        if (!response.ok) {
+          const text = await response.text();
+          throw new Error(text || "Rating failed.");
+        }
+      })
+      .catch(() => {
+        toast.error("Could not submit ratings.");
+        setQueue((prev) => [...batch.map(({ post }) => post), ...prev]);
+      });
+  };
+
+  useEffect(() => {
+    if (!token) {
+      return;
+    }
+    // send what is buffered before the page goes away or the user signs out
+    const flushWhenHidden = () => {
+      if (document.visibilityState === "hidden") {
+        flushVotes(token, { keepalive: true });
+      }
+    };
+    document.addEventListener("visibilitychange", flushWhenHidden);
+    return () => {
+      document.removeEventListener("visibilitychange", flushWhenHidden);
+      flushVotes(token, { keepalive: true });
+    };
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [token]);
+
+  const handleRate = (score) => {
     if (!token) {
       toast.error("Sign in to rate resumes.");
       router.push("/login");
@@ -198,25 +267,13 @@ export default function VotingQueue() {
     }
 
     setQueue((prev) => prev.slice(1));
+    pendingVotes.current.push({ post: current, score });
 
-    try {
-      const response = await fetch(
-        `${apiBase}/posts/${current.post_id}/rate?score=${score}`,
-        {
-          method: "POST",
-          headers: {
-            Authorization: `Bearer ${token}`,
-          },
-        }
-      );
-
-      if (!response.ok) {
-        const text = await response.text();
-        throw new Error(text || "Rating failed.");
-      }
-    } catch (error) {
-      toast.error("Could not submit rating.");
-      setQueue((prev) => [current, ...prev]);
+    // the last card goes out right away, "all caught up" should mean the votes are in
+    if (pendingVotes.current.length >= VOTE_BATCH_SIZE || queue.length === 1) {
+      flushVotes(token);
+    } else if (!flushTimer.current) {
+      flushTimer.current = window.setTimeout(() => flushVotes(token), VOTE_FLUSH_MS);
     }
   };
 
@@ -7,9 +7,19 @@ import { toast } from "sonner";
 import { DEFAULT_API_URL, getToken, onAuthChange, validateSession } from "../auth";
 import ReviewModal from "../components/ReviewModal";
 
+// The backend keeps each ordering indexed, "hot" is recent posts gaining votes and comments.
+const SORTS = [
+  { value: "hot", label: "Hot" },
+  { value: "new", label: "New" },
+  { value: "top", label: "Top" },
+];
+
 export default function FeedPage() {
   const [posts, setPosts] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [sort, setSort] = useState("hot");
+  const [loadingMore, setLoadingMore] = useState(false);
   const [token, setToken] = useState("");
   const [activeIndex, setActiveIndex] = useState(null);
   const lastUrlRef = useRef("");
@@ -151,16 +161,20 @@ export default function FeedPage() {
     });
   };
 
+  // Pages arrive in the server's order, only "new" can be re-sorted on the client.
+  const ordered = (items) => (sort === "new" ? sortByNewest(items) : items);
+
   const loadPosts = async () => {
     setLoading(true);
     try {
-      const response = await fetch(`${apiBase}/posts/`);
+      const response = await fetch(`${apiBase}/posts/?sort=${sort}`);
       if (!response.ok) {
         throw new Error("Failed to load posts.");
       }
       const data = await response.json();
-      const list = Array.isArray(data) ? data : [];
-      setPosts(sortByNewest(list));
+      const list = Array.isArray(data?.posts) ? data.posts : [];
+      setPosts(ordered(list));
+      setNextCursor(data?.next_cursor || null);
     } catch (error) {
       toast.error("Could not load the community.");
     } finally {
@@ -168,6 +182,29 @@ export default function FeedPage() {
     }
   };
 
+  const loadMorePosts = async () => {
+    if (!nextCursor || loadingMore) {
+      return;
+    }
+    setLoadingMore(true);
+    try {
+      const response = await fetch(
+        `${apiBase}/posts/?sort=${sort}&cursor=${encodeURIComponent(nextCursor)}`
+      );
+      if (!response.ok) {
+        throw new Error("Failed to load posts.");
+      }
+      const data = await response.json();
+      const list = Array.isArray(data?.posts) ? data.posts : [];
+      setPosts((prev) => ordered([...prev, ...list]));
+      setNextCursor(data?.next_cursor || null);
+    } catch (error) {
+      toast.error("Could not load more posts.");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   useEffect(() => {
     const sync = () => setToken(getToken());
     sync();
@@ -189,7 +226,7 @@ export default function FeedPage() {
   useEffect(() => {
     loadPosts();
     // eslint-disable-next-line react-hooks/exhaustive-deps
-  }, []);
+  }, [sort]);
 
   const getTargetIdFromLocation = () => {
     if (typeof window === "undefined") {
@@ -457,6 +494,22 @@ export default function FeedPage() {
           </p>
         </div>
         <div className="flex flex-wrap items-center gap-2 text-sm text-muted-foreground">
+          {SORTS.map((option) => (
+            <button
+              key={option.value}
+              className={[
+                "rounded-full px-4 py-2 text-sm transition border border-border",
+                sort === option.value
+                  ? "bg-muted text-foreground"
+                  : "text-muted-foreground hover:text-foreground hover:bg-muted",
+              ].join(" ")}
+              type="button"
+              aria-pressed={sort === option.value}
+              onClick={() => setSort(option.value)}
+            >
+              {option.label}
+            </button>
+          ))}
           <Link className="btn-primary" href="/upload">
             New post
           </Link>
@@ -486,6 +539,18 @@ export default function FeedPage() {
           ))}
         </div>
       )}
+      {!loading && nextCursor ? (
+        <div className="flex justify-center">
+          <button
+            className="btn-ghost"
+            type="button"
+            onClick={loadMorePosts}
+            disabled={loadingMore}
+          >
+            {loadingMore ? "Loading..." : "Load more"}
+          </button>
+        </div>
+      ) : null}
       {activePost ? (
         <ReviewModal
           post={activePost}
@@ -0,0 +1,23 @@
+const isBrowser = () => typeof window !== "undefined";
+
+// Opens a server-sent event stream from the backend's /live endpoints.
+// `handlers` maps event names (comment_created, vote, ...) to callbacks that get the parsed data.
+// `resync` fires when the server dropped us for falling behind: refetch, the stream reconnects by itself.
+export const subscribeLive = (url, handlers = {}) => {
+  if (!isBrowser() || typeof window.EventSource === "undefined") {
+    return () => {};
+  }
+
+  const source = new EventSource(url);
+  Object.entries(handlers).forEach(([event, handler]) => {
+    source.addEventListener(event, (message) => {
+      try {
+        handler(JSON.parse(message.data || "{}"));
+      } catch (error) {
+        // ignore malformed frames, the next refetch corrects the view
+      }
+    });
+  });
+
+  return () => source.close();
+};
@@ -12,6 +12,7 @@ export default function ProfilePage() {
   const [loading, setLoading] = useState(true);
   const [isEmpty, setIsEmpty] = useState(false);
   const [rankMap, setRankMap] = useState({});
+  const [activityMap, setActivityMap] = useState({});
 
   const apiBase = DEFAULT_API_URL;
 
@@ -42,8 +43,10 @@ export default function ProfilePage() {
       }
 
       const data = await response.json();
-      setPosts(Array.isArray(data) ? data : []);
-      setIsEmpty(Array.isArray(data) && data.length === 0);
+      const list = Array.isArray(data) ? data : [];
+      await loadActivity(list);
+      setPosts(list);
+      setIsEmpty(list.length === 0);
     } catch (error) {
       toast.error("Could not load your posts.");
     } finally {
@@ -51,6 +54,35 @@ export default function ProfilePage() {
     }
   };
 
+  // Comment counts and first comments for every card in one request, instead of one per card.
+  const loadActivity = async (list) => {
+    if (!list.length) {
+      setActivityMap({});
+      return;
+    }
+    try {
+      const params = new URLSearchParams();
+      list.forEach((post) => params.append("ids", post.post_id));
+      const response = await fetch(`${apiBase}/posts/activity?${params}`, {
+        headers: {
+          Authorization: `Bearer ${token}`,
+        },
+      });
+      if (!response.ok) {
+        throw new Error("Failed to load activity.");
+      }
+      const data = await response.json();
+      const nextMap = {};
+      (Array.isArray(data?.posts) ? data.posts : []).forEach((item) => {
+        nextMap[String(item.post_id)] = item;
+      });
+      setActivityMap(nextMap);
+    } catch (error) {
+      // the cards fetch their own comments without it
+      setActivityMap({});
+    }
+  };
+
   const loadLeaderboard = async () => {
     if (!token) {
       setRankMap({});
@@ -162,6 +194,7 @@ export default function ProfilePage() {
               onDeleted={handleDeleted}
               showRatingStats
               rank={rankMap[String(post.post_id)]}
+              activity={activityMap[String(post.post_id)]}
               compact
             />
           ))}